@@ -0,0 +1,303 @@
+"""Benchmark suite of the amptorch pipeline on EMT generated datasets:
+fingerprinting, preprocessing, collation, training steps and calculator
+latency, across system sizes and numbers of elements.
+
+Results are saved as JSON and may be compared against a stored baseline,
+reporting the benchmarks that regressed beyond a tolerance:
+
+    python -m amptorch.benchmarks --sizes 10 100 --elements 1 3 \\
+        --output results.json --baseline baseline.json
+
+The exit status is 1 if any benchmark regressed.
+"""
+
+import sys
+import json
+import time
+import argparse
+import platform
+import numpy as np
+import torch
+from ase.build import bulk
+from ase.calculators.emt import EMT
+from ase.calculators.calculator import all_changes
+from skorch import NeuralNetRegressor
+from amptorch.gaussian import SNN_Gaussian
+from amptorch.fp_simple_nn import make_amp_descriptors_simple_nn
+from amptorch.data_preprocess import AtomsDataset, collate_amp
+from amptorch.model import FullNN, CustomMSELoss
+from amptorch.profiling import profiler
+
+# elements parameterized by ASE's EMT, in order of inclusion
+EMT_ELEMENTS = ["Cu", "Ag", "Au", "Ni", "Pd", "Pt", "Al"]
+
+DEFAULT_GS = {
+    "G2_etas": [0.05, 0.5, 5.0],
+    "G2_rs_s": [0] * 3,
+    "G4_etas": [0.005],
+    "G4_zetas": [1.0],
+    "G4_gammas": [+1.0, -1],
+    "cutoff": 6.0,
+}
+
+
+def make_emt_dataset(num_images, num_atoms, num_elements, seed=0):
+    """Generates num_images random alloy clusters of num_atoms atoms of
+    num_elements elements, cut from a rattled fcc lattice, labeled with EMT.
+    Datasets are reproducible for a given seed."""
+    if not 1 <= num_elements <= len(EMT_ELEMENTS):
+        raise ValueError(
+            "num_elements must be between 1 and {}.".format(len(EMT_ELEMENTS))
+        )
+    random_state = np.random.RandomState(seed)
+    repeats = int(np.ceil((num_atoms / 4.0) ** (1.0 / 3.0))) + 1
+    lattice = bulk("Cu", "fcc", a=3.6, cubic=True).repeat(repeats)
+    distances = np.linalg.norm(
+        lattice.positions - lattice.positions.mean(axis=0), axis=1
+    )
+    # the num_atoms lattice sites closest to the center
+    cluster = lattice[np.argsort(distances, kind="stable")[:num_atoms]]
+    cluster.set_pbc(False)
+    cluster.center(vacuum=6.0)
+    images = []
+    for _ in range(num_images):
+        image = cluster.copy()
+        symbols = list(EMT_ELEMENTS[:num_elements])
+        symbols += list(
+            random_state.choice(EMT_ELEMENTS[:num_elements], num_atoms - num_elements)
+        )
+        image.set_chemical_symbols(random_state.permutation(symbols)[:num_atoms])
+        image.positions += random_state.normal(scale=0.05, size=(num_atoms, 3))
+        image.set_calculator(EMT())
+        image.get_potential_energy()
+        image.get_forces()
+        images.append(image)
+    return images
+
+
+def best_time(function, repeats):
+    """Shortest wall time in seconds of repeats calls of function."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_benchmarks(
+    sizes=(10, 100, 1000),
+    elements=(1, 3, 5),
+    num_images=10,
+    batch_size=5,
+    Gs=None,
+    repeats=3,
+    label="benchmark",
+    seed=0,
+):
+    """Runs the benchmarks for every combination of system size and number
+    of elements.
+
+    Returns a dictionary of run metadata and "results", a list of records
+    with the benchmark name, system, value, unit and whether higher values
+    are better:
+
+    - fingerprints: atomic fingerprints (with derivatives) per second
+    - preprocess: images preprocessed per second by AtomsDataset
+    - collate: milliseconds per collate_amp batch
+    - train_step: milliseconds per forward, backward and optimizer step
+    - calculate: milliseconds per AMP.calculate of one image
+    """
+    from amptorch.skorch_model import AMP
+
+    Gs = DEFAULT_GS if Gs is None else Gs
+    results = []
+
+    def record(name, num_atoms, num_elements, value, unit, higher_is_better):
+        results.append(
+            {
+                "benchmark": name,
+                "num_atoms": num_atoms,
+                "num_elements": num_elements,
+                "value": value,
+                "unit": unit,
+                "higher_is_better": higher_is_better,
+            }
+        )
+        print(
+            "%-12s %6i atoms %2i elements %14.4f %s"
+            % (name, num_atoms, num_elements, value, unit)
+        )
+
+    for num_atoms in sizes:
+        for num_elements in elements:
+            if num_elements > num_atoms:
+                continue
+            system_label = "{}-{}-{}".format(label, num_atoms, num_elements)
+            images = make_emt_dataset(num_images, num_atoms, num_elements, seed=seed)
+            symbols = EMT_ELEMENTS[:num_elements]
+
+            seconds = best_time(
+                lambda: make_amp_descriptors_simple_nn(
+                    images, Gs, symbols, forcetraining=True, cores=1,
+                    label=system_label, save=False,
+                ),
+                repeats,
+            )
+            record(
+                "fingerprints", num_atoms, num_elements,
+                num_images * num_atoms / seconds, "fps/s", True,
+            )
+
+            make_amp_descriptors_simple_nn(
+                images, Gs, symbols, forcetraining=True, cores=1,
+                label=system_label, save=True,
+            )
+            profiler.reset()
+            profiler.enable()
+            try:
+                training_data = AtomsDataset(
+                    images, SNN_Gaussian, Gs, forcetraining=True,
+                    label=system_label, cores=1,
+                )
+            finally:
+                profiler.disable()
+            seconds = profiler.summary()["preprocess_data"]["total"]
+            profiler.reset()
+            record(
+                "preprocess", num_atoms, num_elements,
+                len(training_data) / seconds, "images/s", True,
+            )
+
+            items = [training_data[i] for i in range(min(batch_size, len(training_data)))]
+            seconds = best_time(lambda: collate_amp(items), repeats)
+            record("collate", num_atoms, num_elements, 1e3 * seconds, "ms", False)
+
+            torch.manual_seed(seed)
+            model = FullNN(
+                training_data.elements, [training_data.fp_length, 3, 10], "cpu",
+                forcetraining=True,
+            )
+            criterion = CustomMSELoss(force_coefficient=0.04)
+            optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+            batch = collate_amp(items)
+
+            def train_step():
+                optimizer.zero_grad()
+                loss = criterion(model(batch[0]), batch[1])
+                loss.backward()
+                optimizer.step()
+
+            seconds = best_time(train_step, repeats)
+            record("train_step", num_atoms, num_elements, 1e3 * seconds, "ms", False)
+
+            net = NeuralNetRegressor(
+                module=model,
+                criterion=CustomMSELoss,
+                criterion__force_coefficient=0.04,
+                iterator_train__collate_fn=collate_amp,
+                iterator_train__shuffle=False,
+                train_split=0,
+                verbose=0,
+            )
+            net.initialize()
+            calc = AMP(training_data, net, system_label, save_logs=False)
+            net.save_params(f_params=calc.label)
+            image = images[0].copy()
+            seconds = best_time(
+                lambda: calc.calculate(image, ["energy", "forces"], all_changes),
+                repeats,
+            )
+            record("calculate", num_atoms, num_elements, 1e3 * seconds, "ms", False)
+
+    return {
+        "metadata": {
+            "date": time.asctime(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "num_images": num_images,
+            "batch_size": batch_size,
+            "repeats": repeats,
+            "seed": seed,
+            # symmetry function parameters may be numpy arrays
+            "Gs": json.loads(json.dumps(Gs, default=lambda value: value.tolist())),
+        },
+        "results": results,
+    }
+
+
+def save_results(results, filename):
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def compare_results(results, baseline, tolerance=0.2):
+    """Compares benchmark results against baseline results, as returned by
+    run_benchmarks. A benchmark regressed if its value is worse than that
+    of the baseline, for the same system, by more than a fraction tolerance.
+
+    Returns a list of (record, baseline value, relative change) of the
+    regressed benchmarks, where the change is positive for improvements."""
+    key = lambda record: (
+        record["benchmark"], record["num_atoms"], record["num_elements"]
+    )
+    baseline_values = {key(record): record["value"] for record in baseline["results"]}
+    regressions = []
+    for record in results["results"]:
+        if key(record) not in baseline_values:
+            continue
+        reference = baseline_values[key(record)]
+        change = (record["value"] - reference) / reference
+        if not record["higher_is_better"]:
+            change = -change
+        if change < -tolerance:
+            regressions.append((record, reference, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--elements", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(
+        sizes=args.sizes,
+        elements=args.elements,
+        num_images=args.images,
+        batch_size=args.batch_size,
+        repeats=args.repeats,
+        seed=args.seed,
+    )
+    save_results(results, args.output)
+    if args.baseline is None:
+        return 0
+    regressions = compare_results(
+        results, load_results(args.baseline), tolerance=args.tolerance
+    )
+    for record, reference, change in regressions:
+        print(
+            "Regression: %s (%i atoms, %i elements) %.4f %s vs. baseline %.4f (%+.1f%%)"
+            % (
+                record["benchmark"], record["num_atoms"], record["num_elements"],
+                record["value"], record["unit"], reference, 100 * change,
+            )
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""Compressed storage of fingerprintprimes. The sparse matrices are stored in
+CSR order with delta-encoded column indices: the first column of every row,
+then the differences between consecutive columns of the row, held in the
+smallest unsigned integer type that fits them, alongside per row entry
+counts. Values are stored as is or quantized to 16-bit integers with one
+scale per block of consecutive values.
+
+Quantization perturbs every value by at most half its block's scale. Its
+effect on the forces, -fprimes^T dE/dFP, is bounded by prime_error_bound,
+which compress_fingerprintprimes validates against a tolerance.
+"""
+
+import numpy as np
+import torch
+
+
+def smallest_uint(max_value):
+    """Smallest unsigned integer dtype holding values up to max_value."""
+    for dtype in [np.uint8, np.uint16, np.uint32]:
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def prime_error_bound(fingerprintprimes, approximation):
+    """Relative bound of the force error due to approximated
+    fingerprintprimes: the largest absolute column sum of their difference
+    over the largest absolute column sum of the fingerprintprimes. Every
+    force component's error is within this fraction of the largest force
+    magnitude attainable with the same bounded fingerprint gradients."""
+    difference = (
+        fingerprintprimes.to(torch.float64) - approximation.to(torch.float64)
+    ).coalesce()
+    primes = fingerprintprimes.to(torch.float64).coalesce()
+    num_columns = fingerprintprimes.shape[1]
+
+    def max_column_sum(matrix):
+        if matrix._nnz() == 0:
+            return 0.0
+        return np.bincount(
+            matrix.indices()[1].numpy(),
+            weights=np.abs(matrix.values().numpy()),
+            minlength=num_columns,
+        ).max()
+
+    norm = max_column_sum(primes)
+    if norm == 0:
+        return 0.0
+    return max_column_sum(difference) / norm
+
+
+def compress_fingerprintprimes(
+    fingerprintprimes, quantize=False, block_size=64, tolerance=None
+):
+    """Compresses a sparse fingerprintprimes tensor into a dictionary of
+    numpy arrays, see decompress_fingerprintprimes.
+
+    Parameters
+    ----------
+    quantize : bool
+        Quantize the values to int16, with one float32 scale per block of
+        block_size values.
+    tolerance : float
+        If provided, quantized values whose prime_error_bound exceeds
+        tolerance are stored unquantized instead.
+    """
+    fingerprintprimes = fingerprintprimes.coalesce()
+    num_rows, num_columns = fingerprintprimes.shape
+    rows, columns = fingerprintprimes.indices().numpy()
+    values = fingerprintprimes.values()
+    # coalesced indices are in row major order, with increasing columns
+    counts = np.bincount(rows, minlength=num_rows)
+    starts = (np.cumsum(counts) - counts)[counts > 0]
+    deltas = np.diff(columns, prepend=0)
+    deltas[starts] = columns[starts]
+    data = {
+        "shape": np.array([num_rows, num_columns], dtype=np.int64),
+        "counts": counts.astype(smallest_uint(counts.max(initial=0))),
+        "deltas": deltas.astype(smallest_uint(deltas.max(initial=0))),
+    }
+    if quantize:
+        blocks = np.zeros(-(-len(values) // block_size) * block_size)
+        blocks[: len(values)] = values.double().numpy()
+        blocks = blocks.reshape(-1, block_size)
+        scales = np.abs(blocks).max(axis=1) / np.iinfo(np.int16).max
+        scales[scales == 0] = 1.0
+        scales = scales.astype(np.float32)
+        quantized = dict(
+            data,
+            values=np.rint(blocks / scales[:, None]).astype(np.int16).reshape(-1)[
+                : len(values)
+            ],
+            scales=scales,
+            block_size=np.array(block_size),
+        )
+        if tolerance is None or (
+            prime_error_bound(
+                fingerprintprimes, decompress_fingerprintprimes(quantized)
+            )
+            <= tolerance
+        ):
+            return quantized
+    if values.dtype == torch.bfloat16:
+        data["values"] = values.view(torch.int16).numpy()
+        data["bfloat16"] = np.array(True)
+    else:
+        data["values"] = values.numpy()
+    return data
+
+
+def decompress_fingerprintprimes(data, dtype=None):
+    """Decodes the arrays of compress_fingerprintprimes into a sparse COO
+    tensor of values of dtype (their stored dtype if None)."""
+    num_rows, num_columns = (int(size) for size in data["shape"])
+    counts = data["counts"].astype(np.int64)
+    deltas = data["deltas"].astype(np.int64)
+    cumulative = np.cumsum(deltas)
+    # the first delta of every row is its absolute first column
+    nonempty = counts > 0
+    starts = (np.cumsum(counts) - counts)[nonempty]
+    offsets = np.repeat(cumulative[starts] - deltas[starts], counts[nonempty])
+    indices = np.stack(
+        (np.repeat(np.arange(num_rows), counts), cumulative - offsets)
+    )
+    values = np.asarray(data["values"])
+    if "scales" in data:
+        scales = np.repeat(data["scales"], int(data["block_size"]))[: len(values)]
+        values = torch.from_numpy(values.astype(np.float32) * scales)
+    elif "bfloat16" in data:
+        values = torch.from_numpy(values).view(torch.bfloat16)
+    else:
+        values = torch.from_numpy(values)
+    if dtype is not None:
+        values = values.to(dtype)
+    return torch.sparse_coo_tensor(
+        torch.from_numpy(indices), values, (num_rows, num_columns)
+    )
+
+
+def save_compressed_fingerprintprimes(path, fingerprintprimes, **kwargs):
+    """Stores fingerprintprimes compressed by compress_fingerprintprimes, to
+    which kwargs are passed, as '<path>.npz'."""
+    np.savez(path + ".npz", **compress_fingerprintprimes(fingerprintprimes, **kwargs))
+
+
+def load_compressed_fingerprintprimes(path, dtype=None):
+    """Loads fingerprintprimes stored by save_compressed_fingerprintprimes."""
+    with np.load(path + ".npz") as data:
+        return decompress_fingerprintprimes(data, dtype)
@@ -7,18 +7,28 @@ import sys
 import time
 import copy
 import os
+import hashlib
+import queue
+import threading
 import numpy as np
 import torch
-from torch.utils.data import Dataset, SubsetRandomSampler
-import scipy.sparse as sparse
+from torch.utils.data import DataLoader, Dataset, Sampler, Subset, SubsetRandomSampler
 from collections import OrderedDict
 import ase
 from amptorch.gaussian import make_symmetry_functions, SNN_Gaussian
-from amptorch.fp_simple_nn import make_amp_descriptors_simple_nn
+from amptorch.fp_simple_nn import make_amp_descriptors_simple_nn, neighbor_species
 from amptorch.data_utils import Transform
+from amptorch.subsampling import subsample_points
+from amptorch.profiling import profiler, profiled
+from amptorch.precision import get_precision, numpy_dtype
+from amptorch.compression import (
+    save_compressed_fingerprintprimes,
+    load_compressed_fingerprintprimes,
+)
 from amptorch.utils import (
     calculate_fingerprints_range,
     hash_images,
+    image_chunks,
     get_hash,
 )
 from amp.utilities import hash_images as amp_hash
@@ -37,13 +47,19 @@ class AtomsDataset(Dataset):
     Parameters:
     -----------
     images: list, file, database
-        Training data to be utilized for the regression model.
+        Training data to be utilized for the regression model. Duplicate
+        images are stored once and weighted by their multiplicity.
 
     descriptor: object
         Scheme to be utilized for computing fingerprints.
 
     Gs: object
         Symmetry function parameters to be used for hashing and fingerprinting.
+        An optional "species" entry restricts the symmetry functions of each
+        element to given neighbor elements and pairs (see
+        amptorch.fp_simple_nn.make_snn_params), or, if "auto", to those
+        occurring within the cutoff in images. Element networks then take
+        fingerprints of per element lengths.
 
     forcetraining: float
         Flag to specify whether force training is to be performed - dataset
@@ -60,8 +76,44 @@ class AtomsDataset(Dataset):
 
     store_primes: Boolean
         True to save fingerprintprimes matrices for faster preprocessing.
+        Primes are then kept on disk as uncompressed sparse index/value
+        arrays and memory-mapped per item rather than held in memory.
         Default: False
 
+    prefetch_size: int
+        Number of images whose fingerprints are read from disk in bulk at a
+        time during preprocessing. Default: 256
+
+    prune_tol: float
+        If provided, fingerprint columns of each element that are constant
+        (range below prune_tol) or duplicates of another column (scaled
+        values within prune_tol) are pruned from the fingerprints and
+        fingerprintprimes, reducing the element networks' input widths. The
+        kept columns are stored in fp_mask. Default: None, no pruning
+
+    precision: str
+        Precision policy of the stored fingerprints, targets and
+        fingerprintprimes, see amptorch.precision. Default: "float32"
+
+    compress_primes: str
+        Format of the fingerprintprimes stored with store_primes, see
+        amptorch.compression: "csr" for delta-encoded CSR indices and values
+        in the primes' dtype, or "int16" for values further quantized to
+        16-bit integers with per block scales. Default: None, uncompressed
+        index and value arrays
+
+    prime_tol: float
+        Tolerance of the relative force error bound of "int16" quantized
+        fingerprintprimes (see amptorch.compression.prime_error_bound).
+        Images exceeding it are stored unquantized. Default: 1e-3
+
+    chunk_size: int
+        If provided, images are streamed from their list, file or database
+        chunk_size at a time rather than read into memory at once. The
+        fingerprints of each chunk are calculated and stored before the
+        next is read, and only the hashes, energies and forces of the images
+        are kept rather than their ASE atoms objects. Default: None
+
 
     """
 
@@ -75,6 +127,12 @@ class AtomsDataset(Dataset):
         cores,
         delta_data=None,
         store_primes=False,
+        prefetch_size=256,
+        prune_tol=None,
+        precision="float32",
+        compress_primes=None,
+        prime_tol=1e-3,
+        chunk_size=None,
     ):
         self.images = images
         self.base_descriptor = descriptor
@@ -84,6 +142,17 @@ class AtomsDataset(Dataset):
         self.forcetraining = forcetraining
         self.label = label
         self.store_primes = store_primes
+        self.prefetch_size = prefetch_size
+        self.prune_tol = prune_tol
+        self.precision = get_precision(precision)
+        if compress_primes not in [None, "csr", "int16"]:
+            raise ValueError(
+                "Unknown prime compression: {}.".format(compress_primes)
+            )
+        self.compress_primes = compress_primes
+        self.prime_tol = prime_tol
+        self.chunk_size = chunk_size
+        self.fp_mask = None
         self.cores = cores
         self.delta = False
         if delta_data is not None:
@@ -95,11 +164,14 @@ class AtomsDataset(Dataset):
         if self.store_primes:
             if not os.path.isdir("./stored-primes/"):
                 os.mkdir("stored-primes")
-        if isinstance(images, str):
-            extension = os.path.splitext(images)[1]
-            if extension != (".traj" or ".db"):
-                self.atom_images = ase.io.read(images, ":")
+        if isinstance(images, str) and chunk_size is None:
+            self.atom_images = ase.io.read(images, ":")
         self.elements = self.unique()
+        if Gs.get("species") == "auto":
+            Gs = dict(
+                Gs, species=neighbor_species(self.iter_images(), Gs["cutoff"])
+            )
+            self.Gs = Gs
         # TODO Print log - control verbose
         print("Calculating fingerprints...")
         G2_etas = Gs["G2_etas"]
@@ -110,38 +182,159 @@ class AtomsDataset(Dataset):
         cutoff = Gs["cutoff"]
         # create simple_nn fingerprints
         if descriptor == SNN_Gaussian:
-            self.hashed_images = hash_images(self.atom_images, Gs=Gs)
+            if chunk_size is None:
+                self.hashed_images = hash_images(self.atom_images, Gs=Gs)
             # make_amp_descriptors_simple_nn(
             #     self.atom_images, Gs, self.elements, forcetraining=False, cores=cores, label=label, save=True
             # )
             self.isamp_hash = False
         else:
-            self.hashed_images = amp_hash(self.atom_images)
+            if chunk_size is None:
+                self.hashed_images = amp_hash(self.atom_images)
             self.isamp_hash = True
-        G = make_symmetry_functions(elements=self.elements, type="G2", etas=G2_etas)
-        G += make_symmetry_functions(
-            elements=self.elements,
-            type="G4",
-            etas=G4_etas,
-            zetas=G4_zetas,
-            gammas=G4_gammas,
-        )
-        for g in list(G):
-            g["Rs"] = G2_rs_s
+        species = Gs.get("species", {})
+        G = {}
+        for element in self.elements:
+            neighbors, pairs = self.elements, None
+            if element in species:
+                neighbors = species[element]["G2"]
+                pairs = species[element]["G4"]
+            G[element] = make_symmetry_functions(
+                elements=neighbors, type="G2", etas=G2_etas
+            )
+            G[element] += make_symmetry_functions(
+                elements=self.elements,
+                type="G4",
+                etas=G4_etas,
+                zetas=G4_zetas,
+                gammas=G4_gammas,
+                pairs=pairs,
+            )
+            for g in G[element]:
+                g["Rs"] = G2_rs_s
         self.descriptor = self.descriptor(Gs=G, cutoff=cutoff)
-        self.descriptor.calculate_fingerprints(
-            self.hashed_images, calculate_derivatives=forcetraining
-        )
+        if chunk_size is None:
+            self.descriptor.calculate_fingerprints(
+                self.hashed_images,
+                parallel=None if self.isamp_hash else {"cores": cores},
+                calculate_derivatives=forcetraining,
+            )
+            self.fprange = calculate_fingerprints_range(
+                self.descriptor, self.hashed_images
+            )
+        else:
+            self.fprange = self.stream_fingerprints()
         print("Fingerprints Calculated!")
-        self.fprange = calculate_fingerprints_range(self.descriptor, self.hashed_images)
         # perform preprocessing
         self.fingerprint_dataset, self.energy_dataset, self.num_of_atoms, self.sparse_fprimes, self.forces_dataset, self.index_hashes, self.scalings, self.rearange_forces = (
             self.preprocess_data()
         )
 
     def __len__(self):
-        return len(self.atom_images)
+        return len(self.index_hashes)
+
+    def __getstate__(self):
+        """Only the state used by __getitem__ is pickled, e.g. when the dataset
+        is sent to DataLoader workers started with spawn. The images, their
+        calculators and the fingerprint databases are left behind."""
+        state = self.__dict__.copy()
+        for key in [
+            "images",
+            "atom_images",
+            "hashed_images",
+            "targets",
+            "descriptor",
+            "delta_data",
+        ]:
+            state.pop(key, None)
+        return state
+
+    def share_memory(self):
+        """Moves the preprocessed tensors into shared memory, such that
+        DataLoader workers (num_workers > 0) access them without copying."""
+        self.energy_dataset.share_memory_()
+        self.image_weights.share_memory_()
+        for force in self.forces_dataset:
+            force.share_memory_()
+        for fprime in self.sparse_fprimes:
+            fprime._indices().share_memory_()
+            fprime._values().share_memory_()
+        return self
+
+    @profiled("stream_fingerprints")
+    def stream_fingerprints(self):
+        """Reads the images chunk_size at a time, calculating and storing the
+        fingerprints of each chunk. The hashes of all images are kept in
+        image_hashes, and the energies and forces of the unique images in
+        targets, such that the atoms objects of a chunk are released before
+        the next is read.
 
+        Returns the fingerprint range of the images."""
+        self.image_hashes = []
+        self.targets = {}
+        fprange = {}
+        for chunk in image_chunks(self.images, self.chunk_size):
+            if not self.isamp_hash:
+                make_amp_descriptors_simple_nn(
+                    chunk,
+                    self.Gs,
+                    self.elements,
+                    forcetraining=self.forcetraining,
+                    cores=self.cores,
+                    label=self.label,
+                    save=True,
+                )
+            hashed_images = {}
+            for atoms in chunk:
+                hash_name = self.image_hash(atoms)
+                self.image_hashes.append(hash_name)
+                if hash_name in self.targets:
+                    continue
+                hashed_images[hash_name] = atoms
+                forces = None
+                if self.forcetraining:
+                    forces = atoms.get_forces(apply_constraint=False)
+                self.targets[hash_name] = (
+                    atoms.get_potential_energy(apply_constraint=False),
+                    forces,
+                )
+            self.descriptor.calculate_fingerprints(
+                hashed_images,
+                parallel=None if self.isamp_hash else {"cores": self.cores},
+                calculate_derivatives=self.forcetraining,
+            )
+            calculate_fingerprints_range(self.descriptor, hashed_images, fprange)
+            profiler.count("images_streamed", len(chunk))
+        return fprange
+
+    def image_hash(self, atoms):
+        """Hash of an image under the dataset's hashing scheme."""
+        if self.isamp_hash:
+            return get_amp_hash(atoms)
+        return get_hash(atoms, self.Gs)
+
+    def image_targets(self, hash_name):
+        """Potential energy and forces (None without force training) of the
+        image of hash_name."""
+        if self.chunk_size is not None:
+            return self.targets[hash_name]
+        atoms = self.hashed_images[hash_name]
+        forces = None
+        if self.forcetraining:
+            forces = atoms.get_forces(apply_constraint=False)
+        return atoms.get_potential_energy(apply_constraint=False), forces
+
+    def iter_images(self):
+        """Iterates over the images, reading them lazily if streamed."""
+        if self.chunk_size is None:
+            return iter(self.atom_images)
+        return (
+            atoms
+            for chunk in image_chunks(self.images, self.chunk_size)
+            for atoms in chunk
+        )
+
+    @profiled("preprocess_data")
     def preprocess_data(self):
         # TODO cleanup/optimize
         fingerprint_dataset = []
@@ -149,118 +342,123 @@ class AtomsDataset(Dataset):
         energy_dataset = np.array([])
         num_of_atoms = np.array([])
         forces_dataset = []
-        index_hashes = []
-        # updated for 'update_descriptor' method as sub-feature for subsampling
-        if type(self.fp_length) is not int:
-            self.fp_length = self.fp_length()
         rearange_forces = {}
-        n = 0
-        for index, atoms_object in enumerate(self.atom_images):
-            if self.isamp_hash:
-                hash_name = get_amp_hash(atoms_object)
-            else:
-                hash_name = get_hash(atoms_object, self.Gs)
-            index_hashes.append(hash_name)
-            image_fingerprint = self.descriptor.fingerprints[hash_name]
+        if self.chunk_size is None:
+            image_hashes = [self.image_hash(atoms) for atoms in self.atom_images]
+        else:
+            image_hashes = self.image_hashes
+        # duplicate images are collapsed into a single sample, in order of
+        # first occurrence, weighted by their multiplicity in the losses
+        _, image_indices, image_weights = np.unique(
+            image_hashes, return_index=True, return_counts=True
+        )
+        order = np.argsort(image_indices)
+        self.image_indices = image_indices[order]
+        self.image_weights = torch.FloatTensor(image_weights[order])
+        index_hashes = [image_hashes[i] for i in self.image_indices]
+        if len(index_hashes) < len(image_hashes):
+            print(
+                "%i duplicate images collapsed into weighted samples."
+                % (len(image_hashes) - len(index_hashes))
+            )
+        if self.prune_tol is not None:
+            self.fp_mask = self.prune_fingerprints(index_hashes)
+        self.prime_key = self.prime_digest()
+        # updated for 'update_descriptor' method as sub-feature for subsampling
+        self.__dict__.pop("fp_length", None)
+        self.fp_length = self.fp_length()
+        fp_dtype = numpy_dtype(self.precision.fingerprints)
+        for index, hash_name in enumerate(index_hashes):
+            if index % self.prefetch_size == 0:
+                self.prefetch(index_hashes[index : index + self.prefetch_size])
+            # fingerprint scaling to [-1,1]
+            image_fingerprint = mask_fingerprints(
+                scale_fingerprints(
+                    self.descriptor.fingerprints[hash_name], self.fprange, fp_dtype
+                ),
+                self.fp_mask,
+            )
             n_atoms = float(len(image_fingerprint))
             num_of_atoms = np.append(num_of_atoms, n_atoms)
+            profiler.count("images_preprocessed")
+            profiler.count("atoms_preprocessed", int(n_atoms))
             fprange = self.fprange
-            atom_order = []
-            # fingerprint scaling to [-1,1]
-            for i, (atom, afp) in enumerate(image_fingerprint):
-                _afp = copy.copy(afp)
-                fprange_atom = np.array(fprange[atom])
-                for _ in range(np.shape(_afp)[0]):
-                    if (fprange_atom[_][1] - fprange_atom[_][0]) > (10.0 ** (-8.0)):
-                        _afp[_] = -1 + 2.0 * (
-                            (_afp[_] - fprange_atom[_][0])
-                            / (fprange_atom[_][1] - fprange_atom[_][0])
-                        )
-                image_fingerprint[i] = (atom, _afp)
-                atom_order.append(atom)
+            atom_order = [atom for atom, _ in image_fingerprint]
             fingerprint_dataset.append(image_fingerprint)
-            image_potential_energy = (
-                self.hashed_images[hash_name].get_potential_energy(
-                    apply_constraint=False
-                )
-                / n_atoms
-            )
-            energy_dataset = np.append(energy_dataset, image_potential_energy)
+            image_potential_energy, image_forces = self.image_targets(hash_name)
+            energy_dataset = np.append(energy_dataset, image_potential_energy / n_atoms)
             if self.forcetraining:
-                image_forces = (
-                    self.hashed_images[hash_name].get_forces(apply_constraint=False)
-                    / n_atoms
-                )
+                image_forces = image_forces / n_atoms
                 # subtract off delta force contributions
                 if self.delta:
-                    delta_forces = self.delta_forces[index] / n_atoms
+                    delta_forces = self.delta_forces[self.image_indices[index]] / n_atoms
                     image_forces -= delta_forces
-                if self.store_primes and os.path.isfile("./stored-primes/" + hash_name):
+                prime_mapping = []
+                for element in self.elements:
+                    indices = [i for i, x in enumerate(atom_order) if x == element]
+                    prime_mapping += indices
+                new_order = [atom_order[i] for i in prime_mapping]
+                used = set()
+                t = np.array([])
+                for i, x in enumerate(atom_order):
+                    for k, l in enumerate(new_order):
+                        if (x == l) and (k not in used):
+                            used.add(k)
+                            t = np.append(t, k)
+                            break
+                rearange_forces[index] = t.astype(int)
+                prime_path = self.prime_path(hash_name)
+                if self.store_primes and stored_fingerprintprimes(
+                    prime_path, self.compress_primes is not None
+                ):
                     pass
                 else:
-                    prime_mapping = []
-                    for element in self.elements:
-                        indices = [i for i, x in enumerate(atom_order) if x == element]
-                        prime_mapping += indices
-                    new_order = [atom_order[i] for i in prime_mapping]
-                    used = set()
-                    t = np.array([])
-                    for i, x in enumerate(atom_order):
-                        for k, l in enumerate(new_order):
-                            if (x == l) and (k not in used):
-                                used.add(k)
-                                t = np.append(t, k)
-                                break
-                    rearange_forces[index] = t.astype(int)
                     image_primes = self.descriptor.fingerprintprimes[hash_name]
                     # scaling of fingerprint derivatives to be consistent with
                     # fingerprint scaling.
-                    _image_primes = copy.copy(image_primes)
-                    for _, key in enumerate(list(image_primes.keys())):
-                        base_atom = key[3]
-                        fprange_atom = np.array(fprange[base_atom])
-                        fprange_dif = fprange_atom[:, 1] - fprange_atom[:, 0]
-                        fprange_dif[fprange_dif < 10.0 ** (-8.0)] = 2
-                        fprime = np.array(image_primes[key])
-                        fprime = 2 * fprime / fprange_dif
-                        _image_primes[key] = fprime
-
-                    image_prime_values = list(_image_primes.values())
-                    image_prime_keys = list(_image_primes.keys())
-                    fp_length = len(image_fingerprint[0][1])
+                    _image_primes = mask_fingerprintprimes(
+                        scale_fingerprintprimes(image_primes, fprange), self.fp_mask
+                    )
+                    fp_lengths = [len(afp) for _, afp in image_fingerprint]
                     num_atoms = len(image_fingerprint)
-                    fingerprintprimes = torch.zeros(
-                        fp_length * num_atoms, 3 * num_atoms
+                    fingerprintprimes = make_fingerprintprimes(
+                        _image_primes, fp_lengths, num_atoms, self.precision.primes
                     )
-                    for idx, fp_key in enumerate(image_prime_keys):
-                        image_prime = torch.tensor(image_prime_values[idx])
-                        base_atom = fp_key[2]
-                        wrt_atom = fp_key[0]
-                        coord = fp_key[4]
-                        fingerprintprimes[
-                            base_atom * fp_length : base_atom * fp_length + fp_length,
-                            wrt_atom * 3 + coord,
-                        ] = image_prime
+                    profiler.count("prime_nnz", fingerprintprimes._nnz())
                     # store primes in a sparse matrix format
-                    if self.store_primes:
-                        sp_matrix = sparse.coo_matrix(fingerprintprimes)
-                        sparse.save_npz(
-                            open("./stored-primes/" + hash_name, "wb"), sp_matrix
+                    if self.store_primes and self.compress_primes is not None:
+                        save_compressed_fingerprintprimes(
+                            prime_path,
+                            fingerprintprimes,
+                            quantize=self.compress_primes == "int16",
+                            tolerance=self.prime_tol,
                         )
-                    fprimes_dataset.append(fingerprintprimes)
-                forces_dataset.append(torch.from_numpy(image_forces))
+                    elif self.store_primes:
+                        save_fingerprintprimes(prime_path, fingerprintprimes)
+                    else:
+                        fprimes_dataset.append(fingerprintprimes)
+                forces_dataset.append(
+                    torch.tensor(image_forces, dtype=self.precision.fingerprints)
+                )
         if self.delta:
-            self.delta_energies /= num_of_atoms
+            delta_energies = self.delta_energies[self.image_indices] / num_of_atoms
             target_ref_per_atom = energy_dataset[0]
-            delta_ref_per_atom = self.delta_energies[0]
+            delta_ref_per_atom = delta_energies[0]
             relative_targets = energy_dataset - target_ref_per_atom
-            relative_delta = self.delta_energies - delta_ref_per_atom
-            energy_dataset = torch.FloatTensor(relative_targets - relative_delta)
+            relative_delta = delta_energies - delta_ref_per_atom
+            energy_dataset = torch.tensor(
+                relative_targets - relative_delta, dtype=self.precision.fingerprints
+            )
             scalings = [target_ref_per_atom, delta_ref_per_atom]
         else:
-            energy_dataset = torch.FloatTensor(energy_dataset)
+            energy_dataset = torch.tensor(
+                energy_dataset, dtype=self.precision.fingerprints
+            )
             scalings = [0, 0]
-        scale = Transform(energy_dataset)
+        # scaling statistics of the full dataset, duplicates included
+        scale = Transform(
+            energy_dataset.repeat_interleave(self.image_weights.long())
+        )
         energy_dataset = scale.norm(energy_dataset)
         if self.forcetraining:
             for idx, force in enumerate(forces_dataset):
@@ -278,6 +476,32 @@ class AtomsDataset(Dataset):
             rearange_forces,
         )
 
+    def prune_fingerprints(self, hashes):
+        """Determines the fingerprint columns to be kept per element, see
+        fingerprint_masks."""
+        fingerprints = []
+        for index in range(0, len(hashes), self.prefetch_size):
+            chunk = hashes[index : index + self.prefetch_size]
+            self.prefetch(chunk)
+            fingerprints += [self.descriptor.fingerprints[h] for h in chunk]
+        fp_mask = fingerprint_masks(fingerprints, self.fprange, self.prune_tol)
+        for element, mask in fp_mask.items():
+            print(
+                "%s: %i of %i fingerprint columns pruned."
+                % (element, len(mask) - mask.sum(), len(mask))
+            )
+        return fp_mask
+
+    def prefetch(self, hashes):
+        """Bulk reads the fingerprints (and fingerprintprimes if force training)
+        of the provided hashes into memory ahead of preprocessing."""
+        if hasattr(self.descriptor.fingerprints, "prefetch"):
+            self.descriptor.fingerprints.prefetch(hashes)
+        if self.forcetraining and hasattr(
+            self.descriptor.fingerprintprimes, "prefetch"
+        ):
+            self.descriptor.fingerprintprimes.prefetch(hashes)
+
     def __getitem__(self, index):
         fingerprint = self.fingerprint_dataset[index]
         energy = self.energy_dataset[index]
@@ -286,27 +510,59 @@ class AtomsDataset(Dataset):
         fprime = None
         forces = None
         if self.forcetraining:
-            if self.store_primes:
-                fprime = sparse.load_npz(open("./stored-primes/" + idx_hash, "rb"))
-                fprime = torch.tensor(fprime.toarray())
+            if self.store_primes and self.compress_primes is not None:
+                fprime = load_compressed_fingerprintprimes(
+                    self.prime_path(idx_hash), self.precision.primes
+                )
+            elif self.store_primes:
+                fp_length = sum(len(afp) for _, afp in fingerprint)
+                num_atoms = len(fingerprint)
+                fprime = load_fingerprintprimes(
+                    self.prime_path(idx_hash),
+                    (fp_length, 3 * num_atoms),
+                    self.precision.primes,
+                )
             else:
                 fprime = self.sparse_fprimes[index]
             forces = self.forces_dataset[index]
             rearange = self.rearange_forces[index]
-        return [fingerprint, energy, fprime, forces, self.scalings, rearange]
+        weight = self.image_weights[index]
+        return [fingerprint, energy, fprime, forces, weight, self.scalings, rearange]
+
+    def prime_path(self, idx_hash):
+        """Path, without extension, of the stored fingerprintprimes of an
+        image, suffixed by the digest of their scaling and masking (see
+        prime_digest) and by their compression format if any."""
+        path = "./stored-primes/" + idx_hash + "-" + self.prime_key
+        if self.compress_primes is not None:
+            path += "-" + self.compress_primes
+        return path
+
+    def prime_digest(self):
+        """Digest of the fingerprint ranges and masks the fingerprintprimes
+        are scaled and masked with, and of their precision, such that primes
+        stored for different training datasets are not mixed up."""
+        md5 = hashlib.md5(self.precision.name.encode())
+        for element in sorted(self.fprange):
+            md5.update(str(element).encode())
+            md5.update(np.asarray(self.fprange[element], dtype=np.float64).tobytes())
+            if self.fp_mask is not None:
+                md5.update(np.asarray(self.fp_mask[element], dtype=bool).tobytes())
+        return md5.hexdigest()
 
     def unique(self):
-        """Returns the unique elements contained in the training dataset"""
-        elements = np.array(
-            [atom.symbol for atoms in self.atom_images for atom in atoms]
-        )
-        _, idx = np.unique(elements, return_index=True)
-        elements = list(elements[np.sort(idx)])
-        return elements
+        """Returns the unique elements contained in the training dataset, in
+        order of first occurrence"""
+        elements = {}
+        for atoms in self.iter_images():
+            elements.update(dict.fromkeys(atoms.get_chemical_symbols()))
+        return list(elements)
 
     def fp_length(self):
-        """Computes the fingerprint length of the training images"""
-        return len(list(self.fprange.values())[0])
+        """Computes the fingerprint length of the training images, after
+        pruning. Returns a dictionary of per element lengths if these
+        differ."""
+        return fingerprint_lengths(self.fprange, self.fp_mask)
 
     def create_splits(self, training_data, val_frac, resample=None):
         """Constructs a training and validation sampler to be utilized for
@@ -332,47 +588,123 @@ class AtomsDataset(Dataset):
 
         return samplers
     
-    def subsample(self, cutoff_sig=0.1, rate=0.5, method='pykdtree', pca_target_variance=None):
-        from lammps_interface.customizedNNSubsampling import subsampling, subsampling_with_PCA
-        # obtain fingerprints in amp's format by reading all data
-        fps = self.fingerprint_dataset
-        # reorganize fps into n_central_atoms_each_frame * k_fingerprints)
-        fps_reorganized = []
-        index_list = []
-        # iterate over frames
-        for i, tmp in enumerate(fps):
-            for _, fp in tmp:
-                    fps_reorganized.append(fp)
-                    index_list.append(i)
-        fps_array = np.asarray(fps_reorganized)
-        print(fps_array.shape)
-        
-        # call subsampling algorithm to obtain indexes to keep
-        _, idx_keep = subsampling(fps_array, image_index=index_list, \
-                                    cutoff_sig=cutoff_sig, \
-                                    rate=rate, method=method)
-        # if pca_target_variance is None:
-        #     _, idx_keep = subsampling(fps_array, image_index=index_list, \
-        #                             cutoff_sig=cutoff_sig, \
-        #                             rate=rate, method=method)
-        # else:
-        #     _, idx_keep = subsampling_with_PCA(fps_array, image_index=index_list, \
-        #                                     cutoff_sig=cutoff_sig, rate=rate, \
-        #                                     method=method, \
-        #                                     target_variance=pca_target_variance)
-        del _
-        # remove duplicates
-        idx_keep = list(set(idx_keep))
-        # obtain images to keep
-        images_keep = [self.images[_] for _ in idx_keep]
-        print(len(images_keep))
-        # return new AtomsDataset with only selected images
+    def image_costs(self, cost="atoms"):
+        """Per image cost estimates used for batching with AtomsBatchSampler.
+
+        cost: str
+            "atoms" for the number of atoms of each image, "nnz" for the
+            number of nonzero fingerprintprimes entries of each image, which
+            grows roughly with the square of the number of atoms."""
+        if cost == "atoms":
+            return np.asarray(self.num_of_atoms, dtype=int)
+        elif cost == "nnz":
+            if not self.forcetraining:
+                raise ValueError("nnz costs require forcetraining=True.")
+            costs = []
+            for index, idx_hash in enumerate(self.index_hashes):
+                if self.store_primes and self.compress_primes is not None:
+                    with np.load(self.prime_path(idx_hash) + ".npz") as data:
+                        costs.append(len(data["deltas"]))
+                elif self.store_primes:
+                    values = np.load(
+                        self.prime_path(idx_hash) + "-values.npy", mmap_mode="r"
+                    )
+                    costs.append(len(values))
+                else:
+                    costs.append(self.sparse_fprimes[index]._nnz())
+            return np.asarray(costs, dtype=int)
+        raise ValueError("Unknown cost: {}. Choose from atoms, nnz.".format(cost))
+
+    def subsample(
+        self,
+        cutoff_sig=0.1,
+        rate=0.5,
+        method="pykdtree",
+        pca_target_variance=None,
+        chunk_size=10000,
+        seed=None,
+    ):
+        """Selects the images covering the fingerprint space of the dataset,
+        removing redundant ones (see subsample_indices), and refingerprints
+        the dataset with the kept images only.
+
+        Returns the kept images and their indices in the training images."""
+        indices = self.subsample_indices(
+            cutoff_sig, rate, method, pca_target_variance, chunk_size, seed
+        )
+        idx_keep = self.image_indices[indices].tolist()
+        images = list(self.iter_images())
+        images_keep = [images[index] for index in idx_keep]
         self.update_descriptor(images_keep)
         return images_keep, idx_keep
-    
+
+    def subsample_view(
+        self,
+        cutoff_sig=0.1,
+        rate=0.5,
+        method="pykdtree",
+        pca_target_variance=None,
+        chunk_size=10000,
+        seed=None,
+    ):
+        """Selects the images covering the fingerprint space of the dataset as
+        subsample does, without refingerprinting.
+
+        Returns a DatasetView of the kept images, sharing the fingerprints,
+        fingerprintprimes and scalings of the dataset."""
+        return DatasetView(
+            self,
+            self.subsample_indices(
+                cutoff_sig, rate, method, pca_target_variance, chunk_size, seed
+            ),
+        )
+
+    def subsample_indices(
+        self,
+        cutoff_sig=0.1,
+        rate=0.5,
+        method="pykdtree",
+        pca_target_variance=None,
+        chunk_size=10000,
+        seed=None,
+    ):
+        """Selects the images covering the fingerprint space of the dataset.
+        The stored fingerprints of each element are subsampled separately
+        (see amptorch.subsampling.subsample_points), querying the nearest
+        neighbor tree on self.cores threads, and an image is kept if any of
+        its atoms is kept.
+
+        Returns the sorted dataset indices of the kept images."""
+        keep = set()
+        for element in self.elements:
+            fingerprints = []
+            image_idx = []
+            for index, image_fingerprint in enumerate(self.fingerprint_dataset):
+                for atom, afp in image_fingerprint:
+                    if atom == element:
+                        fingerprints.append(afp)
+                        image_idx.append(index)
+            if not fingerprints:
+                continue
+            kept = subsample_points(
+                np.stack(fingerprints),
+                cutoff_sig=cutoff_sig,
+                rate=rate,
+                method=method,
+                pca_target_variance=pca_target_variance,
+                chunk_size=chunk_size,
+                cores=self.cores,
+                seed=seed,
+            )
+            keep.update(np.asarray(image_idx)[kept].tolist())
+        indices = sorted(keep)
+        print("%i of %i images kept." % (len(indices), len(self)))
+        return indices
+
     def update_descriptor(self, images):
         # No update on Gs
         self.atom_images = images
+        self.chunk_size = None
         print("Re-calculating fingerprints...")
         # TODO only works for SNN_Gaussian type fingerprint class
         self.hashed_images = hash_images(self.atom_images, Gs=self.Gs)
@@ -381,7 +713,9 @@ class AtomsDataset(Dataset):
         # )
         self.isamp_hash = False
         self.descriptor.calculate_fingerprints(
-            self.hashed_images, calculate_derivatives=self.forcetraining
+            self.hashed_images,
+            parallel={"cores": self.cores},
+            calculate_derivatives=self.forcetraining,
         )
         print("Fingerprints Re-calculated!")
         self.fprange = calculate_fingerprints_range(self.descriptor, self.hashed_images)
@@ -391,6 +725,285 @@ class AtomsDataset(Dataset):
         )
 
 
+class DatasetView(Subset):
+    """
+    View of a subset of the images of an AtomsDataset, e.g. as selected by
+    AtomsDataset.subsample_view. Items are those of the dataset, and attributes
+    other than dataset and indices (scalings, fprange, elements, ...) are
+    those of the dataset, such that the view can be used in its place for
+    training.
+    """
+
+    def __getattr__(self, name):
+        if name == "dataset":
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def image_costs(self, cost="atoms"):
+        """See AtomsDataset.image_costs."""
+        return self.dataset.image_costs(cost)[np.asarray(self.indices, dtype=int)]
+
+
+class AtomsBatchSampler(Sampler):
+    """
+    Batch sampler packing images into batches of a bounded total cost
+    (atoms or fingerprintprimes nonzeros, see AtomsDataset.image_costs)
+    rather than a fixed number of images, giving stable per-batch memory use
+    and time for datasets mixing small and large structures.
+
+    Images are packed greedily in the order drawn from sampler; an image
+    whose cost alone exceeds the budget forms its own batch. To be used
+    as the DataLoader batch_sampler, e.g. with skorch:
+    iterator_train__batch_sampler=AtomsBatchSampler(...) along with
+    iterator_train__batch_size=1.
+
+    Parameters:
+    -----------
+    costs: array
+        Cost of every image in the dataset.
+
+    budget: int
+        Maximum total cost of a batch.
+
+    sampler: Sampler or iterable
+        Indices to be batched, e.g. a split from AtomsDataset.create_splits.
+        Default: all indices, shuffled every epoch if shuffle is True.
+
+    shuffle: Boolean
+        True to shuffle the images when sampler is not provided.
+        Default: True
+    """
+
+    def __init__(self, costs, budget, sampler=None, shuffle=True):
+        self.costs = np.asarray(costs)
+        self.budget = budget
+        self.sampler = sampler
+        self.shuffle = shuffle
+        self._batches = None
+
+    def indices(self):
+        if self.sampler is not None:
+            return iter(self.sampler)
+        if self.shuffle:
+            return iter(np.random.permutation(len(self.costs)))
+        return iter(range(len(self.costs)))
+
+    def batches(self):
+        """Batches of the coming pass over the sampler. They are planned once
+        per epoch, drawing the shuffled order then, such that __len__ and the
+        following __iter__ agree."""
+        if self._batches is None:
+            self._batches = []
+            batch = []
+            total = 0
+            for index in self.indices():
+                cost = self.costs[index]
+                if batch and total + cost > self.budget:
+                    self._batches.append(batch)
+                    batch = []
+                    total = 0
+                batch.append(int(index))
+                total += cost
+            if batch:
+                self._batches.append(batch)
+        return self._batches
+
+    def __iter__(self):
+        batches = self.batches()
+        self._batches = None
+        return iter(batches)
+
+    def __len__(self):
+        """Number of batches of the coming pass over the sampler."""
+        return len(self.batches())
+
+
+def scale_fingerprints(image_fingerprint, fprange, dtype=np.float64):
+    """Scales an image's fingerprints to [-1, 1] according to fprange.
+    Components whose range is smaller than 1e-8 are left unscaled.
+
+    Returns a new list of (element, fingerprint) pairs, where the fingerprints
+    are rows of a single contiguous array of dtype per element of the image.
+    Scaling itself is performed in float64."""
+    elements = np.array([atom for atom, _ in image_fingerprint])
+    scaled_fingerprints = [None] * len(elements)
+    for element in np.unique(elements):
+        rows = np.nonzero(elements == element)[0]
+        fingerprints = np.array(
+            [image_fingerprint[row][1] for row in rows], dtype=np.float64
+        )
+        fprange_atom = np.asarray(fprange[element])
+        fprange_min = fprange_atom[:, 0]
+        fprange_dif = fprange_atom[:, 1] - fprange_min
+        scaled = fprange_dif > (10.0 ** (-8.0))
+        fingerprints[:, scaled] = -1 + 2.0 * (
+            (fingerprints[:, scaled] - fprange_min[scaled]) / fprange_dif[scaled]
+        )
+        fingerprints = fingerprints.astype(dtype, copy=False)
+        for row, afp in zip(rows, fingerprints):
+            scaled_fingerprints[row] = afp
+    return list(zip(elements.tolist(), scaled_fingerprints))
+
+
+def scale_fingerprintprimes(image_primes, fprange):
+    """Scales an image's fingerprint derivatives consistently with
+    scale_fingerprints. Returns a new dictionary of float arrays."""
+    fprange_difs = {}
+    for element, fprange_atom in fprange.items():
+        fprange_atom = np.asarray(fprange_atom)
+        fprange_dif = fprange_atom[:, 1] - fprange_atom[:, 0]
+        fprange_dif[fprange_dif < 10.0 ** (-8.0)] = 2
+        fprange_difs[element] = fprange_dif
+    _image_primes = OrderedDict()
+    for key, fprime in image_primes.items():
+        base_atom = key[3]
+        _image_primes[key] = 2 * np.asarray(fprime, dtype=np.float64) / fprange_difs[
+            base_atom
+        ]
+    return _image_primes
+
+
+def fingerprint_masks(fingerprints, fprange, tol):
+    """Determines, per element, the fingerprint columns carrying information:
+    columns whose range is smaller than tol are constant, and columns whose
+    scaled values are within tol of those of a preceding kept column, for all
+    atoms, are duplicates.
+
+    fingerprints is a list of image fingerprints, i.e. lists of (element,
+    fingerprint) pairs. Returns a dictionary of boolean masks of the columns
+    to be kept."""
+    element_fps = {element: [] for element in fprange}
+    for image_fingerprint in fingerprints:
+        for atom, afp in scale_fingerprints(image_fingerprint, fprange):
+            element_fps[atom].append(afp)
+    masks = {}
+    for element, fps in element_fps.items():
+        fprange_atom = np.asarray(fprange[element])
+        mask = fprange_atom[:, 1] - fprange_atom[:, 0] >= tol
+        if fps:
+            fps = np.stack(fps)
+            kept = []
+            for column in np.nonzero(mask)[0]:
+                if kept and (
+                    np.abs(fps[:, kept] - fps[:, [column]]).max(axis=0).min() < tol
+                ):
+                    mask[column] = False
+                else:
+                    kept.append(column)
+        masks[element] = mask
+    return masks
+
+
+def mask_fingerprints(image_fingerprint, mask):
+    """Keeps the fingerprint columns of the per element masks, if provided."""
+    if mask is None:
+        return image_fingerprint
+    return [(atom, afp[mask[atom]]) for atom, afp in image_fingerprint]
+
+
+def mask_fingerprintprimes(image_primes, mask):
+    """Keeps the fingerprint derivative columns of the per element masks, if
+    provided, consistently with mask_fingerprints."""
+    if mask is None:
+        return image_primes
+    return OrderedDict(
+        (key, fprime[mask[key[3]]]) for key, fprime in image_primes.items()
+    )
+
+
+def fingerprint_lengths(fprange, mask=None):
+    """Fingerprint length of the elements of fprange, after applying the per
+    element masks if provided. Returns a single length if all elements share
+    it, otherwise a dictionary of per element lengths."""
+    lengths = {
+        str(element): len(fprange_atom) if mask is None else int(mask[element].sum())
+        for element, fprange_atom in fprange.items()
+    }
+    if len(set(lengths.values())) == 1:
+        return list(lengths.values())[0]
+    return lengths
+
+
+def make_fingerprintprimes(image_primes, fp_length, num_atoms, dtype=None):
+    """Assembles the fingerprint derivatives of an image into a sparse
+    (fp_length * num_atoms) x (3 * num_atoms) COO tensor of values of dtype
+    (default dtype if None), without materializing the dense matrix.
+    fp_length is either a single length or the list of fingerprint lengths
+    of every atom, in which case the rows of each atom follow those of the
+    previous atom."""
+    if dtype is None:
+        dtype = torch.get_default_dtype()
+    fp_lengths = np.broadcast_to(np.asarray(fp_length, dtype=np.int64), (num_atoms,))
+    row_offsets = np.cumsum(fp_lengths) - fp_lengths
+    size = (int(fp_lengths.sum()), 3 * num_atoms)
+    if len(image_primes) == 0:
+        return torch.sparse_coo_tensor(
+            torch.zeros((2, 0), dtype=torch.int64), torch.zeros(0, dtype=dtype), size
+        )
+    keys = list(image_primes.keys())
+    base_atoms = np.array([key[2] for key in keys])
+    columns = np.array([key[0] * 3 + key[4] for key in keys])
+    values = np.concatenate(list(image_primes.values()))
+    lengths = fp_lengths[base_atoms]
+    rows = np.repeat(row_offsets[base_atoms] - (np.cumsum(lengths) - lengths), lengths)
+    rows = rows + np.arange(len(rows))
+    columns = np.repeat(columns, lengths)
+    nonzero = values != 0
+    indices = torch.from_numpy(np.stack((rows[nonzero], columns[nonzero])))
+    values = torch.tensor(values[nonzero], dtype=dtype)
+    return torch.sparse_coo_tensor(indices, values, size).coalesce()
+
+
+def save_fingerprintprimes(path, fingerprintprimes):
+    """Stores a sparse fingerprintprimes tensor as uncompressed index and
+    value arrays, '<path>-indices.npy' and '<path>-values.npy'. bfloat16
+    values, without a numpy counterpart, are stored as their 16 bits."""
+    fingerprintprimes = fingerprintprimes.coalesce()
+    values = fingerprintprimes.values()
+    if values.dtype == torch.bfloat16:
+        values = values.view(torch.int16)
+    np.save(path + "-indices.npy", fingerprintprimes.indices().numpy())
+    np.save(path + "-values.npy", values.numpy())
+
+
+def stored_fingerprintprimes(path, compressed=False):
+    """Whether fingerprintprimes have been stored at path, compressed (see
+    amptorch.compression) or not."""
+    if compressed:
+        return os.path.isfile(path + ".npz")
+    return os.path.isfile(path + "-indices.npy") and os.path.isfile(
+        path + "-values.npy"
+    )
+
+
+def load_fingerprintprimes(path, shape, dtype=None):
+    """Loads fingerprintprimes stored by save_fingerprintprimes straight into
+    a sparse COO tensor of values of dtype (their stored dtype if None). The
+    arrays are memory-mapped, so only the nonzero entries are read."""
+    indices = np.load(path + "-indices.npy", mmap_mode="c")
+    values = torch.from_numpy(np.load(path + "-values.npy", mmap_mode="c"))
+    if values.dtype == torch.int16:
+        values = values.view(torch.bfloat16)
+    if dtype is not None:
+        values = values.to(dtype)
+    return torch.sparse_coo_tensor(torch.from_numpy(indices), values, shape)
+
+
+def stack_fingerprints(fingerprint_dataset, elements):
+    """Gathers the fingerprints of a batch of images into one tensor per
+    element, of the dtype they are stored in, alongside the LongTensor index
+    of the image each row belongs to."""
+    element_fps = {element: [[], []] for element in elements}
+    for fp_index, sample_fingerprints in enumerate(fingerprint_dataset):
+        for atom_element, atom_fingerprint in sample_fingerprints:
+            element_fps[atom_element][0].append(atom_fingerprint)
+            element_fps[atom_element][1].append(fp_index)
+    for element in elements:
+        element_fps[element][0] = torch.from_numpy(np.stack(element_fps[element][0]))
+        element_fps[element][1] = torch.LongTensor(element_fps[element][1])
+    return element_fps
+
+
 def make_sparse(primes):
     primes = primes.to_sparse()
     return primes
@@ -422,6 +1035,9 @@ def factorize_data(training_data):
     6. image_forces = Extracts the ab initio forces for each hashed data sample in the
     dataset.
 
+    7. image_weights = Multiplicity of each data sample in the dataset, i.e.
+    the number of duplicate images it stands for.
+
     """
     forcetraining = False
     if training_data[0][2] is not None:
@@ -432,6 +1048,7 @@ def factorize_data(training_data):
     fingerprint_dataset = []
     energy_dataset = []
     num_of_atoms = []
+    image_weights = []
     if forcetraining:
         total_entries = 0
         previous_entries = 0
@@ -450,9 +1067,9 @@ def factorize_data(training_data):
         image_forces = []
         dim1_start = 0
         dim2_start = 0
-        # pre-define matrices filled with zeros
+        # pre-define matrices filled with zeros, in the stored primes' dtype
         fprimes_inds = torch.zeros((2, total_entries), dtype=torch.int64)
-        fprimes_vals = torch.zeros((total_entries))
+        fprimes_vals = torch.zeros(total_entries, dtype=training_data[0][2].dtype)
 
     rearange_set = np.zeros((1, int(sum(num_of_atoms))))[0]
     atom_shift = 0
@@ -465,6 +1082,7 @@ def factorize_data(training_data):
                 unique_atoms.append(element)
         image_potential_energy = image[1]
         energy_dataset.append(image_potential_energy)
+        image_weights.append(float(image[4]))
         if forcetraining:
             rearange_set[atom_shift : atom_shift + len(image_fingerprint)] = (
                 image[-1] + atom_shift
@@ -481,7 +1099,7 @@ def factorize_data(training_data):
                 [[dim1_start], [dim2_start]]
             )
             # build the matrix of values
-            s_fprime_vals = fprime._values().type(torch.FloatTensor)
+            s_fprime_vals = fprime._values()
             num_entries = len(s_fprime_vals)
             # fill in the entries
             fprimes_inds[
@@ -495,10 +1113,10 @@ def factorize_data(training_data):
             dim2_start += dim2
             image_forces.append((image[3]))
     if forcetraining:
-        sparse_fprimes = torch.sparse.FloatTensor(
+        sparse_fprimes = torch.sparse_coo_tensor(
             fprimes_inds, fprimes_vals, torch.Size([dim1_start, dim2_start])
         )
-        image_forces = torch.cat(image_forces).float()
+        image_forces = torch.cat(image_forces)
 
     # unique_atoms = sorted(set(unique_atoms))
     unique_atoms = OrderedDict.fromkeys(unique_atoms, 1)
@@ -510,16 +1128,59 @@ def factorize_data(training_data):
         num_of_atoms,
         sparse_fprimes,
         image_forces,
+        image_weights,
         scalings,
         rearange_set,
     )
 
 
+def collate_energy(training_data):
+    """
+    Energy-only counterpart of collate_amp, for batches without fingerprint
+    derivatives: the fingerprints are stacked per element alongside the image
+    index of every row (the segments of FullNN's per image energy sum),
+    skipping factorize_data's force bookkeeping. Batches have the layout of
+    collate_amp, with empty fingerprintprimes, forces and rearange tensors.
+    """
+    unique_atoms = OrderedDict()
+    fingerprint_dataset = []
+    energy_dataset = []
+    num_of_atoms = []
+    image_weights = []
+    for image in training_data:
+        fingerprint_dataset.append(image[0])
+        energy_dataset.append(image[1])
+        num_of_atoms.append(float(len(image[0])))
+        image_weights.append(float(image[4]))
+        for element, _ in image[0]:
+            unique_atoms[element] = 1
+    batch_size = len(energy_dataset)
+    return [
+        [
+            stack_fingerprints(fingerprint_dataset, unique_atoms),
+            batch_size,
+            unique_atoms,
+            torch.tensor([]),
+            torch.LongTensor([]),
+        ],
+        [
+            torch.tensor(energy_dataset).reshape(-1, 1),
+            torch.FloatTensor(num_of_atoms).reshape(batch_size, 1),
+            torch.tensor([]),
+            torch.FloatTensor(image_weights).reshape(batch_size, 1),
+        ],
+    ]
+
+
+@profiled("collate_amp")
 def collate_amp(training_data):
     """
     Reshuffling scheme that reads in raw data and organizes it into element
     specific datasets to be fed into element specific neural networks.
+    Batches without fingerprint derivatives are collated by collate_energy.
     """
+    if training_data[0][2] is None:
+        return collate_energy(training_data)
     (
         unique_atoms,
         fingerprint_dataset,
@@ -527,26 +1188,13 @@ def collate_amp(training_data):
         num_of_atoms,
         fp_primes,
         image_forces,
+        image_weights,
         scalings,
         rearange,
     ) = factorize_data(training_data)
     batch_size = len(energy_dataset)
-    element_specific_fingerprints = {}
+    element_specific_fingerprints = stack_fingerprints(fingerprint_dataset, unique_atoms)
     model_input_data = [[], []]
-    for element in unique_atoms:
-        element_specific_fingerprints[element] = [[], []]
-    for fp_index, sample_fingerprints in enumerate(fingerprint_dataset):
-        for fingerprint in sample_fingerprints:
-            atom_element = fingerprint[0]
-            atom_fingerprint = fingerprint[1]
-            element_specific_fingerprints[atom_element][0].append(
-                torch.tensor(atom_fingerprint, dtype=torch.get_default_dtype())
-            )
-            element_specific_fingerprints[atom_element][1].append(fp_index)
-    for element in unique_atoms:
-        element_specific_fingerprints[element][0] = torch.stack(
-            element_specific_fingerprints[element][0]
-        )
     model_input_data[0].append(element_specific_fingerprints)
     model_input_data[0].append(batch_size)
     model_input_data[0].append(unique_atoms)
@@ -555,18 +1203,97 @@ def collate_amp(training_data):
     model_input_data[1].append(torch.tensor(energy_dataset).reshape(-1, 1))
     model_input_data[1].append(torch.FloatTensor(num_of_atoms).reshape(batch_size, 1))
     model_input_data[1].append(image_forces)
+    model_input_data[1].append(torch.FloatTensor(image_weights).reshape(batch_size, 1))
     return model_input_data
 
 
+def worker_init_fn(worker_id):
+    """DataLoader worker_init_fn limiting each worker to a single torch thread,
+    avoiding oversubscription of the cores when num_workers > 0."""
+    torch.set_num_threads(1)
+
+
+class PrefetchDataLoader(DataLoader):
+    """
+    DataLoader assembling batches in a background thread, up to prefetch
+    batches ahead of their use. Batch collation (e.g. collate_amp) then
+    overlaps with the forward and backward passes. May be combined with
+    num_workers > 0. With skorch: iterator_train=PrefetchDataLoader,
+    iterator_train__prefetch=2.
+
+    Parameters:
+    -----------
+    prefetch: int
+        Maximum number of batches assembled ahead. Default: 2
+    """
+
+    def __init__(self, dataset, prefetch=2, **kwargs):
+        super(PrefetchDataLoader, self).__init__(dataset, **kwargs)
+        self.prefetch = prefetch
+
+    def __iter__(self):
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        errors = []
+        loader = threading.Thread(
+            target=_load_batches,
+            args=(super(PrefetchDataLoader, self).__iter__(), batches, stop, errors),
+            daemon=True,
+        )
+        loader.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is _END_OF_BATCHES:
+                    break
+                yield batch
+            if errors:
+                raise errors[0]
+        finally:
+            stop.set()
+            loader.join()
+
+
+_END_OF_BATCHES = object()
+
+
+def _put_batch(batches, batch, stop):
+    """Puts batch on the queue unless stop is set first."""
+    while not stop.is_set():
+        try:
+            batches.put(batch, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _load_batches(iterator, batches, stop, errors):
+    """Loader thread of PrefetchDataLoader; iterates over the DataLoader
+    iterator, queueing its batches until exhausted or stopped."""
+    try:
+        for batch in iterator:
+            if not _put_batch(batches, batch, stop):
+                return
+    except Exception as e:
+        errors.append(e)
+    _put_batch(batches, _END_OF_BATCHES, stop)
+
+
 class TestDataset(Dataset):
     """
     PyTorch inherited abstract class that specifies how testing data is to be preprocessed and
     passed along to the DataLoader.
 
+    Fingerprints (and fingerprint derivatives) of all images are computed in
+    a single featurization pass upon construction; each index then
+    corresponds to one image, allowing many structures to be batched through
+    collate_test.
+
     Parameters:
     -----------
     images: list, file, database
-        Training data to be utilized for the regression model.
+        Testing data to be predicted on by the regression model.
 
     descriptor: object
         Scheme to be utilized for computing fingerprints
@@ -575,10 +1302,32 @@ class TestDataset(Dataset):
         Fingerprint ranges of the training dataset to be used to scale the test
         dataset fingerprints in the same manner.
 
+    forcetraining: Boolean
+        True to compute the fingerprint derivatives required for force
+        predictions. Default: True
+
+    fp_mask: dict
+        Per element fingerprint columns kept by the training dataset (see
+        AtomsDataset prune_tol), applied after scaling. Default: None
+
+    precision: str
+        Precision policy of the fingerprints and fingerprintprimes, see
+        amptorch.precision. Default: "float32"
+
     """
 
     def __init__(
-        self, images, unique_atoms, descriptor, Gs, fprange, label="example", cores=1
+        self,
+        images,
+        unique_atoms,
+        descriptor,
+        Gs,
+        fprange,
+        label="example",
+        cores=1,
+        forcetraining=True,
+        fp_mask=None,
+        precision="float32",
     ):
         self.images = images
         if type(images) is not list:
@@ -590,56 +1339,39 @@ class TestDataset(Dataset):
             if extension != (".traj" or ".db"):
                 self.atom_images = ase.io.read(images, ":")
         self.fprange = fprange
+        self.fp_mask = fp_mask
+        self.precision = get_precision(precision)
+        self.forcetraining = forcetraining
         self.training_unique_atoms = unique_atoms
-        self.hashed_images = amp_hash(self.atom_images)
         if descriptor == SNN_Gaussian:
             self.hashed_images = hash_images(self.atom_images, Gs)
             self.fps, self.fp_primes = make_amp_descriptors_simple_nn(
                 self.atom_images,
                 Gs,
                 self.training_unique_atoms,
-                forcetraining=False,
+                forcetraining=forcetraining,
                 cores=cores,
                 label=label,
                 save=False,
             )
-        if self.fp_primes == None:
-            self.fp_primes = {}
+        else:
+            self.hashed_images = amp_hash(self.atom_images)
         self.unique_atoms = self.unique()
 
     def __len__(self):
-        return len(self.hashed_images)
+        return len(self.atom_images)
 
     def __getitem__(self, index):
-        image_fingerprint = self.fps
-        fprange = self.fprange
-        atom_order = []
-        # fingerprint scaling to a range of [-1,1].
-        for i, (atom, afp) in enumerate(image_fingerprint):
-            _afp = copy.copy(afp)
-            fprange_atom = fprange[atom]
-            for _ in range(np.shape(_afp)[0]):
-                if (fprange_atom[_][1] - fprange_atom[_][0]) > (10.0 ** (-8.0)):
-                    _afp[_] = -1 + 2.0 * (
-                        (_afp[_] - fprange_atom[_][0])
-                        / (fprange_atom[_][1] - fprange_atom[_][0])
-                    )
-            image_fingerprint[i] = (atom, _afp)
-            atom_order.append(atom)
-        image_primes = self.fp_primes
-        # image_primes = self.descriptor.fingerprintprimes[hash_name]
-        # fingerprint derivative scaling to a range of [0,1].
-        _image_primes = copy.copy(image_primes)
-        for _, key in enumerate(list(image_primes.keys())):
-            base_atom = key[3]
-            fprange_atom = fprange[base_atom]
-            fprime = image_primes[key]
-            for i in range(len(fprime)):
-                if (fprange_atom[i][1] - fprange_atom[i][0]) > (10.0 ** (-8.0)):
-                    fprime[i] = 2.0 * (
-                        fprime[i] / (fprange_atom[i][1] - fprange_atom[i][0])
-                    )
-            _image_primes[key] = fprime
+        # fingerprint scaling to a range of [-1,1], keeping the columns the
+        # model was trained on.
+        image_fingerprint = mask_fingerprints(
+            scale_fingerprints(
+                self.fps[index], self.fprange, numpy_dtype(self.precision.fingerprints)
+            ),
+            self.fp_mask,
+        )
+        atom_order = [atom for atom, _ in image_fingerprint]
+        num_atoms = len(image_fingerprint)
         prime_mapping = []
         for element in self.unique_atoms:
             indices = [i for i, x in enumerate(atom_order) if x == element]
@@ -653,21 +1385,17 @@ class TestDataset(Dataset):
                     used.add(k)
                     rearange.append(k)
                     break
+        if not self.forcetraining:
+            return [image_fingerprint, None, num_atoms, rearange]
 
-        image_prime_values = list(_image_primes.values())
-        image_prime_keys = list(_image_primes.keys())
-        fp_length = len(image_fingerprint[0][1])
-        num_atoms = len(image_fingerprint)
-        fingerprintprimes = torch.zeros(fp_length * num_atoms, 3 * num_atoms)
-        for idx, fp_key in enumerate(image_prime_keys):
-            image_prime = torch.tensor(image_prime_values[idx])
-            base_atom = fp_key[2]
-            wrt_atom = fp_key[0]
-            coord = fp_key[4]
-            fingerprintprimes[
-                base_atom * fp_length : base_atom * fp_length + fp_length,
-                wrt_atom * 3 + coord,
-            ] = image_prime
+        # fingerprint derivative scaling consistent with the fingerprints.
+        _image_primes = mask_fingerprintprimes(
+            scale_fingerprintprimes(self.fp_primes[index], self.fprange), self.fp_mask
+        )
+        fp_lengths = [len(afp) for _, afp in image_fingerprint]
+        fingerprintprimes = make_fingerprintprimes(
+            _image_primes, fp_lengths, num_atoms, self.precision.primes
+        )
 
         return [image_fingerprint, fingerprintprimes, num_atoms, rearange]
 
@@ -680,8 +1408,8 @@ class TestDataset(Dataset):
         return elements
 
     def fp_length(self):
-        self.fp_length = len(list(self.fprange.values())[0])
-        return len(list(self.fprange.values())[0])
+        self.fp_length = fingerprint_lengths(self.fprange, self.fp_mask)
+        return self.fp_length
 
     def collate_test(self, training_data):
         """
@@ -694,9 +1422,11 @@ class TestDataset(Dataset):
         total_entries = 0
         previous_entries = 0
         atom_shift = 0
+        forcetraining = training_data[0][1] is not None
         for image in training_data:
-            image[1] = image[1].to_sparse()  # presparify the fprimes
-            total_entries += len(image[1]._values())
+            if forcetraining:
+                image[1] = image[1].to_sparse()  # presparify the fprimes
+                total_entries += len(image[1]._values())
             num_of_atoms.append(image[2])
             rearange_set = np.append(rearange_set, np.array(image[-1]) + atom_shift)
             atom_shift += image[2]
@@ -705,9 +1435,13 @@ class TestDataset(Dataset):
         dim2_start = 0
         # pre-define matrices filled with zeros
         fprimes_inds = torch.zeros((2, total_entries), dtype=torch.int64)
-        fprimes_vals = torch.zeros((total_entries))
+        fprimes_vals = torch.zeros(total_entries, dtype=self.precision.primes)
 
         for idx, image in enumerate(training_data):
+            image_fingerprint = image[0]
+            fingerprint_dataset.append(image_fingerprint)
+            if not forcetraining:
+                continue
             fprime = image[1]
             dim1 = fprime.shape[0]
             dim2 = fprime.shape[1]
@@ -716,7 +1450,7 @@ class TestDataset(Dataset):
             s_fprime_inds = fprime._indices() + torch.LongTensor(
                 [[dim1_start], [dim2_start]]
             )
-            s_fprime_vals = fprime._values().type(torch.FloatTensor)
+            s_fprime_vals = fprime._values()
             num_entries = len(s_fprime_vals)
             # fill in the entries
             fprimes_inds[
@@ -729,34 +1463,84 @@ class TestDataset(Dataset):
 
             dim1_start += dim1
             dim2_start += dim2
-            image_fingerprint = image[0]
-            fingerprint_dataset.append(image_fingerprint)
-        sparse_fprimes = torch.sparse.LongTensor(
+        sparse_fprimes = torch.sparse_coo_tensor(
             fprimes_inds, fprimes_vals, torch.Size([dim1_start, dim2_start])
         )
 
-        element_specific_fingerprints = {}
+        batch_symbols = set(
+            atom for image_fingerprint in fingerprint_dataset for atom, _ in image_fingerprint
+        )
+        batch_elements = [
+            element for element in self.unique_atoms if element in batch_symbols
+        ]
+        element_specific_fingerprints = stack_fingerprints(
+            fingerprint_dataset, batch_elements
+        )
         model_input_data = []
-        for element in self.unique_atoms:
-            element_specific_fingerprints[element] = [[], []]
-        for fp_index, sample_fingerprints in enumerate(fingerprint_dataset):
-            for fingerprint in sample_fingerprints:
-                atom_element = fingerprint[0]
-                atom_fingerprint = fingerprint[1]
-                element_specific_fingerprints[atom_element][0].append(
-                    torch.tensor(atom_fingerprint, dtype=torch.get_default_dtype())
-                )
-                element_specific_fingerprints[atom_element][1].append(fp_index)
-        for element in self.unique_atoms:
-            element_specific_fingerprints[element][0] = torch.stack(
-                element_specific_fingerprints[element][0]
-            )
         batch_size = len(num_of_atoms)
         model_input_data.append(element_specific_fingerprints)
         model_input_data.append(batch_size)
-        model_input_data.append(self.unique_atoms)
+        model_input_data.append(batch_elements)
         model_input_data.append(num_of_atoms)
         model_input_data.append(sparse_fprimes)
         model_input_data.append(torch.LongTensor(rearange_set))
 
         return model_input_data
+
+    def collate_script(self, training_data):
+        """
+        Collates a batch into the tensor-only inputs of InferenceNN:
+        fingerprints, element ids (indexing the training elements), image
+        indices, number of images and the block-diagonal sparse fingerprint
+        derivatives (None without forcetraining). Fingerprints of per element
+        lengths are zero-padded to the longest one, with the fingerprint
+        derivative rows following the padded layout.
+        """
+        element_ids = {element: i for i, element in enumerate(self.training_unique_atoms)}
+        fp_length = max(len(fp) for image in training_data for _, fp in image[0])
+        fingerprints = []
+        atom_elements = []
+        image_idx = []
+        fprimes_inds = []
+        fprimes_vals = []
+        atom_start = 0
+        dim2_start = 0
+        forcetraining = training_data[0][1] is not None
+        for idx, image in enumerate(training_data):
+            fp_lengths = []
+            for element, fp in image[0]:
+                fingerprints.append(np.pad(fp, (0, fp_length - len(fp))))
+                atom_elements.append(element_ids[element])
+                fp_lengths.append(len(fp))
+            image_idx += [idx] * image[2]
+            if not forcetraining:
+                continue
+            fprime = image[1]
+            # map the rows of every atom to its padded fingerprint
+            fp_lengths = torch.LongTensor(fp_lengths)
+            atoms = torch.repeat_interleave(torch.arange(len(fp_lengths)), fp_lengths)
+            padded_rows = (atom_start + atoms) * fp_length + (
+                torch.arange(len(atoms)) - (torch.cumsum(fp_lengths, 0) - fp_lengths)[atoms]
+            )
+            inds = fprime._indices()
+            fprimes_inds.append(
+                torch.stack((padded_rows[inds[0]], inds[1] + dim2_start))
+            )
+            fprimes_vals.append(fprime._values().float())
+            atom_start += image[2]
+            dim2_start += fprime.shape[1]
+        dim1_start = atom_start * fp_length
+        fprimes = None
+        if forcetraining:
+            fprimes = torch.sparse_coo_tensor(
+                torch.cat(fprimes_inds, dim=1),
+                torch.cat(fprimes_vals),
+                (dim1_start, dim2_start),
+            )
+        return [
+            torch.tensor(np.array(fingerprints), dtype=torch.get_default_dtype()),
+            torch.LongTensor(atom_elements),
+            torch.LongTensor(image_idx),
+            len(training_data),
+            fprimes,
+        ]
@@ -8,6 +8,14 @@ class Transform():
         self.mean = torch.mean(tensor, dim=0)
         self.std = torch.std(tensor, dim=0)
 
+    @classmethod
+    def from_stats(cls, mean, std):
+        """Rebuilds a Transform from previously computed statistics."""
+        transform = cls.__new__(cls)
+        transform.mean = mean
+        transform.std = std
+        return transform
+
     def norm(self, tensor, energy=True):
         return (tensor - self.mean) / self.std if energy else tensor/self.std
 
@@ -12,7 +12,7 @@ from functools import lru_cache
 
 
 class morse_potential:
-    def __init__(self, images, params, cutoff, filename, combo='mean'):
+    def __init__(self, images, params, cutoff, filename, combo='mean', cores=1):
         if not os.path.exists("results"):
             os.mkdir("results")
         if not os.path.exists("results/logs"):
@@ -26,7 +26,9 @@ class morse_potential:
         self.hashed_keys = list(self.hashed_images.keys())
         calc = NeighborlistCalculator(cutoff=cutoff)
         self.neighborlist = Data(filename="amp-data-neighborlists", calculator=calc)
-        self.neighborlist.calculate_items(self.hashed_images)
+        self.neighborlist.calculate_items(
+            self.hashed_images, parallel={"cores": cores}
+        )
         log = Logger("results/logs/{}.txt".format(filename))
         self.logresults(log, self.params)
 
@@ -1,5 +1,6 @@
 import sys
 import copy
+import json
 import time
 import os
 import pickle
@@ -9,14 +10,17 @@ import shutil
 import numpy as np
 from ase import io
 from ase.db import connect
+from amptorch.gaussian import FileDatabase
+from amptorch.profiling import profiler, profiled
 from simple_nn.features.symmetry_function._libsymf import lib, ffi
 from simple_nn.features.symmetry_function import _gen_2Darray_for_ffi
 
 def make_amp_descriptors_simple_nn(atoms, Gs, elements, forcetraining, cores, label, save):
     """
     uses simple_nn to make descriptors in the amp format.
-    Only creates the same symmetry functions for each element
-    for now.
+    When saving, the individual symmetry function columns are cached (see
+    cached_symmetry_functions), so that only the symmetry functions new to
+    Gs are calculated when the parameters change.
     Parameters: 
         atoms (list of ASE Atoms objects)
             a list of the atoms you'd like to make descriptors for
@@ -30,19 +34,34 @@ def make_amp_descriptors_simple_nn(atoms, Gs, elements, forcetraining, cores, la
         cores (int for multithreading, default = 1)
         label (str)
         save (boolean, default = True)
-            if set to True, return None, None, but saved the files for data-feteching called upon AMPTorch. 
-            if set to False, return fps, and fp_primes. 
+            if set to True, the descriptors are also stored in the fingerprint
+            databases for data-fetching called upon AMPTorch; images already
+            stored are not recalculated but read back.
+            if set to False, the descriptors are computed in memory in a
+            single pass.
+    returns:
+        fps, fp_primes (lists)
+            the fingerprints and fingerprint primes (None without
+            forcetraining) of every image, in the order of atoms, for either
+            value of save.
     """
     traj, calculated, cffi_out = make_simple_nn_fps(atoms, Gs, elements=elements,
-            label=label)        
-    if save is True:
+            label=label, skip_stored=save, cache_columns=save,
+            calculate_derivatives=forcetraining)
+    if save is False:
+        return convert_simple_nn_fps(traj, Gs, cffi_out, forcetraining, cores, save=save)
+    computed = {}
+    if calculated:
         fps, fp_primes = convert_simple_nn_fps(traj, Gs, cffi_out, forcetraining, cores, save=save)
-        return fps, fp_primes
-    else:
-        fps, fp_primes = stored_fps(atoms, Gs, forcetraining=forcetraining)
-        return fps, fp_primes
+        computed = {
+            get_hash(image, Gs): (fp, fp_prime)
+            for image, fp, fp_prime in zip(traj, fps, fp_primes)
+        }
+    return stored_fps(atoms, Gs, forcetraining, computed)
 
-def make_simple_nn_fps(traj, Gs, label, elements="all"):
+@profiled("make_simple_nn_fps")
+def make_simple_nn_fps(traj, Gs, label, elements="all", skip_stored=True,
+        cache_columns=False, calculate_derivatives=True):
     """
     generates descriptors using simple_nn. The files are stored in the
     ./data folder. These descriptors will be in the simple_nn form and
@@ -52,9 +71,18 @@ def make_simple_nn_fps(traj, Gs, label, elements="all"):
             a list of the atoms you'd like to make descriptors for
         descriptors (tuple):
             a tuple containing (g2_etas, g2_rs_s, g4_etas, cutoff, g4_zetas, g4_gammas)
-        clean_up_directory (bool):
-            if set to True, the input files made by simple_nn will
-            be deleted
+        elements (list or str):
+            the atom types, in order, the descriptors are made for.
+            "all" uses the atom types of traj in order of appearance
+        skip_stored (bool):
+            if set to True, images whose descriptors are already
+            stored are skipped
+        cache_columns (bool):
+            if set to True, symmetry function columns are read from and
+            stored to the column cache, see cached_symmetry_functions
+        calculate_derivatives (bool):
+            if set to False, the column cache neither stores nor returns
+            derivatives
     returns:
         None
     """
@@ -63,7 +91,8 @@ def make_simple_nn_fps(traj, Gs, label, elements="all"):
         traj = [traj]
 
     G = copy.deepcopy(Gs)
-    traj = factorize_data(traj, G)
+    if skip_stored:
+        traj = factorize_data(traj, G)
     calculated = False
     cffi_out = None
     if len(traj) > 0:
@@ -81,35 +110,46 @@ def make_simple_nn_fps(traj, Gs, label, elements="all"):
         )
         if elements == "all":
             atom_types = []
-            # TODO rewrite this
             for image in traj:
-                atom_types += image.get_chemical_symbols()
-                atom_types = list(set(atom_types))
+                for symbol in image.get_chemical_symbols():
+                    if symbol not in atom_types:
+                        atom_types.append(symbol)
         else:
-            atom_types = traj[0].get_chemical_symbols()
-            atom_types = list(set(atom_types))
+            atom_types = list(elements)
 
-        params_set = make_snn_params(atom_types, *descriptors)
+        params_set = make_snn_params(
+            atom_types, *descriptors, species=G.get("species")
+        )
 
         # build the descriptor object
         cffi_out = defaultdict()
+        if cache_columns:
+            column_db = FileDatabase("amp-data-sf-columns", max_memory=0)
         for image_idx, atoms in enumerate(traj):
-            x_out, dx_out = wrap_symmetry_functions(atoms, params_set)
+            if cache_columns:
+                x_out, dx_out = cached_symmetry_functions(
+                    atoms, params_set, column_db, calculate_derivatives
+                )
+            else:
+                x_out, dx_out = wrap_symmetry_functions(atoms, params_set)
             cffi_out[image_idx] = defaultdict()
             cffi_out_i = cffi_out[image_idx]
             cffi_out_i['x'] = x_out
             cffi_out_i['dx'] = dx_out
         calculated = True
+        profiler.count("images_fingerprinted", len(traj))
+        profiler.count("atoms_fingerprinted", sum(len(atoms) for atoms in traj))
     return traj, calculated, cffi_out
 
 def factorize_data(traj, Gs):
     new_traj = []
     if os.path.isdir("amp-data-fingerprint-primes.ampdb/"):
+        # keys may live either as loose files or in an indexed archive
+        stored = set(FileDatabase("amp-data-fingerprints", max_memory=0).keys())
+        stored &= set(FileDatabase("amp-data-fingerprint-primes", max_memory=0).keys())
         for image in traj:
             hash = get_hash(image, Gs)
-            if os.path.isfile(
-                "amp-data-fingerprint-primes.ampdb/loose/" + hash
-            ) and os.path.isfile("amp-data-fingerprints.ampdb/loose/" + hash):
+            if hash in stored:
                 pass
             else:
                 new_traj.append(image)
@@ -118,7 +158,8 @@ def factorize_data(traj, Gs):
     return new_traj
 
 def make_snn_params(
-    elements, etas, rs_s, g4_eta=4, cutoff=6.5, g4_zeta=[1.0, 4.0], g4_gamma=[1, -1]
+    elements, etas, rs_s, g4_eta=4, cutoff=6.5, g4_zeta=[1.0, 4.0], g4_gamma=[1, -1],
+    species=None
     ):
     """
     makes a params file for simple_NN. This is the file containing
@@ -142,10 +183,16 @@ def make_snn_params(
         cutoff (float):
             the distance in angstroms at which you'd like to cut
             off the descriptors
+        species (dict):
+            per element symmetry function sets, {element: {"G2": [neighbor
+            elements], "G4": [[neighbor element, neighbor element], ...]}},
+            e.g. as made by neighbor_species. Elements missing from species
+            get the full set. Default: None, the full set for every element
     returns:
         None
     """
     params_set = {}
+    species = {} if species is None else species
     
     if len(etas) != len(rs_s):
         raise ValueError('the length of the etas list must be equal to the'
@@ -154,21 +201,36 @@ def make_snn_params(
         g4_eta = np.logspace(-4, -1, num=g4_eta)
     for element in elements:
         params = {'i':[],'d':[]}
-        
+        g2_species = range(1, len(elements) + 1)
+        g4_pairs = [
+            (i, j)
+            for i in range(1, len(elements) + 1)
+            for j in range(i, len(elements) + 1)
+        ]
+        if element in species:
+            g2_species = [
+                elements.index(neighbor) + 1 for neighbor in species[element]["G2"]
+            ]
+            g4_pairs = [
+                tuple(sorted((elements.index(n1) + 1, elements.index(n2) + 1)))
+                for n1, n2 in species[element]["G4"]
+            ]
+            g2_species = sorted(set(g2_species))
+            g4_pairs = sorted(set(g4_pairs))
+
         # G2
         for eta, Rs in zip(etas, rs_s):
-            for species in range(1, len(elements) + 1):
-                params['i'].append([2,species,0])
+            for g2_element in g2_species:
+                params['i'].append([2,g2_element,0])
                 params['d'].append([cutoff,eta,Rs,0.0])
 
         # G4
         for eta in g4_eta:
             for zeta in g4_zeta:
                 for lamda in g4_gamma:
-                    for i in range(1, len(elements) + 1):
-                        for j in range(i, len(elements) + 1):
-                            params['i'].append([4,i,j])
-                            params['d'].append([cutoff,eta,zeta,lamda])
+                    for i, j in g4_pairs:
+                        params['i'].append([4,i,j])
+                        params['d'].append([cutoff,eta,zeta,lamda])
                             
                             
         params_set[element]={'num':len(params['i']),
@@ -176,6 +238,184 @@ def make_snn_params(
                 'd':params['d']}
     return params_set
 
+def periodic_atoms(atoms):
+    """
+    returns atoms as simple_nn's calculate_sf sees them: it takes no pbc and
+    always treats the cell as periodic, so images with a cell are returned as
+    a copy with pbc=True, and images without one as they are.
+    """
+    if not atoms.cell.any() or atoms.pbc.all():
+        return atoms
+    atoms = atoms.copy()
+    atoms.set_pbc(True)
+    return atoms
+
+
+def neighbor_species(images, cutoff):
+    """
+    finds, for every element, the neighbor elements and pairs of neighbor
+    elements that occur within cutoff in images, i.e. the G2 and G4 symmetry
+    functions that are not identically zero. Cells are periodic, as in
+    simple_nn (see periodic_atoms).
+    Parameters:
+        images (list of ASE atoms objects)
+        cutoff (float)
+    returns:
+        species (dict):
+            {element: {"G2": [neighbor elements], "G4": [[neighbor element,
+            neighbor element], ...]}}, in the format of make_snn_params
+    """
+    from ase.neighborlist import neighbor_list
+
+    g2 = {}
+    g4 = {}
+    for atoms in images:
+        symbols = np.array(atoms.get_chemical_symbols(), dtype=object)
+        for symbol in symbols:
+            g2.setdefault(symbol, set())
+            g4.setdefault(symbol, set())
+        i, j = neighbor_list("ij", periodic_atoms(atoms), cutoff)
+        order = np.argsort(i, kind="stable")
+        i, j = i[order], j[order]
+        centers, starts = np.unique(i, return_index=True)
+        for center, neighbors in zip(centers, np.split(j, starts[1:])):
+            element = symbols[center]
+            neighbor_elements = sorted(set(symbols[neighbors]))
+            g2[element].update(neighbor_elements)
+            # pairs of distinct neighbors, including two of the same element
+            counts = {
+                n: np.sum(symbols[neighbors] == n) for n in neighbor_elements
+            }
+            for a, n1 in enumerate(neighbor_elements):
+                for n2 in neighbor_elements[a:]:
+                    if n1 != n2 or counts[n1] > 1:
+                        g4[element].add((n1, n2))
+    return {
+        element: {
+            "G2": sorted(g2[element]),
+            "G4": [list(pair) for pair in sorted(g4[element])],
+        }
+        for element in g2
+    }
+
+def sf_column_keys(params_set):
+    """
+    names every symmetry function of a params_set by its center element,
+    type, neighbor elements and parameters, which, unlike its column,
+    does not depend on the other symmetry functions or the element order.
+    Parameters:
+        params_set (dict):
+            simple_nn parameter set, as made by make_snn_params
+    returns:
+        keys (dict):
+            {element: [key of every column]}
+    """
+    elements = list(params_set.keys())
+    keys = {}
+    for element, params in params_set.items():
+        keys[element] = [
+            (
+                element,
+                int(i[0]),
+                tuple(sorted(elements[n - 1] for n in i[1:] if n > 0)),
+                tuple(float(value) for value in d),
+            )
+            for i, d in zip(params["i"], params["d"])
+        ]
+    return keys
+
+def column_entry_key(image_hash, key):
+    """
+    key of the column cache entry of a symmetry function column of an image.
+    Parameters:
+        image_hash (str):
+            image hash, without Gs
+        key (tuple):
+            column key, see sf_column_keys
+    returns:
+        entry key (str)
+    """
+    import hashlib
+
+    md5 = hashlib.md5(repr(key).encode("utf-8"))
+    return "{}-{}".format(image_hash, md5.hexdigest())
+
+def cached_symmetry_functions(atoms, params_set, column_db, calculate_derivatives=True):
+    """
+    computes the symmetry functions of an image, as wrap_symmetry_functions,
+    reading the individual symmetry function columns already calculated for
+    the image from column_db. Only the missing columns are calculated, and
+    stored to column_db, such that changing a few parameters of Gs does not
+    recompute the others.
+    Parameters:
+        atoms (ASE atoms object)
+        params_set (dict):
+            simple_nn parameter set, as made by make_snn_params
+        column_db (FileDatabase):
+            column cache, holding every column of an image as its own entry
+            (see column_entry_key): the fingerprints of the column's atoms
+            and, if calculated, their derivatives as the nonzero (atom,
+            neighbor) rows only
+        calculate_derivatives (bool):
+            if set to False, derivatives are neither calculated, stored nor
+            returned
+    returns:
+        x_out, dx_out in the format of wrap_symmetry_functions, dx_out None
+        without calculate_derivatives
+    """
+    image_hash = get_hash(atoms)
+    keys = sf_column_keys(params_set)
+    columns = {}
+    missing = OrderedDict()
+    for element, params in params_set.items():
+        rows = []
+        for n, key in enumerate(keys[element]):
+            try:
+                column = column_db[column_entry_key(image_hash, key)]
+            except KeyError:
+                column = None
+            if column is None or (calculate_derivatives and "dx" not in column):
+                rows.append(n)
+            else:
+                columns[key] = column
+        missing[element] = {
+            "num": len(rows),
+            "i": [params["i"][n] for n in rows],
+            "d": [params["d"][n] for n in rows],
+            "rows": rows,
+        }
+    if any(params["num"] for params in missing.values()):
+        x, dx = wrap_symmetry_functions(atoms, missing)
+        for element, params in missing.items():
+            for column, n in enumerate(params["rows"]):
+                key = keys[element][n]
+                columns[key] = {"x": np.array(x[element][:, column])}
+                if calculate_derivatives:
+                    dx_column = dx[element][:, column]
+                    centers, neighbors = np.nonzero(np.any(dx_column != 0, axis=2))
+                    columns[key]["pairs"] = np.stack((centers, neighbors)).astype(
+                        np.int32
+                    )
+                    columns[key]["dx"] = dx_column[centers, neighbors]
+                column_db[column_entry_key(image_hash, key)] = columns[key]
+
+    symbols = np.array(atoms.get_chemical_symbols())
+    x_out = {}
+    dx_out = {} if calculate_derivatives else None
+    for element in params_set:
+        num_atoms = int(np.sum(symbols == element))
+        x_out[element] = np.zeros((num_atoms, len(keys[element])))
+        if calculate_derivatives:
+            dx_out[element] = np.zeros(
+                (num_atoms, len(keys[element]), len(atoms), 3)
+            )
+        for n, key in enumerate(keys[element]):
+            x_out[element][:, n] = columns[key]["x"]
+            if calculate_derivatives:
+                centers, neighbors = columns[key]["pairs"]
+                dx_out[element][centers, n, neighbors] = columns[key]["dx"]
+    return x_out, dx_out
+
 def wrap_symmetry_functions(atoms, params_set):
 
     # Adapted from the python code in simple-nn
@@ -203,8 +443,8 @@ def wrap_symmetry_functions(atoms, params_set):
         type_idx[jtem] = np.arange(atom_num)[tmp]
 
     for key in params_set:
-        params_set[key]['ip']=_gen_2Darray_for_ffi(np.asarray(params_set[key]['i'], dtype=np.intc, order='C'), ffi, "int")
-        params_set[key]['dp']=_gen_2Darray_for_ffi(np.asarray(params_set[key]['d'], dtype=np.float64, order='C'), ffi)
+        params_set[key]['ip']=_gen_2Darray_for_ffi(np.asarray(params_set[key]['i'], dtype=np.intc, order='C').reshape(-1, 3), ffi, "int")
+        params_set[key]['dp']=_gen_2Darray_for_ffi(np.asarray(params_set[key]['d'], dtype=np.float64, order='C').reshape(-1, 4), ffi)
         
     atom_i_p = ffi.cast("int *", atom_i.ctypes.data)
 
@@ -241,18 +481,20 @@ def wrap_symmetry_functions(atoms, params_set):
 
     return x_out, dx_out 
 
+@profiled("convert_simple_nn_fps")
 def convert_simple_nn_fps(traj, Gs, cffi_out, forcetraining, cores, save):
-
+    """
+    reorganizes the simple_nn descriptors of traj into amp format. Returns
+    lists of fps and fp_primes (None without forcetraining) in the order of
+    traj. If save is True they are also written to the fingerprint
+    databases.
+    """
+    fps, fp_primes = [], []
     # make the directories
-    if not os.path.isdir("./amp-data-fingerprints.ampdb"):
-        os.mkdir("./amp-data-fingerprints.ampdb")
-    if not os.path.isdir("./amp-data-fingerprints.ampdb/loose"):
-        os.mkdir("./amp-data-fingerprints.ampdb/loose")
-    if forcetraining:
-        if not os.path.isdir("./amp-data-fingerprint-primes.ampdb"):
-            os.mkdir("./amp-data-fingerprint-primes.ampdb")
-        if not os.path.isdir("./amp-data-fingerprint-primes.ampdb/loose"):
-            os.mkdir("amp-data-fingerprint-primes.ampdb/loose")
+    if save:
+        fp_db = FileDatabase("amp-data-fingerprints", max_memory=0)
+        if forcetraining:
+            fprimes_db = FileDatabase("amp-data-fingerprint-primes", max_memory=0)
     for i, image in enumerate(traj):
         x = cffi_out[i]['x']
         dx = cffi_out[i]['dx']
@@ -262,12 +504,12 @@ def convert_simple_nn_fps(traj, Gs, cffi_out, forcetraining, cores, save):
         if forcetraining:
             x_der_dict = reorganize_simple_nn_derivative(image, dx)
         if save:
-            pickle.dump(x_list, open("./amp-data-fingerprints.ampdb/loose/" + im_hash, "wb"))
+            fp_db[im_hash] = x_list
             if forcetraining:
-                pickle.dump(
-                    x_der_dict, open("./amp-data-fingerprint-primes.ampdb/loose/" + im_hash, "wb")
-                )
-    return x_list, x_der_dict
+                fprimes_db[im_hash] = x_der_dict
+        fps.append(x_list)
+        fp_primes.append(x_der_dict)
+    return fps, fp_primes
 
 def reorganize_simple_nn_fp(image, x_dict):
     """
@@ -292,7 +534,7 @@ def reorganize_simple_nn_fp(image, x_dict):
     for i, sym in enumerate(syms):
         simple_nn_index = sym_dict[sym].index(i)
         fp = x_dict[sym][simple_nn_index]
-        fp_l.append((sym, list(fp)))
+        fp_l.append((sym, fp))
     return fp_l
 
 def reorganize_simple_nn_derivative(image, dx_dict):
@@ -324,6 +566,8 @@ def reorganize_simple_nn_derivative(image, dx_dict):
                         if (j, syms[j], true_i, element, k) not in d:
                             d[(j, syms[j], true_i, element, k)] = []
                         d[(j, syms[j], true_i, element, k)].append(derivative)
+    for key, derivatives in d.items():
+        d[key] = np.array(derivatives)
     # zero_keys = []
     # for key, derivatives in d.items():
         # zero_check = [a == 0 for a in derivatives]
@@ -373,18 +617,34 @@ def get_hash(atoms, Gs=None):
         for number in gs_values[4]:
             string += "%.15f" % number
         string += "%.15f" % gs_values[5]
+        if "species" in Gs:
+            string += json.dumps(Gs["species"], sort_keys=True)
 
     md5 = hashlib.md5(string.encode("utf-8"))
     hash = md5.hexdigest()
     return hash
 
-def stored_fps(traj, Gs, forcetraining):
-    image_hash = get_hash(traj[0], Gs)
-    with open("amp-data-fingerprints.ampdb/loose/"+image_hash, "rb") as f:
-        fps = load(f)
+def stored_fps(traj, Gs, forcetraining, computed=None):
+    """
+    returns lists of the fps and fp_primes (None without forcetraining) of
+    every image of traj. Those of images in computed, a dictionary of image
+    hash: (fps, fp_primes), are taken from it, the others are read from the
+    fingerprint databases.
+    """
+    if type(traj) != list:
+        traj = [traj]
+    computed = {} if computed is None else computed
+    fp_db = FileDatabase("amp-data-fingerprints", max_memory=0)
     if forcetraining:
-        with open("amp-data-fingerprint-primes.ampdb/loose/"+image_hash, "rb") as f:
-            fp_primes = load(f)
-    else:
-        fp_primes = None
+        fprimes_db = FileDatabase("amp-data-fingerprint-primes", max_memory=0)
+    fps, fp_primes = [], []
+    for image in traj:
+        image_hash = get_hash(image, Gs)
+        if image_hash in computed:
+            fp, fp_prime = computed[image_hash]
+        else:
+            fp = fp_db[image_hash]
+            fp_prime = fprimes_db[image_hash] if forcetraining else None
+        fps.append(fp)
+        fp_primes.append(fp_prime)
     return fps, fp_primes
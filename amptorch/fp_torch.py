@@ -0,0 +1,443 @@
+"""Gaussian (Behler-Parrinello) symmetry functions written in vectorized torch
+operations. Fingerprints are computed from positions and neighbor pair lists,
+so that fingerprint derivatives, and hence forces, come from autograd rather
+than from stored fingerprintprimes. The parameterization follows
+make_snn_params and the output matches wrap_symmetry_functions."""
+
+import copy
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import Dataset
+from ase.neighborlist import neighbor_list
+from amptorch.fp_simple_nn import make_snn_params, periodic_atoms
+from amptorch.data_utils import Transform
+from amptorch.precision import get_precision
+from amptorch.data_preprocess import fingerprint_masks, fingerprint_lengths
+
+
+def make_torch_params(Gs, elements):
+    """
+    makes the simple_nn parameter set of Gs for elements, in the same manner
+    as make_simple_nn_fps.
+    Parameters:
+        Gs (dict):
+            amptorch symmetry function parameters (G2_etas, G2_rs_s,
+            G4_etas, G4_zetas, G4_gammas, cutoff)
+        elements (list):
+            the atom types, in order, the descriptors are made for
+    returns:
+        params_set (dict)
+    """
+    G = copy.deepcopy(Gs)
+    cutoff = G["cutoff"]
+    G["G2_etas"] = [a / cutoff ** 2 for a in G["G2_etas"]]
+    G["G4_etas"] = [a / cutoff ** 2 for a in G["G4_etas"]]
+    return make_snn_params(
+        list(elements),
+        G["G2_etas"],
+        G["G2_rs_s"],
+        G["G4_etas"],
+        G["cutoff"],
+        G["G4_zetas"],
+        G["G4_gammas"],
+        species=G.get("species"),
+    )
+
+
+def make_pair_list(atoms, cutoff):
+    """
+    builds the neighbor pairs of an image within cutoff. Cells are periodic,
+    as in simple_nn (see amptorch.fp_simple_nn.periodic_atoms).
+    Parameters:
+        atoms (ASE atoms object)
+        cutoff (float)
+    returns:
+        a dictionary of numpy arrays: the center atoms "i", neighbor atoms
+        "j", cartesian periodic image "offsets" of the neighbors, and
+        "triplets", the pairs of pair indices sharing a center atom that
+        make up the angular terms.
+    """
+    i, j, S = neighbor_list("ijS", periodic_atoms(atoms), cutoff)
+    offsets = np.dot(S, atoms.cell.array)
+    counts = np.bincount(i, minlength=len(atoms))
+    starts = np.cumsum(counts) - counts
+    triplets = [np.zeros((2, 0), dtype=np.int64)]
+    for start, count in zip(starts, counts):
+        if count > 1:
+            triplets.append(start + np.stack(np.triu_indices(count, 1)))
+    return {
+        "i": i.astype(np.int64),
+        "j": j.astype(np.int64),
+        "offsets": offsets,
+        "triplets": np.concatenate(triplets, axis=1),
+    }
+
+
+def collate_pairs(pair_lists, num_atoms):
+    """Concatenates the pair lists of a batch of images into tensors, shifting
+    atom and pair indices to index into the batch."""
+    atom_shift = 0
+    pair_shift = 0
+    batch = {"i": [], "j": [], "offsets": [], "triplets": []}
+    for pairs, n_atoms in zip(pair_lists, num_atoms):
+        batch["i"].append(pairs["i"] + atom_shift)
+        batch["j"].append(pairs["j"] + atom_shift)
+        batch["offsets"].append(pairs["offsets"])
+        batch["triplets"].append(pairs["triplets"] + pair_shift)
+        atom_shift += n_atoms
+        pair_shift += len(pairs["i"])
+    return {
+        "i": torch.from_numpy(np.concatenate(batch["i"])),
+        "j": torch.from_numpy(np.concatenate(batch["j"])),
+        "offsets": torch.from_numpy(np.concatenate(batch["offsets"])),
+        "triplets": torch.from_numpy(np.concatenate(batch["triplets"], axis=1)),
+    }
+
+
+def cosine_cutoff(distances, cutoff):
+    return 0.5 * (torch.cos(np.pi * distances / cutoff) + 1) * (distances < cutoff)
+
+
+class SymmetryFunctions(nn.Module):
+    """Computes the G2 and G4 symmetry functions of a params_set, as made by
+    make_snn_params, from atomic positions. Elements with fewer symmetry
+    functions than others have their fingerprints zero-padded to fp_length.
+
+    Arguments:
+        params_set (dict): simple_nn parameter set. Element order determines
+            the atom types and the species indices of the parameters.
+    """
+
+    def __init__(self, params_set):
+        super(SymmetryFunctions, self).__init__()
+        self.elements = list(params_set.keys())
+        self.fp_lengths = [params_set[element]["num"] for element in self.elements]
+        self.fp_length = max(self.fp_lengths)
+        self.cutoff = max(
+            np.asarray(params_set[element]["d"]).reshape(-1, 4)[:, 0].max(initial=0)
+            for element in self.elements
+        )
+        self.g2_params = []
+        self.g4_params = []
+        for element in self.elements:
+            types = np.asarray(params_set[element]["i"], dtype=np.int64).reshape(-1, 3)
+            values = torch.tensor(
+                np.asarray(params_set[element]["d"]).reshape(-1, 4), dtype=torch.float64
+            )
+            g2 = np.nonzero(types[:, 0] == 2)[0]
+            g4 = np.nonzero(types[:, 0] == 4)[0]
+            self.g2_params.append(
+                {
+                    "columns": torch.from_numpy(g2),
+                    "species": torch.from_numpy(types[g2, 1] - 1),
+                    "cutoff": values[g2, 0],
+                    "eta": values[g2, 1],
+                    "rs": values[g2, 2],
+                }
+            )
+            self.g4_params.append(
+                {
+                    "columns": torch.from_numpy(g4),
+                    "species_1": torch.from_numpy(types[g4, 1] - 1),
+                    "species_2": torch.from_numpy(types[g4, 2] - 1),
+                    "cutoff": values[g4, 0],
+                    "eta": values[g4, 1],
+                    "zeta": values[g4, 2],
+                    "gamma": values[g4, 3],
+                }
+            )
+
+    def atom_types(self, symbols):
+        """Returns the index of each symbol in the element order."""
+        return torch.LongTensor([self.elements.index(symbol) for symbol in symbols])
+
+    def forward(self, positions, atom_types, pairs):
+        """Computes the fingerprints of a batch of atoms.
+
+        Q - Atoms in batch
+        P - Length of fingerprint
+
+        Arguments:
+            positions (torch.Tensor): Qx3 atomic positions.
+            atom_types (torch.LongTensor): Q element indices.
+            pairs (dict): Pair list tensors, see collate_pairs.
+
+        Returns a QxP tensor of fingerprints.
+        """
+        dtype = positions.dtype
+        i, j = pairs["i"], pairs["j"]
+        vectors = positions[j] - positions[i] + pairs["offsets"].to(dtype)
+        distances = vectors.norm(dim=1)
+        fingerprints = torch.zeros(
+            positions.size(0), self.fp_length, dtype=dtype, device=positions.device
+        )
+        center_types = atom_types[i]
+        neighbor_types = atom_types[j]
+
+        # radial (G2) terms, summed over neighbors
+        for element, params in enumerate(self.g2_params):
+            if len(params["columns"]) == 0:
+                continue
+            r = distances[:, None]
+            terms = (
+                torch.exp(-params["eta"].to(dtype) * (r - params["rs"].to(dtype)) ** 2)
+                * cosine_cutoff(r, params["cutoff"].to(dtype))
+                * (center_types == element)[:, None]
+                * (neighbor_types[:, None] == params["species"])
+            )
+            g2 = torch.zeros(
+                positions.size(0), len(params["columns"]), dtype=dtype,
+                device=positions.device
+            ).index_add(0, i, terms)
+            fingerprints = fingerprints.index_add(1, params["columns"], g2)
+
+        # angular (G4) terms, summed over unique pairs of neighbors
+        a, b = pairs["triplets"]
+        if a.numel() == 0:
+            return fingerprints
+        center = i[a]
+        r_ij = distances[a][:, None]
+        r_ik = distances[b][:, None]
+        r_jk = (vectors[b] - vectors[a]).norm(dim=1)[:, None]
+        cos_theta = ((vectors[a] * vectors[b]).sum(dim=1) / (r_ij * r_ik)[:, 0])[:, None]
+        type_j = neighbor_types[a][:, None]
+        type_k = neighbor_types[b][:, None]
+        for element, params in enumerate(self.g4_params):
+            if len(params["columns"]) == 0:
+                continue
+            eta = params["eta"].to(dtype)
+            zeta = params["zeta"].to(dtype)
+            cutoff = params["cutoff"].to(dtype)
+            species_1, species_2 = params["species_1"], params["species_2"]
+            match = ((type_j == species_1) & (type_k == species_2)) | (
+                (type_j == species_2) & (type_k == species_1)
+            )
+            terms = (
+                2 ** (1 - zeta)
+                * (1 + params["gamma"].to(dtype) * cos_theta).clamp(min=0) ** zeta
+                * torch.exp(-eta * (r_ij ** 2 + r_ik ** 2 + r_jk ** 2))
+                * cosine_cutoff(r_ij, cutoff)
+                * cosine_cutoff(r_ik, cutoff)
+                * cosine_cutoff(r_jk, cutoff)
+                * (center_types[a] == element)[:, None]
+                * match
+            )
+            g4 = torch.zeros(
+                positions.size(0), len(params["columns"]), dtype=dtype,
+                device=positions.device
+            ).index_add(0, center, terms)
+            fingerprints = fingerprints.index_add(1, params["columns"], g4)
+        return fingerprints
+
+
+def torch_symmetry_functions(atoms, params_set, calculate_derivatives=True):
+    """
+    drop-in replacement of wrap_symmetry_functions, computing the symmetry
+    functions of an image with SymmetryFunctions and their derivatives with
+    autograd.
+    Parameters:
+        atoms (ASE atoms object)
+        params_set (dict):
+            simple_nn parameter set, as made by make_snn_params
+        calculate_derivatives (bool):
+            if set to False, dx_out is None
+    returns:
+        x_out, dx_out in the format of wrap_symmetry_functions
+    """
+    symmetry_functions = SymmetryFunctions(params_set)
+    symbols = np.array(atoms.get_chemical_symbols())
+    atom_types = symmetry_functions.atom_types(symbols)
+    pairs = collate_pairs(
+        [make_pair_list(atoms, symmetry_functions.cutoff)], [len(atoms)]
+    )
+    positions = torch.tensor(atoms.get_positions(), dtype=torch.float64)
+    x = symmetry_functions(positions, atom_types, pairs)
+    dx = None
+    if calculate_derivatives:
+        dx = torch.autograd.functional.jacobian(
+            lambda positions: symmetry_functions(positions, atom_types, pairs),
+            positions,
+            vectorize=True,
+        )
+    x_out = {}
+    dx_out = None if dx is None else {}
+    for element, fp_length in zip(
+        symmetry_functions.elements, symmetry_functions.fp_lengths
+    ):
+        idx = np.nonzero(symbols == element)[0]
+        x_out[element] = x[idx, :fp_length].detach().numpy()
+        if dx is not None:
+            dx_out[element] = dx[idx, :fp_length].numpy()
+    return x_out, dx_out
+
+
+def collate_positions(images, symmetry_functions):
+    """
+    makes the inputs of amptorch.model.PositionsNN for a batch of images.
+    Parameters:
+        images (list of ASE atoms objects)
+        symmetry_functions (SymmetryFunctions)
+    returns:
+        [positions, atom types, image indices, number of images, pair list]
+    """
+    return stack_positions(
+        [atoms.get_positions() for atoms in images],
+        [
+            symmetry_functions.atom_types(atoms.get_chemical_symbols())
+            for atoms in images
+        ],
+        [make_pair_list(atoms, symmetry_functions.cutoff) for atoms in images],
+    )
+
+
+def stack_positions(positions, atom_types, pair_lists):
+    """
+    stacks the positions, atom types and pair lists of a batch of images
+    into the inputs of amptorch.model.PositionsNN.
+    returns:
+        [positions, atom types, image indices, number of images, pair list]
+    """
+    num_atoms = [len(image_positions) for image_positions in positions]
+    image_idx = np.repeat(np.arange(len(positions)), num_atoms)
+    return [
+        torch.from_numpy(np.concatenate(positions)),
+        torch.cat(atom_types),
+        torch.from_numpy(image_idx),
+        len(positions),
+        collate_pairs(pair_lists, num_atoms),
+    ]
+
+
+class PositionsDataset(Dataset):
+    """
+    Training data of amptorch.model.PositionsNN. Images are kept as positions,
+    atom types and neighbor pair lists, from which the model computes the
+    fingerprints, and with autograd their derivatives, in every forward pass.
+    Energy and force targets are scaled as in
+    amptorch.data_preprocess.AtomsDataset, and batches are collated by
+    collate, e.g. with skorch: iterator_train__collate_fn=dataset.collate.
+
+    Parameters:
+    -----------
+    images: list
+        Training images, with energies (and forces) available.
+
+    Gs: dict
+        Symmetry function parameters, see make_torch_params.
+
+    forcetraining: Boolean
+        True to include the force targets.
+
+    prune_tol: float
+        If provided, fingerprint columns are pruned per element as in
+        AtomsDataset, keeping the columns in fp_mask. Default: None
+
+    precision: str
+        Precision policy of the targets, see amptorch.precision. Default:
+        "float32"
+    """
+
+    def __init__(
+        self, images, Gs, forcetraining=True, prune_tol=None, precision="float32"
+    ):
+        self.images = images
+        self.Gs = Gs
+        self.forcetraining = forcetraining
+        self.precision = get_precision(precision)
+        self.delta = False
+        self.elements = []
+        for atoms in images:
+            for symbol in atoms.get_chemical_symbols():
+                if symbol not in self.elements:
+                    self.elements.append(symbol)
+        self.symmetry_functions = SymmetryFunctions(
+            make_torch_params(Gs, self.elements)
+        )
+        self.positions = [atoms.get_positions() for atoms in images]
+        self.atom_types = [
+            self.symmetry_functions.atom_types(atoms.get_chemical_symbols())
+            for atoms in images
+        ]
+        self.pair_lists = [
+            make_pair_list(atoms, self.symmetry_functions.cutoff) for atoms in images
+        ]
+        fingerprints = self.fingerprints()
+        self.fprange = {}
+        for element in self.symmetry_functions.elements:
+            fps = np.array(
+                [afp for image in fingerprints for atom, afp in image if atom == element]
+            )
+            self.fprange[element] = np.stack((fps.min(0), fps.max(0)), axis=1)
+        self.fp_mask = None
+        if prune_tol is not None:
+            self.fp_mask = fingerprint_masks(fingerprints, self.fprange, prune_tol)
+        self.fp_length = fingerprint_lengths(self.fprange, self.fp_mask)
+
+        dtype = self.precision.fingerprints
+        self.num_of_atoms = np.array([len(atoms) for atoms in images], dtype=float)
+        energies = np.array(
+            [atoms.get_potential_energy(apply_constraint=False) for atoms in images]
+        )
+        self.energy_dataset = torch.tensor(energies / self.num_of_atoms, dtype=dtype)
+        self.image_weights = torch.ones(len(images))
+        scale = Transform(self.energy_dataset)
+        self.energy_dataset = scale.norm(self.energy_dataset)
+        self.forces_dataset = []
+        if forcetraining:
+            for atoms, n_atoms in zip(images, self.num_of_atoms):
+                forces = torch.tensor(
+                    atoms.get_forces(apply_constraint=False) / n_atoms, dtype=dtype
+                )
+                self.forces_dataset.append(scale.norm(forces, energy=False))
+        self.scalings = [0, 0, scale]
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, index):
+        forces = self.forces_dataset[index] if self.forcetraining else None
+        return [
+            self.positions[index],
+            self.atom_types[index],
+            self.pair_lists[index],
+            self.energy_dataset[index],
+            forces,
+            self.image_weights[index],
+        ]
+
+    @torch.no_grad()
+    def fingerprints(self):
+        """Unscaled fingerprints of the images, as lists of (element,
+        fingerprint) pairs of per element lengths."""
+        elements = self.symmetry_functions.elements
+        fp_lengths = self.symmetry_functions.fp_lengths
+        fingerprints = []
+        for positions, atom_types, pair_list in zip(
+            self.positions, self.atom_types, self.pair_lists
+        ):
+            inputs = stack_positions([positions], [atom_types], [pair_list])
+            fps = self.symmetry_functions(inputs[0], inputs[1], inputs[4]).numpy()
+            fingerprints.append(
+                [
+                    (elements[atom_type], afp[: fp_lengths[atom_type]])
+                    for atom_type, afp in zip(atom_types.tolist(), fps)
+                ]
+            )
+        return fingerprints
+
+    def collate(self, batch):
+        """Collates a batch of items into the inputs of
+        amptorch.model.PositionsNN and the targets of
+        amptorch.model.CustomMSELoss, as collate_amp does for FullNN."""
+        positions, atom_types, pair_lists, energies, forces, weights = zip(*batch)
+        batch_size = len(batch)
+        inputs = stack_positions(list(positions), list(atom_types), list(pair_lists))
+        num_atoms = [len(image_positions) for image_positions in positions]
+        targets = [
+            torch.stack(energies).reshape(-1, 1),
+            torch.FloatTensor(num_atoms).reshape(batch_size, 1),
+            torch.cat(forces) if self.forcetraining else torch.tensor([]),
+            torch.stack(weights).reshape(batch_size, 1),
+        ]
+        return [inputs, targets]
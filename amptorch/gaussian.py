@@ -1,13 +1,22 @@
 """Modified utilities and descriptors extracted from AMP's source code"""
 
+import hashlib
 import os
 import pickle
+import queue
+import struct
 import tarfile
+import tempfile
+import threading
 import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from .utils import Cosine, dict2cutoff
 from ase.calculators.calculator import Parameters
 from copy import deepcopy
 from .utils import Logger
+from .profiling import profiler
 
 
 class SNN_Gaussian(object):
@@ -158,7 +167,7 @@ class SNN_Gaussian(object):
             self.neighborlist = Data(
                 filename="%s-neighborlists" % self.dblabel, calculator=calc
             )
-        self.neighborlist.calculate_items(images)
+        self.neighborlist.calculate_items(images, parallel=parallel)
 
         if not hasattr(self, "fingerprints"):
             self.fingerprints = Data(
@@ -209,6 +218,102 @@ class NeighborlistCalculator:
         return [n.get_neighbors(index) for index in range(len(image))]
 
 
+class IndexedArchive:
+    """Single-file container of pickled database entries with a footer index
+    of member offsets, allowing random access without scanning the file.
+
+    The layout is the concatenated members, followed by a pickled index
+    mapping each key to its (offset, length, compressed) triple, followed by
+    the offset of that index and a magic string. Members may individually be
+    zlib compressed.
+
+    Parameters
+    ----------
+    path : str
+        Location of the archive file.
+    """
+
+    magic = b"AMPARIDX"
+    footer = struct.Struct("<Q8s")
+
+    def __init__(self, path):
+        self.path = path
+        self._index = None
+        self._stamp = None
+
+    @property
+    def index(self):
+        """Dictionary of key: (offset, length, compressed), reloaded whenever
+        the archive file changes on disk."""
+        stat = os.stat(self.path)
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if self._index is None or stamp != self._stamp:
+            with open(self.path, "rb") as f:
+                f.seek(-self.footer.size, os.SEEK_END)
+                index_offset, magic = self.footer.unpack(f.read(self.footer.size))
+                if magic != self.magic:
+                    raise IOError("%s is not an indexed archive." % self.path)
+                f.seek(index_offset)
+                length = os.path.getsize(self.path) - self.footer.size - index_offset
+                self._index = pickle.loads(f.read(length))
+            self._stamp = stamp
+        return self._index
+
+    def keys(self):
+        return list(self.index.keys())
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def read(self, key):
+        """Returns the raw pickled bytes of key."""
+        offset, length, compressed = self.index[key]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            contents = f.read(length)
+        if compressed:
+            contents = zlib.decompress(contents)
+        return contents
+
+    @classmethod
+    def write(Cls, path, items, compress=False):
+        """Writes an archive at path from an iterable of (key, pickled bytes)
+        pairs. The archive is built in a temporary file and renamed into
+        place.
+
+        Parameters
+        ----------
+        path : str
+            Location of the archive file.
+        items : iterable
+            (key, bytes) pairs to be stored.
+        compress : bool
+            If True, each member is zlib compressed.
+        """
+        index = {}
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for key, contents in items:
+                    if compress:
+                        contents = zlib.compress(contents)
+                    index[key] = (f.tell(), len(contents), compress)
+                    f.write(contents)
+                index_offset = f.tell()
+                f.write(pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL))
+                f.write(Cls.footer.pack(index_offset, Cls.magic))
+            os.replace(tmppath, path)
+        except BaseException:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            raise
+        return Cls(path)
+
+
+# Default in-memory cache budget of a FileDatabase, in bytes.
+DEFAULT_CACHE_MEMORY = 2 ** 30
+
+
 class FileDatabase:
     """Using a database file, such as shelve or sqlitedict, that can handle
     multiple processes writing to the file is hard.
@@ -217,17 +322,24 @@ class FileDatabase:
     a separate file. This class behaves essentially like shelve, but saves each
     dictionary entry as a plain pickle file within the directory, with the
     filename corresponding to the dictionary key (which must be a string).
+    Entries are written atomically, and an md5 digest of each entry is kept
+    under 'hashes' so unchanged entries are not rewritten.
 
     Like shelve, this also keeps an internal (memory dictionary) representation
-    of the variables that have been accessed.
-
-    Also includes an archive feature, where files are instead added to a file
-    called 'archive.tar.gz' to save disk space. If an entry exists in both the
-    loose and archive formats, the loose is taken to be the new (correct)
-    value.
+    of the variables that have been accessed. This cache is bounded by
+    max_memory (in bytes, estimated from the size of the pickled entries) and
+    evicts the least recently used entries once the budget is exceeded. Set
+    max_memory to None for an unbounded cache or 0 to disable caching.
+
+    Also includes an archive feature, where loose files are compacted into a
+    single indexed file called 'archive.ampar' (see IndexedArchive) that can
+    be read at random-access speed. If an entry exists in both the loose and
+    archive formats, the loose is taken to be the new (correct) value. Legacy
+    'archive.tar.gz' archives are still read, and are folded into the indexed
+    archive the next time archive() is called.
     """
 
-    def __init__(self, filename):
+    def __init__(self, filename, max_memory=DEFAULT_CACHE_MEMORY):
         """Open the filename at specified location. flag is ignored; this
         format is always capable of both reading and writing."""
         if not filename.endswith(os.extsep + "ampdb"):
@@ -235,6 +347,9 @@ class FileDatabase:
         self.path = filename
         self.loosepath = os.path.join(self.path, "loose")
         self.tarpath = os.path.join(self.path, "archive.tar.gz")
+        self.archivepath = os.path.join(self.path, "archive.ampar")
+        self._archive = IndexedArchive(self.archivepath)
+        self.hashpath = os.path.join(self.path, "hashes")
         if not os.path.exists(self.path):
             try:
                 os.mkdir(self.path)
@@ -246,14 +361,34 @@ class FileDatabase:
                 os.mkdir(self.loosepath)
             except OSError:
                 pass
-        self._memdict = {}  # Items already accessed; stored in memory.
+        self.max_memory = max_memory
+        # Items already accessed; stored in memory in least to most recently
+        # used order, alongside their estimated sizes in bytes.
+        self._memdict = OrderedDict()
+        self._memsizes = {}
+        self._memory = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        """The in-memory cache and its lock are not pickled, such that the
+        database can be sent to other processes (e.g. DataLoader workers)."""
+        state = self.__dict__.copy()
+        state["_memdict"] = OrderedDict()
+        state["_memsizes"] = {}
+        state["_memory"] = 0
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
 
     @classmethod
-    def open(Cls, filename, flag=None):
+    def open(Cls, filename, flag=None, **kwargs):
         """Open present for compatibility with shelve. flag is ignored; this
         format is always capable of both reading and writing.
         """
-        return Cls(filename=filename)
+        return Cls(filename=filename, **kwargs)
 
     def close(self):
         """Only present for compatibility with shelve.
@@ -265,6 +400,8 @@ class FileDatabase:
         items.
         """
         keys = os.listdir(self.loosepath)
+        if os.path.exists(self.archivepath):
+            keys = list(set(keys + self._archive.keys()))
         if os.path.exists(self.tarpath):
             with tarfile.open(self.tarpath) as tf:
                 keys = list(set(keys + tf.getnames()))
@@ -281,16 +418,114 @@ class FileDatabase:
         return len(self.keys())
 
     def __setitem__(self, key, value):
-        self._memdict[key] = value
-        path = os.path.join(self.loosepath, str(key))
-        if os.path.exists(path):
-            with open(path, "rb") as f:
-                contents = self._repeat_read(f)
-                if pickle.dumps(contents) == pickle.dumps(value):
-                    # Using pickle as a hash...
+        key = str(key)
+        contents = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = hashlib.md5(contents).hexdigest()
+        path = os.path.join(self.loosepath, key)
+        digestpath = os.path.join(self.hashpath, key)
+        if os.path.exists(path) and os.path.exists(digestpath):
+            with open(digestpath, "r") as f:
+                if f.read() == digest:
+                    self._cache(key, value, len(contents))
                     return  # Nothing to update.
-        with open(path, "wb") as f:
-            pickle.dump(value, f, protocol=0)
+        # the digest is removed first, such that an interrupted write never
+        # leaves a digest beside contents it does not describe
+        if os.path.exists(digestpath):
+            os.remove(digestpath)
+        self._atomic_write(path, contents)
+        self._atomic_write(digestpath, digest.encode("utf-8"))
+        self._cache(key, value, len(contents))
+
+    def _atomic_write(self, path, contents):
+        """Writes contents to a temporary file alongside the database and
+        renames it into place, so concurrent readers never see a partially
+        written entry."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(contents)
+            os.replace(tmppath, path)
+        except BaseException:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            raise
+
+    def _cache(self, key, value, size):
+        """Stores value in the in-memory cache, evicting the least recently
+        used entries until the cache fits within max_memory."""
+        if self.max_memory is not None and size > self.max_memory:
+            return
+        with self._lock:
+            if key in self._memdict:
+                self._memory -= self._memsizes[key]
+            self._memdict[key] = value
+            self._memdict.move_to_end(key)
+            self._memsizes[key] = size
+            self._memory += size
+            if self.max_memory is None:
+                return
+            while self._memory > self.max_memory:
+                old_key, _ = self._memdict.popitem(last=False)
+                self._memory -= self._memsizes.pop(old_key)
+
+    def _read(self, key):
+        """Reads an item from disk, returning it alongside its size in bytes.
+        """
+        keypath = os.path.join(self.loosepath, key)
+        if os.path.exists(keypath):
+            with open(keypath, "rb") as f:
+                return self._repeat_read(f), os.path.getsize(keypath)
+        if os.path.exists(self.archivepath) and key in self._archive:
+            contents = self._archive.read(key)
+            return pickle.loads(contents), len(contents)
+        if os.path.exists(self.tarpath):
+            with tarfile.open(self.tarpath) as tf:
+                try:
+                    member = tf.getmember(key)
+                except KeyError:
+                    raise KeyError(str(key))
+                return pickle.load(tf.extractfile(member)), member.size
+        raise KeyError(str(key))
+
+    def archive(self, compress=False):
+        """Compacts all loose entries, along with any previously archived
+        ones, into the indexed archive and removes the loose files.
+
+        Parameters
+        ----------
+        compress : bool
+            If True, each archived entry is individually zlib compressed.
+            Reads stay random-access either way.
+        """
+        loose_keys = os.listdir(self.loosepath)
+
+        def items():
+            written = set(loose_keys)
+            for key in loose_keys:
+                with open(os.path.join(self.loosepath, key), "rb") as f:
+                    yield key, f.read()
+            if os.path.exists(self.archivepath):
+                for key in self._archive.keys():
+                    if key not in written:
+                        written.add(key)
+                        yield key, self._archive.read(key)
+            if os.path.exists(self.tarpath):
+                with tarfile.open(self.tarpath) as tf:
+                    for member in tf.getmembers():
+                        if member.name not in written:
+                            yield member.name, tf.extractfile(member).read()
+
+        self._archive = IndexedArchive.write(
+            self.archivepath, items(), compress=compress
+        )
+        if os.path.exists(self.tarpath):
+            os.remove(self.tarpath)
+        for key in loose_keys:
+            os.remove(os.path.join(self.loosepath, key))
+            digestpath = os.path.join(self.hashpath, key)
+            if os.path.exists(digestpath):
+                os.remove(digestpath)
 
     def _repeat_read(self, f, maxtries=5, sleep=0.2):
         """If one process is writing, the other process cannot read without
@@ -309,17 +544,38 @@ class FileDatabase:
         raise IOError("Too many file read attempts.")
 
     def __getitem__(self, key):
-        if key in self._memdict:
-            return self._memdict[key]
-        keypath = os.path.join(self.loosepath, key)
-        if os.path.exists(keypath):
-            with open(keypath, "rb") as f:
-                return self._repeat_read(f)
-        elif os.path.exists(self.tarpath):
-            with tarfile.open(self.tarpath) as tf:
-                return pickle.load(tf.extractfile(key))
-        else:
-            raise KeyError(str(key))
+        with self._lock:
+            if key in self._memdict:
+                self._memdict.move_to_end(key)
+                return self._memdict[key]
+        value, size = self._read(key)
+        profiler.count("bytes_read", size)
+        self._cache(key, value, size)
+        return value
+
+    def prefetch(self, keys, workers=None):
+        """Reads the requested items into the in-memory cache, overlapping
+        the file reads with a pool of threads. Keys already in memory are
+        skipped; keys beyond the memory budget simply evict older entries.
+
+        Parameters
+        ----------
+        keys : list of str
+            Keys to be read into memory.
+        workers : int
+            Number of reading threads. Defaults to the ThreadPoolExecutor
+            default.
+        """
+        if self.max_memory == 0:
+            return
+        with self._lock:
+            keys = [key for key in keys if key not in self._memdict]
+        if len(keys) == 0:
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for key, (value, size) in zip(keys, executor.map(self._read, keys)):
+                profiler.count("bytes_read", size)
+                self._cache(key, value, size)
 
     def update(self, newitems):
         for key, value in newitems.items():
@@ -344,23 +600,73 @@ class Data:
     >>> data.open()
     >>> keys = data.d.keys()
     >>> values = data.d.values()
+
+    Any additional keyword arguments, e.g. max_memory, are passed along to
+    the database when it is opened.
     """
 
-    def __init__(self, filename, db=FileDatabase, calculator=None):
+    def __init__(self, filename, db=FileDatabase, calculator=None, **db_kwargs):
         self.calc = calculator
         self.db = db
+        self.db_kwargs = db_kwargs
         self.filename = filename
         self.d = None
 
-    def calculate_items(self, images):
-        d = self.db.open(self.filename, "r")
+    def calculate_items(self, images, parallel=None):
+        """Calculates the items of images not already in the database.
+
+        Parameters
+        ----------
+        images : dict
+            Dictionary of hashed images.
+        parallel : dict
+            Configuration for parallelization, e.g. {"cores": 4}. The optional
+            "backend" entry selects a "process" (default) or "thread" pool.
+            Items are computed by the pool and written to the database by a
+            single writer thread.
+        """
+        d = self.db.open(self.filename, "r", **self.db_kwargs)
         calcs_needed = list(set(images.keys()).difference(d.keys()))
         d.close()
         if len(calcs_needed) == 0:
             return
-        d = self.db.open(self.filename, "c")
-        for key in calcs_needed:
-            d[key] = self.calc.calculate(images[key], key)
+        d = self.db.open(self.filename, "c", **self.db_kwargs)
+        cores = 1 if parallel is None else parallel.get("cores", 1)
+        if cores == 1 or len(calcs_needed) == 1:
+            for key in calcs_needed:
+                d[key] = self.calc.calculate(images[key], key)
+        else:
+            backend = parallel.get("backend", "process")
+            if backend == "process":
+                Executor = ProcessPoolExecutor
+            elif backend == "thread":
+                Executor = ThreadPoolExecutor
+            else:
+                raise ValueError(
+                    "Unknown backend: {}. Choose from process, thread.".format(backend)
+                )
+            results = queue.Queue(maxsize=4 * cores)
+            errors = []
+            writer = threading.Thread(target=_write_items, args=(d, results, errors))
+            writer.start()
+            try:
+                with Executor(max_workers=cores) as executor:
+                    chunksize = max(1, len(calcs_needed) // (4 * cores))
+                    values = executor.map(
+                        self.calc.calculate,
+                        [images[key] for key in calcs_needed],
+                        calcs_needed,
+                        chunksize=chunksize,
+                    )
+                    for key, value in zip(calcs_needed, values):
+                        if errors:
+                            break
+                        results.put((key, value))
+            finally:
+                results.put(None)
+                writer.join()
+            if errors:
+                raise errors[0]
         d.close()
         self.d = None
 
@@ -368,6 +674,14 @@ class Data:
         self.open()
         return self.d[key]
 
+    def prefetch(self, keys, workers=None):
+        """Bulk reads the items of keys into the database's in-memory cache,
+        if the database supports it.
+        """
+        self.open()
+        if hasattr(self.d, "prefetch"):
+            self.d.prefetch(keys, workers=workers)
+
     def close(self):
         """Safely close the database.
         """
@@ -379,13 +693,28 @@ class Data:
         """Open the database connection with mode specified.
         """
         if self.d is None:
-            self.d = self.db.open(self.filename, mode)
+            self.d = self.db.open(self.filename, mode, **self.db_kwargs)
 
     def __del__(self):
         self.close()
 
 
-def make_symmetry_functions(elements, type, etas, zetas=None, gammas=None):
+def _write_items(d, results, errors):
+    """Writer thread of Data.calculate_items; stores (key, value) pairs from
+    the results queue into the database d until None is received."""
+    while True:
+        item = results.get()
+        if item is None:
+            return
+        if errors:
+            continue
+        try:
+            d[item[0]] = item[1]
+        except Exception as e:
+            errors.append(e)
+
+
+def make_symmetry_functions(elements, type, etas, zetas=None, gammas=None, pairs=None):
     """Helper function to create Gaussian symmetry functions.
     Returns a list of dictionaries with symmetry function parameters
     in the format expected by the Gaussian class.
@@ -403,6 +732,9 @@ def make_symmetry_functions(elements, type, etas, zetas=None, gammas=None):
         zeta values to use in G4, and G5 fingerprints
     gammas : list of floats
         gamma values to use in G4, and G5 fingerprints
+    pairs : list of element pairs
+        Pairs of neighbor elements to use in G4 and G5 fingerprints, e.g. the
+        pairs occurring within the cutoff. Default: all pairs of elements
 
     Returns
     -------
@@ -417,40 +749,41 @@ def make_symmetry_functions(elements, type, etas, zetas=None, gammas=None):
             for element in elements
         ]
         return G
-    elif type == "G4":
+    if pairs is None:
+        pairs = [
+            [el1, el2] for i1, el1 in enumerate(elements) for el2 in elements[i1:]
+        ]
+    element_pairs = [sorted(pair) for pair in pairs]
+    if type == "G4":
         G = []
         for eta in etas:
             for zeta in zetas:
                 for gamma in gammas:
-                    for i1, el1 in enumerate(elements):
-                        for el2 in elements[i1:]:
-                            els = sorted([el1, el2])
-                            G.append(
-                                {
-                                    "type": "G4",
-                                    "elements": els,
-                                    "eta": eta,
-                                    "gamma": gamma,
-                                    "zeta": zeta,
-                                }
-                            )
+                    for els in element_pairs:
+                        G.append(
+                            {
+                                "type": "G4",
+                                "elements": list(els),
+                                "eta": eta,
+                                "gamma": gamma,
+                                "zeta": zeta,
+                            }
+                        )
         return G
     elif type == "G5":
         G = []
         for eta in etas:
             for zeta in zetas:
                 for gamma in gammas:
-                    for i1, el1 in enumerate(elements):
-                        for el2 in elements[i1:]:
-                            els = sorted([el1, el2])
-                            G.append(
-                                {
-                                    "type": "G5",
-                                    "elements": els,
-                                    "eta": eta,
-                                    "gamma": gamma,
-                                    "zeta": zeta,
-                                }
-                            )
+                    for els in element_pairs:
+                        G.append(
+                            {
+                                "type": "G5",
+                                "elements": list(els),
+                                "eta": eta,
+                                "gamma": gamma,
+                                "zeta": zeta,
+                            }
+                        )
         return G
     raise NotImplementedError("Unknown type: {}.".format(type))
@@ -4,6 +4,8 @@ constructed based off the unique number of atoms in the dataset."""
 
 import sys
 from collections import defaultdict
+import numpy as np
+from typing import Optional, Tuple
 import torch
 import torch.nn as nn
 from torch.nn import Tanh, Softplus, LeakyReLU
@@ -11,6 +13,8 @@ from torch.nn import init
 from torch.nn.init import xavier_uniform_, kaiming_uniform_
 from torch.autograd import grad
 from amptorch.utils import Logger
+from amptorch.profiling import profiled
+from amptorch.precision import get_precision
 
 __author__ = "Muhammed Shuaibi"
 __email__ = "mshuaibi@andrew.cmu.edu"
@@ -56,15 +60,48 @@ class MLP(nn.Module):
         return self.model_net(inputs)
 
 
+def input_width(architecture, element):
+    """Input width of an element's network: architecture[0] is either a single
+    fingerprint length or a dictionary of per element fingerprint lengths."""
+    if isinstance(architecture[0], dict):
+        return architecture[0][element]
+    return architecture[0]
+
+
+def ragged_index(starts, lengths):
+    """Flat indices of the concatenated ranges [start, start + length)."""
+    offsets = torch.cumsum(lengths, 0) - lengths
+    positions = torch.arange(int(lengths.sum()), device=lengths.device)
+    return torch.repeat_interleave(starts - offsets, lengths) + positions
+
+
+def fingerprint_gradient_index(idx, widths, rearange):
+    """Index reordering the concatenated element specific fingerprint
+    gradients, of atoms of images idx and fingerprint widths, into the 1xPQ
+    layout of the fingerprintprimes rows."""
+    boolean = idx[:, None] == torch.unique(idx)
+    ordered_idx = torch.nonzero(boolean.t(), as_tuple=False)[:, -1]
+    # atoms' rows, of per element widths, in the fprimes order
+    atom_order = torch.index_select(ordered_idx, 0, rearange)
+    starts = torch.cumsum(widths, 0) - widths
+    return ragged_index(starts[atom_order], widths[atom_order])
+
+
 class FullNN(nn.Module):
     """Combines element specific NNs into a model to predict energy of a given
-    structure
+    structure. architecture is [input length, # of layers, nodes/layer], where
+    the input length may be a dictionary of per element fingerprint lengths.
+
+    The networks are evaluated in the compute dtype of the precision policy
+    (see amptorch.precision), to which the inputs are cast, and atomic
+    energies are summed into image energies in its accumulate dtype before
+    being returned in the compute dtype.
 
     """
 
     def __init__(
         self, unique_atoms, architecture, device, forcetraining,
-        activation=Tanh, require_grd=True
+        activation=Tanh, require_grd=True, precision="float32"
     ):
         super(FullNN, self).__init__()
         self.device = device
@@ -72,19 +109,21 @@ class FullNN(nn.Module):
         self.forcetraining = forcetraining
         self.architecture = architecture
         self.activation_fn = activation
+        self.precision = get_precision(precision)
 
-        input_length = architecture[0]
         n_layers = architecture[1]
         n_hidden_size = architecture[2]
         self.elementwise_models = nn.ModuleDict()
         for element in unique_atoms:
             self.elementwise_models[element] = MLP(
-                n_input_nodes=input_length,
+                n_input_nodes=input_width(architecture, element),
                 n_layers=n_layers,
                 n_hidden_size=n_hidden_size,
                 activation=activation,
             )
+        self.to(self.precision.compute)
 
+    @profiled("FullNN.forward")
     def forward(self, inputs):
         """Forward pass through the model - predicting energy and forces
         accordingly.
@@ -93,27 +132,32 @@ class FullNN(nn.Module):
         Q - Atoms in batch
         P - Length of fingerprint"""
 
+        if not self.forcetraining:
+            return self.energy_forward(inputs)
+        compute = self.precision.compute
         with torch.enable_grad():
             input_data = inputs[0]
             batch_size = inputs[1]
             batch_elements = inputs[2]
             rearange = inputs[-1]
-            if self.device == 'cpu':
-                energy_pred = torch.zeros(batch_size, 1).to(self.device)
-            else:
-                energy_pred = torch.cuda.FloatTensor(batch_size, 1)
+            # Constructs an Nx1 tensor to accumulate element energy contributions
+            energy_pred = torch.zeros(
+                batch_size, 1, dtype=self.precision.accumulate, device=self.device
+            )
             force_pred = torch.tensor([])
-            # Constructs an Nx1 empty tensor to store element energy contributions
             if self.forcetraining:
-                fprimes = inputs[-2]
-                dE_dFP = torch.tensor([]).to(self.device)
+                fprimes = inputs[-2].to(compute)
+                dE_dFP = torch.tensor([], dtype=compute).to(self.device)
                 idx = torch.tensor([]).to(self.device)
+                widths = torch.tensor([], dtype=torch.long).to(self.device)
             for index, element in enumerate(batch_elements):
-                model_inputs = input_data[element][0]
+                model_inputs = input_data[element][0].to(compute)
                 model_inputs.requires_grad = True
-                contribution_index = torch.tensor(input_data[element][1]).to(self.device)
+                contribution_index = torch.as_tensor(input_data[element][1]).to(self.device)
                 atomwise_outputs = self.elementwise_models[element].forward(model_inputs)
-                energy_pred.index_add_(0, contribution_index, atomwise_outputs)
+                energy_pred.index_add_(
+                    0, contribution_index, atomwise_outputs.to(energy_pred.dtype)
+                )
                 if self.forcetraining:
                     gradients = grad(
                         energy_pred,
@@ -121,15 +165,22 @@ class FullNN(nn.Module):
                         grad_outputs=torch.ones_like(energy_pred),
                         create_graph=True,
                     )[0]
-                    dE_dFP = torch.cat((dE_dFP, gradients))
+                    dE_dFP = torch.cat((dE_dFP, gradients.reshape(-1)))
                     idx = torch.cat((idx, contribution_index.float()))
+                    widths = torch.cat(
+                        (
+                            widths,
+                            torch.full(
+                                (len(gradients),), gradients.size(1), dtype=torch.long
+                            ).to(self.device),
+                        )
+                    )
             if self.forcetraining:
                 """Constructs a 1xPQ tensor that contains the derivatives with respect to
                 each atom's fingerprint"""
-                boolean = idx[:, None] == torch.unique(idx)
-                ordered_idx = torch.nonzero(boolean.t(), as_tuple=False)[:, -1]
-                dE_dFP = torch.index_select(dE_dFP, 0, ordered_idx)
-                dE_dFP = torch.index_select(dE_dFP, 0, rearange).reshape(1, -1)
+                dE_dFP = torch.index_select(
+                    dE_dFP, 0, fingerprint_gradient_index(idx, widths, rearange)
+                ).reshape(1, -1)
                 """Sparse multiplication requires the first matrix to be
                 sparse.
                 Multiplies a 3QxPQ tensor with a PQx1 tensor to return a 3Qx1 tensor
@@ -139,8 +190,472 @@ class FullNN(nn.Module):
                 predictions in the same order and shape as the target forces calculated
                 from AMP."""
                 force_pred = force_pred.reshape(-1, 3)
+        return energy_pred.to(compute), force_pred
+
+    def energy_forward(self, inputs, chunk_size=None):
+        """Energy-only forward pass, taken by forward without forcetraining.
+        The element specific networks are evaluated without input gradients,
+        in chunks of chunk_size atoms if provided, and the atomic energies of
+        all elements are summed per image in a single index_add (segment sum
+        over the image index of every atom).
+
+        Returns the Nx1 energies and an empty force tensor."""
+        input_data = inputs[0]
+        batch_size = inputs[1]
+        atomwise_outputs = []
+        contribution_index = []
+        for element in inputs[2]:
+            fingerprints = input_data[element][0].to(self.device, self.precision.compute)
+            network = self.elementwise_models[element]
+            if chunk_size is None:
+                atomwise_outputs.append(network(fingerprints))
+            else:
+                atomwise_outputs.extend(
+                    network(chunk) for chunk in torch.split(fingerprints, chunk_size)
+                )
+            contribution_index.append(
+                torch.as_tensor(input_data[element][1]).to(self.device)
+            )
+        atomwise_outputs = torch.cat(atomwise_outputs).to(self.precision.accumulate)
+        energy_pred = atomwise_outputs.new_zeros(batch_size, 1).index_add_(
+            0, torch.cat(contribution_index), atomwise_outputs
+        )
+        return energy_pred.to(self.precision.compute), torch.tensor([])
+
+    @torch.no_grad()
+    def predict_energies(self, inputs, chunk_size=65536):
+        """Energy-only inference: energy_forward without autograd graphs, whose
+        activations are only kept for chunk_size atoms at a time, such that
+        very large batches are evaluated in bounded memory. Returns the Nx1
+        energies."""
+        return self.energy_forward(inputs, chunk_size)[0]
+
+
+class EnsembleMLP(nn.Module):
+    """K fully connected neural networks of identical architecture, evaluated
+    in one vectorized pass with batched matrix multiplications. Each member
+    is initialized as an MLP.
+
+    Arguments:
+        n_input_nodes: Number of input nodes
+        n_layers: Total number of layers in the neural networks
+        n_hidden_size: Number of neurons within each hidden layer
+        activation: Activation function to be utilized.
+        n_models: Number of networks K
+        n_output_nodes: Number of output nodes (Default=1)
+    """
+
+    def __init__(
+        self,
+        n_input_nodes,
+        n_layers,
+        n_hidden_size,
+        activation,
+        n_models,
+        n_output_nodes=1,
+    ):
+        super(EnsembleMLP, self).__init__()
+        if isinstance(n_hidden_size, int):
+            n_hidden_size = [n_hidden_size] * (n_layers)
+        self.n_neurons = [n_input_nodes] + n_hidden_size[: n_layers - 1] + [
+            n_output_nodes
+        ]
+        self.n_models = n_models
+        self.activation = activation()
+        self.weights = nn.ParameterList()
+        self.biases = nn.ParameterList()
+        for n_in, n_out in zip(self.n_neurons[:-1], self.n_neurons[1:]):
+            layers = [nn.Linear(n_in, n_out) for _ in range(n_models)]
+            self.weights.append(
+                nn.Parameter(torch.stack([layer.weight.data.t() for layer in layers]))
+            )
+            self.biases.append(
+                nn.Parameter(torch.stack([layer.bias.data[None] for layer in layers]))
+            )
+
+    def forward(self, inputs):
+        """Feeds data forward in the neural networks
+
+        Arguments:
+            inputs (torch.Tensor): KxQxP inputs of every network
+        """
+        outputs = inputs
+        for layer, (weight, bias) in enumerate(zip(self.weights, self.biases)):
+            outputs = torch.baddbmm(bias, outputs, weight)
+            if layer < len(self.weights) - 1:
+                outputs = self.activation(outputs)
+        return outputs
+
+
+class EnsembleNN(nn.Module):
+    """Ensemble of n_models FullNN models sharing the collated inputs, whose
+    element specific networks are evaluated in one vectorized forward pass.
+
+    Predictions carry a trailing member dimension, i.e. Nxn_models energies
+    and Qx3xn_models forces, see ensemble_statistics for their mean and
+    variance. Trained with EnsembleLoss, each member minimizes its own loss.
+    """
+
+    def __init__(
+        self, unique_atoms, architecture, device, forcetraining, n_models=5,
+        activation=Tanh
+    ):
+        super(EnsembleNN, self).__init__()
+        self.device = device
+        self.forcetraining = forcetraining
+        self.architecture = architecture
+        self.activation_fn = activation
+        self.n_models = n_models
+
+        self.elementwise_models = nn.ModuleDict()
+        for element in unique_atoms:
+            self.elementwise_models[element] = EnsembleMLP(
+                n_input_nodes=input_width(architecture, element),
+                n_layers=architecture[1],
+                n_hidden_size=architecture[2],
+                activation=activation,
+                n_models=n_models,
+            )
+
+    @classmethod
+    def from_models(cls, models):
+        """Stacks trained FullNN models of identical architecture into an
+        ensemble."""
+        model = models[0]
+        ensemble = cls(
+            list(model.elementwise_models.keys()),
+            model.architecture,
+            model.device,
+            model.forcetraining,
+            n_models=len(models),
+            activation=model.activation_fn,
+        )
+        for element, networks in ensemble.elementwise_models.items():
+            layers = [
+                [
+                    layer
+                    for layer in member.elementwise_models[element].model_net
+                    if isinstance(layer, nn.Linear)
+                ]
+                for member in models
+            ]
+            for index, (weight, bias) in enumerate(
+                zip(networks.weights, networks.biases)
+            ):
+                weight.data = torch.stack(
+                    [member[index].weight.data.t() for member in layers]
+                )
+                bias.data = torch.stack(
+                    [member[index].bias.data[None] for member in layers]
+                )
+        return ensemble
+
+    @profiled("EnsembleNN.forward")
+    def forward(self, inputs):
+        """Forward pass through the models - predicting energies and forces
+        of every member accordingly.
+
+        N - Number of training images
+        Q - Atoms in batch
+        P - Length of fingerprint
+        K - Number of models"""
+
+        with torch.enable_grad():
+            input_data = inputs[0]
+            batch_size = inputs[1]
+            batch_elements = inputs[2]
+            rearange = inputs[-1]
+            energy_pred = torch.zeros(batch_size, self.n_models).to(self.device)
+            force_pred = torch.tensor([])
+            if self.forcetraining:
+                fprimes = inputs[-2]
+                gradients = []
+                idx = []
+                widths = []
+            for element in batch_elements:
+                fingerprints = input_data[element][0].to(energy_pred.dtype)
+                contribution_index = torch.as_tensor(input_data[element][1]).to(self.device)
+                # a copy of the inputs per member, for per member derivatives
+                model_inputs = fingerprints.detach().unsqueeze(0).repeat(
+                    self.n_models, 1, 1
+                )
+                model_inputs.requires_grad = True
+                atomwise_outputs = self.elementwise_models[element](model_inputs)
+                energy_pred = energy_pred.index_add(
+                    0, contribution_index, atomwise_outputs[:, :, 0].t()
+                )
+                if self.forcetraining:
+                    dE_dFP = grad(
+                        atomwise_outputs,
+                        model_inputs,
+                        grad_outputs=torch.ones_like(atomwise_outputs),
+                        create_graph=True,
+                    )[0]
+                    gradients.append(dE_dFP.reshape(self.n_models, -1))
+                    idx.append(contribution_index.float())
+                    widths.append(
+                        torch.full(
+                            (fingerprints.size(0),), fingerprints.size(1),
+                            dtype=torch.long,
+                        ).to(self.device)
+                    )
+            if self.forcetraining:
+                # KxPQ derivatives with respect to each atom's fingerprint
+                order = fingerprint_gradient_index(
+                    torch.cat(idx), torch.cat(widths), rearange
+                )
+                dE_dFP = torch.index_select(torch.cat(gradients, 1), 1, order)
+                # 3QxPQ by PQxK, into Qx3xK forces
+                force_pred = -1 * torch.sparse.mm(
+                    fprimes.to(dE_dFP.dtype).t(), dE_dFP.t()
+                )
+                force_pred = force_pred.reshape(-1, 3, self.n_models)
+        return energy_pred, force_pred
+
+
+def ensemble_statistics(energy_pred, force_pred):
+    """Mean and (population) variance over the members of EnsembleNN
+    predictions, returned as energies, forces, energy variances and force
+    variances shaped as FullNN predictions."""
+    energy_var = energy_pred.var(-1, unbiased=False, keepdim=True)
+    energy_pred = energy_pred.mean(-1, keepdim=True)
+    force_var = force_pred
+    if force_pred.nelement() != 0:
+        force_var = force_pred.var(-1, unbiased=False)
+        force_pred = force_pred.mean(-1)
+    return energy_pred, force_pred, energy_var, force_var
+
+
+class PositionsNN(nn.Module):
+    """Combines element specific NNs with a SymmetryFunctions descriptor into
+    a model predicting energies directly from atomic positions. Forces are
+    obtained with autograd as -dE/dR, such that no fingerprintprimes are
+    required. Parameter names follow FullNN, so trained FullNN state dicts
+    can be loaded directly. Fingerprints are computed and scaled in float64,
+    and the networks evaluated as in FullNN under the precision policy.
+
+    Arguments:
+        unique_atoms (list): Elements to construct NNs for.
+        architecture (list): [input length, # of layers, nodes/layer], where
+            the input length may be a dictionary of per element lengths.
+        symmetry_functions (SymmetryFunctions): Descriptor, whose element
+            order defines the atom types.
+        fprange (dict): Fingerprint ranges used to scale fingerprints to
+            [-1, 1], as computed for the training dataset.
+        fp_mask (dict): Per element fingerprint columns kept by the training
+            dataset, see amptorch.fp_torch.PositionsDataset. (Default=None)
+        precision (str): Precision policy, see amptorch.precision.
+            (Default="float32")
+    """
+
+    def __init__(
+        self, unique_atoms, architecture, symmetry_functions, fprange,
+        device="cpu", forcetraining=True, activation=Tanh, fp_mask=None,
+        precision="float32"
+    ):
+        super(PositionsNN, self).__init__()
+        self.device = device
+        self.forcetraining = forcetraining
+        self.architecture = architecture
+        self.activation_fn = activation
+        self.precision = get_precision(precision)
+        self.symmetry_functions = symmetry_functions
+        # fingerprint scaling of scale_fingerprints as a per element linear map
+        slopes = []
+        offsets = []
+        # columns of the zero-padded fingerprints fed to each element network
+        self.fp_columns = []
+        fp_length = symmetry_functions.fp_length
+        for element, element_length in zip(
+            symmetry_functions.elements, symmetry_functions.fp_lengths
+        ):
+            fprange_atom = np.asarray(fprange[element], dtype=np.float64)
+            fprange_dif = fprange_atom[:, 1] - fprange_atom[:, 0]
+            scaled = np.nonzero(fprange_dif > (10.0 ** (-8.0)))[0]
+            slope = np.ones(fp_length)
+            offset = np.zeros(fp_length)
+            slope[scaled] = 2.0 / fprange_dif[scaled]
+            offset[scaled] = -1 - 2.0 * fprange_atom[scaled, 0] / fprange_dif[scaled]
+            slopes.append(slope)
+            offsets.append(offset)
+            if fp_mask is None:
+                columns = np.arange(element_length)
+            else:
+                columns = np.nonzero(fp_mask[element])[0]
+            self.fp_columns.append(torch.from_numpy(columns))
+        self.fp_slopes = torch.tensor(np.array(slopes))
+        self.fp_offsets = torch.tensor(np.array(offsets))
+
+        self.elementwise_models = nn.ModuleDict()
+        for element in unique_atoms:
+            self.elementwise_models[element] = MLP(
+                n_input_nodes=input_width(architecture, element),
+                n_layers=architecture[1],
+                n_hidden_size=architecture[2],
+                activation=activation,
+            )
+        self.to(self.precision.compute)
+
+    def forward(self, inputs):
+        """Forward pass through the model - predicting energy and forces
+        accordingly.
+
+        N - Number of images
+        Q - Atoms in batch
+
+        Arguments:
+            inputs (list): [Qx3 positions, Q atom types, Q image indices, N,
+                pair list], as made by amptorch.fp_torch.collate_positions.
+        """
+        positions, atom_types, image_idx, batch_size, pairs = inputs
+        compute = self.precision.compute
+        with torch.enable_grad():
+            positions = positions.to(torch.float64)
+            if self.forcetraining:
+                positions = positions.detach().requires_grad_(True)
+            fingerprints = self.symmetry_functions(positions, atom_types, pairs)
+            fingerprints = (
+                fingerprints * self.fp_slopes[atom_types]
+                + self.fp_offsets[atom_types]
+            )
+            energy_pred = torch.zeros(batch_size, 1, dtype=self.precision.accumulate)
+            for index, element in enumerate(self.symmetry_functions.elements):
+                atom_idx = torch.nonzero(atom_types == index).flatten()
+                if len(atom_idx) == 0:
+                    continue
+                model_inputs = fingerprints.index_select(0, atom_idx).index_select(
+                    1, self.fp_columns[index]
+                )
+                atomwise_outputs = self.elementwise_models[element](
+                    model_inputs.to(compute)
+                )
+                energy_pred = energy_pred.index_add(
+                    0, image_idx[atom_idx], atomwise_outputs.to(energy_pred.dtype)
+                )
+            force_pred = torch.tensor([])
+            if self.forcetraining:
+                force_pred = -1 * grad(
+                    energy_pred.sum(), positions, create_graph=self.training
+                )[0].to(compute)
+        return energy_pred.to(compute), force_pred
+
+
+class InferenceNN(nn.Module):
+    """Inference-only counterpart of FullNN with a tensor-only signature, such
+    that it can be compiled with torch.jit.script, frozen and saved.
+
+    Arguments:
+        model (FullNN): Trained model whose element specific networks are
+            reused. Element ids index into the model's element order.
+        scale (Transform): Target scaling of the training data. If provided,
+            predictions are returned in unscaled units. (Default=None)
+    """
+
+    def __init__(self, model, scale=None):
+        super(InferenceNN, self).__init__()
+        self.elements = list(model.elementwise_models.keys())
+        self.elementwise_models = nn.ModuleList(
+            [model.elementwise_models[element] for element in self.elements]
+        )
+        self.input_widths = [
+            model.elementwise_models[element].n_neurons[0] for element in self.elements
+        ]
+        mean, std = 0.0, 1.0
+        if scale is not None:
+            mean, std = float(scale.mean), float(scale.std)
+        # inputs are cast to the dtype of the networks
+        dtype = next(model.parameters()).dtype
+        self.register_buffer("energy_mean", torch.tensor(mean, dtype=dtype))
+        self.register_buffer("energy_std", torch.tensor(std, dtype=dtype))
+
+    def forward(
+        self,
+        fingerprints,
+        element_ids,
+        image_idx,
+        num_images: int,
+        fprimes: Optional[torch.Tensor] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Predicts energies and, if fingerprint derivatives are provided,
+        forces of a batch of images.
+
+        Q - Atoms in batch
+        P - Length of fingerprint
+
+        Arguments:
+            fingerprints (torch.Tensor): QxP scaled fingerprints, ordered by
+                image and by atom within each image. Fingerprints shorter than
+                P (per element widths) are zero-padded.
+            element_ids (torch.LongTensor): Q element indices.
+            image_idx (torch.LongTensor): Q image indices.
+            num_images (int): Number of images in the batch.
+            fprimes (torch.sparse.FloatTensor): PQx3Q fingerprint derivatives,
+                with rows following the padded fingerprints.
+                Forces are only computed if provided, which requires gradient
+                mode to be enabled.
+        """
+        fingerprints = fingerprints.to(self.energy_mean.dtype)
+        if fprimes is not None:
+            fingerprints = fingerprints.detach().requires_grad_(True)
+        atomwise_energies = torch.zeros(
+            fingerprints.size(0), 1, dtype=fingerprints.dtype,
+            device=fingerprints.device
+        )
+        for element_id, network in enumerate(self.elementwise_models):
+            atom_idx = torch.nonzero(element_ids == element_id).flatten()
+            width = self.input_widths[element_id]
+            atomwise_energies = atomwise_energies.index_copy(
+                0, atom_idx, network(fingerprints.index_select(0, atom_idx)[:, :width])
+            )
+        energy_pred = torch.zeros(
+            num_images, 1, dtype=fingerprints.dtype, device=fingerprints.device
+        ).index_add(0, image_idx, atomwise_energies)
+        force_pred = torch.zeros(0, 3)
+        if fprimes is not None:
+            dE_dFP = torch.autograd.grad(
+                [energy_pred.sum()], [fingerprints]
+            )[0]
+            assert dE_dFP is not None
+            force_pred = -1 * torch.mm(
+                fprimes.to(dE_dFP.dtype).t(), dE_dFP.reshape(-1, 1)
+            )
+            force_pred = force_pred.reshape(-1, 3)
+        num_atoms = torch.zeros(num_images, 1, dtype=fingerprints.dtype).index_add(
+            0, image_idx, torch.ones(image_idx.size(0), 1, dtype=fingerprints.dtype)
+        )
+        # no_grad rather than detach, which freezing removes
+        with torch.no_grad():
+            energy_pred = energy_pred * self.energy_std + self.energy_mean * num_atoms
+            force_pred = force_pred * self.energy_std
         return energy_pred, force_pred
 
+
+def script_model(model, scale=None, filename=None):
+    """Compiles a trained FullNN into a frozen TorchScript InferenceNN module.
+    If filename is provided the module is saved with torch.jit.save, after
+    which it can be loaded with torch.jit.load without amptorch installed."""
+    if isinstance(model, EnsembleNN):
+        raise NotImplementedError("TorchScript export of ensembles is not supported.")
+    module = torch.jit.script(InferenceNN(model, scale).eval())
+    module = torch.jit.freeze(module, preserved_attrs=["elements"])
+    if filename is not None:
+        torch.jit.save(module, filename)
+    return module
+
+
+def target_weights(target):
+    """Returns the per image weights of a batch target, i.e. the multiplicity
+    of images collapsed from duplicates (see collate_amp), alongside their
+    extension to every atom of the images. Targets without weights are
+    weighted equally."""
+    num_atoms = target[1]
+    weights = target[3] if len(target) > 3 else torch.ones_like(num_atoms)
+    weights_extended = torch.cat(
+        [weight.repeat(int(n)) for weight, n in zip(weights, num_atoms)]
+    ).reshape(-1, 1)
+    return weights, weights_extended
+
+
 class CustomMSELoss(nn.Module):
     """Custom loss function to be optimized by the regression. Includes aotmic
     energy and force contributions.
@@ -152,6 +667,7 @@ class CustomMSELoss(nn.Module):
         super(CustomMSELoss, self).__init__()
         self.alpha = force_coefficient
 
+    @profiled("loss")
     def forward(
         self,
         prediction,
@@ -160,23 +676,27 @@ class CustomMSELoss(nn.Module):
         energy_pred = prediction[0]
         energy_targets_per_atom = target[0]
         num_atoms = target[1]
-        MSE_loss = nn.MSELoss(reduction="sum")
+        weights, weights_extended = target_weights(target)
+        MSE_loss = nn.MSELoss(reduction="none")
         energy_pred_per_atom = torch.div(energy_pred, num_atoms)
-        energy_loss = MSE_loss(energy_pred_per_atom, energy_targets_per_atom)
+        energy_loss = torch.sum(
+            weights * MSE_loss(energy_pred_per_atom, energy_targets_per_atom)
+        )
 
         if self.alpha > 0:
             force_pred = prediction[1]
             if force_pred.nelement() == 0:
                 raise Exception('Force training disabled. Set force_coefficient to 0')
-            force_targets_per_atom = target[-1]
+            force_targets_per_atom = target[2]
             num_atoms_extended = torch.cat([idx.repeat(int(idx)) for idx in num_atoms])
             num_atoms_extended = torch.sqrt(
                 num_atoms_extended.reshape(-1, 1)
             )
             force_pred_per_atom = torch.div(force_pred, num_atoms_extended)
             force_targets_per_atom = force_targets_per_atom*num_atoms_extended
-            force_loss = (self.alpha / 3) * MSE_loss(
-                force_pred_per_atom, force_targets_per_atom
+            force_loss = (self.alpha / 3) * torch.sum(
+                weights_extended
+                * MSE_loss(force_pred_per_atom, force_targets_per_atom)
             )
             loss = 0.5 * (energy_loss + force_loss)
         else:
@@ -188,6 +708,7 @@ class MAELoss(nn.Module):
         super(MAELoss, self).__init__()
         self.alpha = force_coefficient
 
+    @profiled("loss")
     def forward(
         self,
         prediction,
@@ -196,22 +717,24 @@ class MAELoss(nn.Module):
         energy_pred = prediction[0]
         energy_targets = target[0]
         num_atoms = target[1]
-        MAE_loss = nn.L1Loss(reduction="sum")
+        weights, weights_extended = target_weights(target)
+        MAE_loss = nn.L1Loss(reduction="none")
         energy_per_atom = torch.div(energy_pred, num_atoms)
         targets_per_atom = torch.div(energy_targets, num_atoms)
-        energy_loss = MAE_loss(energy_per_atom, targets_per_atom)
+        energy_loss = torch.sum(weights * MAE_loss(energy_per_atom, targets_per_atom))
 
         if self.alpha > 0:
             force_pred = prediction[1]
             if force_pred.nelement() == 0:
                 raise Exception('Force training disabled. Set force_coefficient to 0')
-            force_targets = target[-1]
+            force_targets = target[2]
             num_atoms_force = torch.cat([idx.repeat(int(idx)) for idx in num_atoms])
             num_atoms_force = num_atoms_force.reshape(len(num_atoms_force), 1)
             force_pred_per_atom = torch.div(force_pred, num_atoms_force)
             force_targets_per_atom = torch.div(force_targets, num_atoms_force)
-            force_loss = (self.alpha / 3) * MAE_loss(
-                force_pred_per_atom, force_targets_per_atom
+            force_loss = (self.alpha / 3) * torch.sum(
+                weights_extended
+                * MAE_loss(force_pred_per_atom, force_targets_per_atom)
             )
             loss = 0.5 * (energy_loss + force_loss)
         else:
@@ -223,6 +746,7 @@ class HuberLoss(nn.Module):
         super(HuberLoss, self).__init__()
         self.alpha = force_coefficient
 
+    @profiled("loss")
     def forward(
         self,
         prediction,
@@ -231,25 +755,52 @@ class HuberLoss(nn.Module):
         energy_pred = prediction[0]
         energy_targets = target[0]
         num_atoms = target[1]
+        weights, weights_extended = target_weights(target)
         huber_loss = nn.SmoothL1Loss(reduction="none")
         energy_per_atom = torch.div(energy_pred, num_atoms)
         targets_per_atom = torch.div(energy_targets, num_atoms)
         energy_loss = huber_loss(energy_per_atom, targets_per_atom)
-        energy_loss = torch.sum(energy_loss)
+        energy_loss = torch.sum(weights * energy_loss)
 
         if self.alpha > 0:
             force_pred = prediction[1]
             if force_pred.nelement() == 0:
                 raise Exception('Force training disabled. Set force_coefficient to 0')
-            force_targets = target[-1]
+            force_targets = target[2]
             num_atoms_force = torch.cat([idx.repeat(int(idx)) for idx in num_atoms]).reshape(-1, 1)
             force_pred_per_atom = torch.div(force_pred, num_atoms_force)
             force_targets_per_atom = torch.div(force_targets, num_atoms_force)
             force_loss = (self.alpha / 3) * huber_loss(
                 force_pred_per_atom, force_targets_per_atom
             )
-            force_loss = torch.sum(force_loss)
+            force_loss = torch.sum(weights_extended * force_loss)
             loss = energy_loss + force_loss
         else:
             loss = energy_loss
         return loss
+
+
+class EnsembleLoss(nn.Module):
+    """Sum of a loss function over the members of EnsembleNN predictions, such
+    that every member is trained as it would be on its own.
+
+    Arguments:
+        loss: Loss function applied to each member (Default=CustomMSELoss)
+        kwargs: Arguments of loss, e.g. force_coefficient
+    """
+
+    def __init__(self, loss=CustomMSELoss, **kwargs):
+        super(EnsembleLoss, self).__init__()
+        self.loss = loss(**kwargs)
+
+    def forward(self, prediction, target):
+        energy_pred, force_pred = prediction
+        loss = 0
+        for member in range(energy_pred.size(-1)):
+            member_forces = force_pred
+            if force_pred.nelement() != 0:
+                member_forces = force_pred[..., member]
+            loss = loss + self.loss(
+                (energy_pred[:, member : member + 1], member_forces), target
+            )
+        return loss
@@ -0,0 +1,57 @@
+"""Precision policies: the dtypes in which fingerprints (and force and energy
+targets) and fingerprint derivatives are stored, in which the element
+specific networks are evaluated, and in which atomic energies are summed
+into image energies.
+
+    ==========  ============  ========  =======  ==========
+    Policy      Fingerprints  Primes    Compute  Accumulate
+    ==========  ============  ========  =======  ==========
+    float64     float64       float64   float64  float64
+    float32     float32       float32   float32  float64
+    bfloat16    float32       bfloat16  float32  float64
+    ==========  ============  ========  =======  ==========
+
+float32, the default, halves the memory of the stored fingerprints and
+fingerprintprimes with respect to the float64 fingerprinting output, and
+bfloat16 halves that of the fingerprintprimes once more, at a relative
+precision of ~1e-2 of the individual derivatives.
+"""
+
+from collections import namedtuple
+import numpy as np
+import torch
+
+Precision = namedtuple(
+    "Precision", ["name", "fingerprints", "primes", "compute", "accumulate"]
+)
+
+PRECISIONS = {
+    "float64": Precision(
+        "float64", torch.float64, torch.float64, torch.float64, torch.float64
+    ),
+    "float32": Precision(
+        "float32", torch.float32, torch.float32, torch.float32, torch.float64
+    ),
+    "bfloat16": Precision(
+        "bfloat16", torch.float32, torch.bfloat16, torch.float32, torch.float64
+    ),
+}
+
+
+def get_precision(precision):
+    """Returns the Precision of a policy name, see PRECISIONS. Precision
+    instances are returned as is."""
+    if isinstance(precision, Precision):
+        return precision
+    if precision not in PRECISIONS:
+        raise ValueError(
+            "Unknown precision: {}. Choose from {}.".format(
+                precision, ", ".join(PRECISIONS)
+            )
+        )
+    return PRECISIONS[precision]
+
+
+def numpy_dtype(dtype):
+    """numpy counterpart of a floating point torch dtype."""
+    return torch.empty(0, dtype=dtype).numpy().dtype
@@ -0,0 +1,160 @@
+"""Lightweight instrumentation of the amptorch pipeline: named timing spans
+around its stages (hashing, fingerprinting, preprocessing, collation, forward
+passes, losses and scoring) and counters of the work done (images, atoms,
+fingerprintprimes nonzeros, bytes read).
+
+Profiling is disabled by default, in which case spans and counters cost a
+single attribute check. Usage:
+
+    >>> from amptorch.profiling import profiler
+    >>> profiler.enable()
+    >>> ...  # construct datasets, train, predict
+    >>> profiler.log_summary(Logger("profile.txt"))
+    >>> profiler.save_trace("trace.json")
+
+Spans are only recorded in the process enabling the profiler, i.e. not in
+DataLoader worker processes.
+"""
+
+import os
+import json
+import time
+import functools
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+
+class Profiler:
+    """Collects timing spans and counters. A single instance, profiler, is
+    shared by the instrumented stages."""
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """Discards the recorded spans and counters."""
+        with self._lock:
+            self.events = []
+            self.counters = OrderedDict()
+            self._start = time.perf_counter()
+
+    @contextmanager
+    def span(self, name, **args):
+        """Times the enclosed block as a span called name. Keyword arguments
+        are recorded alongside the span, e.g. the size of its input."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.events.append(
+                    {
+                        "name": name,
+                        "start": start - self._start,
+                        "duration": end - start,
+                        "thread": threading.get_ident(),
+                        "args": args,
+                    }
+                )
+
+    def count(self, name, value=1):
+        """Increments the counter name by value."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """Aggregates the spans by name, in order of first occurrence.
+
+        Returns a dictionary of span names to their number of calls, total,
+        mean and maximum durations in seconds."""
+        summary = OrderedDict()
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            stats = summary.setdefault(
+                event["name"], {"calls": 0, "total": 0.0, "max": 0.0}
+            )
+            stats["calls"] += 1
+            stats["total"] += event["duration"]
+            stats["max"] = max(stats["max"], event["duration"])
+        for stats in summary.values():
+            stats["mean"] = stats["total"] / stats["calls"]
+        return summary
+
+    def log_summary(self, log):
+        """Writes the span summary and the counters as tables through log,
+        an amptorch.utils.Logger."""
+        header = "%-28s %7s %12s %12s %12s"
+        log("Profile summary:")
+        log(header % ("Span", "Calls", "Total (s)", "Mean (s)", "Max (s)"))
+        log(header % ("=" * 28, "=" * 7, "=" * 12, "=" * 12, "=" * 12))
+        for name, stats in self.summary().items():
+            log(
+                "%-28s %7i %12.4f %12.4f %12.4f"
+                % (name, stats["calls"], stats["total"], stats["mean"], stats["max"])
+            )
+        if self.counters:
+            log("%-28s %20s" % ("Counter", "Value"))
+            log("%-28s %20s" % ("=" * 28, "=" * 20))
+            for name, value in self.counters.items():
+                log("%-28s %20s" % (name, value))
+
+    def save_trace(self, filename):
+        """Saves the spans in the Chrome trace event JSON format, viewable in
+        chrome://tracing or Perfetto, alongside the counters."""
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+        trace = {
+            "traceEvents": [
+                {
+                    "name": event["name"],
+                    "ph": "X",
+                    "ts": event["start"] * 1e6,
+                    "dur": event["duration"] * 1e6,
+                    "pid": pid,
+                    "tid": event["thread"],
+                    "args": event["args"],
+                }
+                for event in events
+            ],
+            "displayTimeUnit": "ms",
+            "counters": counters,
+        }
+        with open(filename, "w") as f:
+            json.dump(trace, f)
+
+
+profiler = Profiler()
+
+
+def profiled(name):
+    """Decorator timing every call of the decorated function as a span."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with profiler.span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
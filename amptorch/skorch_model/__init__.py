@@ -2,10 +2,13 @@
 
 import os
 import copy
+import importlib
 import numpy as np
 import time
 from torch.utils.data import DataLoader
+from skorch import NeuralNetRegressor
 from amptorch.utils import Logger, hash_images, get_hash
+from amptorch.profiling import profiler
 from amptorch.skorch_model.utils import (
     make_force_header,
     make_energy_header,
@@ -19,9 +22,19 @@ from amptorch.data_preprocess import (
     collate_amp,
     TestDataset,
 )
-from amptorch.model import FullNN, CustomMSELoss
+from amptorch.model import (
+    FullNN,
+    EnsembleNN,
+    CustomMSELoss,
+    script_model,
+    ensemble_statistics,
+)
+from amptorch.skorch_model.distributed import DistributedTrainer
+from amptorch.data_utils import Transform
+from amptorch.delta_models.morse import morse_potential
 from ase.calculators.calculator import Calculator, Parameters
 import torch
+import torch.distributed as dist
 
 __author__ = "Muhammed Shuaibi"
 __email__ = "mshuaibi@andrew.cmu.edu"
@@ -39,12 +52,26 @@ class AMP(Calculator):
     label : str
         Location to save the trained model.
 
+    energy_only : bool
+        If True, energy-only calculations (e.g. get_potential_energy) take the
+        energy-only inference path, without fingerprint derivatives, such
+        that subsequent force requests fingerprint the image again. By
+        default energies and forces are calculated together. Default: False
+
+    Models may be an EnsembleNN, in which case predictions are the ensemble
+    mean, and their variances are available through predict(...,
+    uncertainty=True) and the "energy_variance" and "forces_variance"
+    results.
+
     """
 
     implemented_properties = ["energy", "forces"]
 
-    def __init__(self, training_data, model, label, save_logs=True):
+    def __init__(
+        self, training_data, model, label, save_logs=True, energy_only=False
+    ):
         Calculator.__init__(self)
+        self.energy_only = energy_only
 
         os.makedirs("results/", exist_ok=True)
         os.makedirs("results/trained_models", exist_ok=True)
@@ -52,6 +79,7 @@ class AMP(Calculator):
         self.model = model
         self.testlabel = label
         self.label = "".join(["results/trained_models/", label, ".pt"])
+        self.bundle_label = "".join(["results/trained_models/", label, "_bundle.pt"])
         self.scalings = training_data.scalings
         self.target_ref_per_atom = self.scalings[0]
         self.delta_ref_per_atom = self.scalings[1]
@@ -59,7 +87,9 @@ class AMP(Calculator):
         self.delta = training_data.delta
         self.Gs = training_data.Gs
         self.fprange = training_data.fprange
+        self.fp_mask = training_data.fp_mask
         self.descriptor = training_data.base_descriptor
+        self.elements = training_data.elements
         self.cores = training_data.cores
         self.training_data = training_data
         if self.delta:
@@ -67,7 +97,12 @@ class AMP(Calculator):
             self.delta_model = self.training_data.delta_data[4]
 
         # TODO make utility logging function
-        self.log = Logger("results/logs/{}.txt".format(label))
+        self.rank = dist.get_rank() if dist.is_initialized() else 0
+        if self.rank == 0:
+            self.log = Logger("results/logs/{}.txt".format(label))
+        else:
+            # only rank 0 logs in distributed training
+            self.log = Logger(None)
         if not self.delta:
             self.log(time.asctime())
             self.log("-" * 50)
@@ -109,17 +144,186 @@ class AMP(Calculator):
             )
 
     def train(self, overwrite=True):
-        # TODO Store training settings (scalings, etc.) alongside model
-        # parameters. Necessary for more efficient loading.
         self.model.fit(self.training_data, None)
         log_results(self.model, self.log)
+        if profiler.enabled:
+            profiler.log_summary(self.log)
         if os.path.exists(self.label):
             if overwrite is False:
                 print("Could not save! File already exists")
             else:
                 self.model.save_params(f_params=self.label)
+                self.save_bundle(self.bundle_label)
         else:
             self.model.save_params(f_params=self.label)
+            self.save_bundle(self.bundle_label)
+
+    def train_distributed(self, overwrite=True, sampler=None):
+        """Trains the model data-parallel across the processes of an initialized
+        torch.distributed process group (see
+        amptorch.skorch_model.distributed.init_process_group); every process
+        constructs its AMP calculator and calls train_distributed. The
+        criterion, optimizer, learning rate and epochs of the skorch model are
+        used, with batch_size split across the processes. Rank 0 logs and
+        saves the trained model."""
+        net = self.model
+        world_size = dist.get_world_size()
+        batch_size = None
+        if net.batch_size not in (None, -1):
+            batch_size = int(np.ceil(net.batch_size / world_size))
+        optimizer_kwargs = net._get_params_for("optimizer")
+        optimizer_kwargs.setdefault("lr", net.lr)
+        trainer = DistributedTrainer(
+            net.module,
+            net.criterion(**net._get_params_for("criterion")),
+            optimizer=net.optimizer,
+            batch_size=batch_size,
+            max_epochs=net.max_epochs,
+            log=self.log,
+            **optimizer_kwargs
+        )
+        trainer.fit(self.training_data, sampler=sampler)
+        if self.rank == 0:
+            if os.path.exists(self.label) and overwrite is False:
+                print("Could not save! File already exists")
+            else:
+                torch.save(net.module.state_dict(), self.label)
+                self.save_bundle(self.bundle_label)
+        dist.barrier()
+        return trainer
+
+    def save_bundle(self, filename):
+        '''
+        Saves a standalone model bundle: the model parameters and architecture
+        alongside the fingerprint ranges and mask, target scalings, symmetry
+        function parameters and delta model settings needed for inference.
+        Loading it with AMP.from_bundle does not require the training dataset.
+        ------------------
+
+        filename: str.
+            Path to save the bundle to.'''
+        module = self.model.module
+        bundle = {
+            "state_dict": module.state_dict(),
+            "architecture": list(module.architecture),
+            "n_models": getattr(module, "n_models", None),
+            "precision": module.precision.name if isinstance(module, FullNN) else None,
+            "elements": [str(element) for element in self.elements],
+            "activation": module.activation_fn.__name__,
+            "descriptor": "{}.{}".format(
+                self.descriptor.__module__, self.descriptor.__name__
+            ),
+            "Gs": {
+                key: np.asarray(value).tolist() for key, value in self.Gs.items()
+            },
+            "fprange": {
+                str(element): torch.tensor(np.asarray(value))
+                for element, value in self.fprange.items()
+            },
+            "fp_mask": None
+            if self.fp_mask is None
+            else {
+                str(element): torch.tensor(np.asarray(mask))
+                for element, mask in self.fp_mask.items()
+            },
+            "scalings": [
+                float(self.target_ref_per_atom),
+                float(self.delta_ref_per_atom),
+            ],
+            "scale": {"mean": self.scale.mean, "std": self.scale.std},
+            "delta": None,
+        }
+        if self.delta:
+            bundle["delta"] = {
+                "params": self.params,
+                "cutoff": float(self.delta_model.cutoff),
+                "combo": self.delta_model.combo,
+            }
+        torch.save(bundle, filename)
+
+    @classmethod
+    def from_bundle(
+        cls, filename, label="bundle", cores=1, device="cpu", energy_only=False
+    ):
+        '''
+        Constructs a calculator for inference from a bundle saved by
+        AMP.save_bundle, without rebuilding the training dataset.
+        ------------------
+
+        filename: str.
+            Path to the model bundle.
+
+        label: str.
+            Label used for fingerprinting and logging.
+
+        energy_only: bool.
+            See AMP.'''
+        bundle = torch.load(filename)
+        calc = cls.__new__(cls)
+        Calculator.__init__(calc)
+        calc.energy_only = energy_only
+        module_name, descriptor_name = bundle["descriptor"].rsplit(".", 1)
+        calc.descriptor = getattr(importlib.import_module(module_name), descriptor_name)
+        calc.elements = bundle["elements"]
+        kwargs = {}
+        model = FullNN
+        if bundle.get("n_models") is not None:
+            model = EnsembleNN
+            kwargs["n_models"] = bundle["n_models"]
+        elif bundle.get("precision") is not None:
+            kwargs["precision"] = bundle["precision"]
+        module = model(
+            calc.elements,
+            bundle["architecture"],
+            device,
+            forcetraining=True,
+            activation=getattr(torch.nn, bundle["activation"]),
+            **kwargs
+        )
+        module.load_state_dict(bundle["state_dict"])
+        calc.model = NeuralNetRegressor(
+            module=module, criterion=CustomMSELoss, device=device
+        )
+        calc.testlabel = label
+        calc.label = None
+        calc.Gs = bundle["Gs"]
+        calc.fprange = {
+            element: value.numpy() for element, value in bundle["fprange"].items()
+        }
+        calc.fp_mask = bundle.get("fp_mask")
+        if calc.fp_mask is not None:
+            calc.fp_mask = {
+                element: mask.numpy() for element, mask in calc.fp_mask.items()
+            }
+        calc.scale = Transform.from_stats(
+            bundle["scale"]["mean"], bundle["scale"]["std"]
+        )
+        calc.target_ref_per_atom, calc.delta_ref_per_atom = bundle["scalings"]
+        calc.scalings = [calc.target_ref_per_atom, calc.delta_ref_per_atom, calc.scale]
+        calc.cores = cores
+        calc.training_data = None
+        calc.delta = bundle["delta"] is not None
+        if calc.delta:
+            calc.params = bundle["delta"]["params"]
+            calc.delta_model = morse_potential(
+                [],
+                calc.params,
+                bundle["delta"]["cutoff"],
+                label,
+                combo=bundle["delta"]["combo"],
+            )
+        return calc
+
+    def export_torchscript(self, filename):
+        """Saves the trained model as a frozen TorchScript module with a
+        tensor-only signature (see amptorch.model.InferenceNN), whose
+        predictions include the target scaling. Inputs are assembled by
+        TestDataset.collate_script. The delta model, if any, is not included.
+        """
+        model = self.model.module
+        if self.label is not None:
+            model.load_state_dict(torch.load(self.label))
+        return script_model(model, self.scale, filename)
 
     def load(self, filename):
         '''
@@ -134,46 +338,143 @@ class AMP(Calculator):
         except:
             raise Exception('File not found or trying to load a model with a different architecture than that defined')
 
-    def calculate(self, atoms, properties, system_changes):
-        Calculator.calculate(self, atoms, properties, system_changes)
+    def predict(self, images, batch_size=100, uncertainty=False):
+        """Predicts the energies and forces of a list of images, featurizing
+        them in one pass and evaluating up to batch_size structures per
+        forward pass.
+
+        Returns a list of energies and a list of (N, 3) force arrays. For
+        ensemble models these are the ensemble means, followed by the lists
+        of energy variances and of (N, 3) force variances if uncertainty is
+        True."""
+        if uncertainty and not isinstance(self.model.module, EnsembleNN):
+            raise ValueError("Uncertainties require an EnsembleNN model.")
         dataset = TestDataset(
-            images=atoms,
-            unique_atoms=self.training_data.elements,
-            descriptor=self.training_data.base_descriptor,
+            images=images,
+            unique_atoms=self.elements,
+            descriptor=self.descriptor,
             Gs=self.Gs,
             fprange=self.fprange,
             label=self.testlabel,
             cores=self.cores,
+            fp_mask=self.fp_mask,
+            precision=getattr(self.model.module, "precision", "float32"),
         )
-        num_atoms = len(atoms)
-        unique_atoms = dataset.unique()
-        batch_size = len(dataset)
         dataloader = DataLoader(
             dataset, batch_size, collate_fn=dataset.collate_test, shuffle=False
         )
         model = self.model.module
         model.forcetraining = True
-        model.load_state_dict(torch.load(self.label))
+        if self.label is not None:
+            model.load_state_dict(torch.load(self.label))
         model.eval()
 
+        energies = []
+        forces = []
+        energy_variances = []
+        force_variances = []
         for inputs in dataloader:
-            for element in unique_atoms:
-                inputs[0][element][0] = inputs[0][element][0].requires_grad_(True)
-            energy, forces = model(inputs)
-            energy = energy*self.scale.std + self.scale.mean*num_atoms
-            forces = self.scale.denorm(forces, energy=False)
-        energy = np.concatenate(energy.detach().numpy())
-        forces = forces.detach().numpy()
-
-        image_hash = hash_images([atoms])
+            energy, force = model(inputs)
+            num_atoms = np.array(inputs[3])
+            if isinstance(model, EnsembleNN):
+                energy, force, energy_var, force_var = ensemble_statistics(
+                    energy, force
+                )
+                variance_scale = float(self.scale.std) ** 2
+                energy_variances.extend(
+                    energy_var.detach().numpy().reshape(-1) * variance_scale
+                )
+                force_var = force_var.detach().numpy() * variance_scale
+                force_variances.extend(np.split(force_var, np.cumsum(num_atoms)[:-1]))
+            energy = energy.detach().numpy().reshape(-1)
+            energy = energy * float(self.scale.std) + float(self.scale.mean) * num_atoms
+            force = self.scale.denorm(force, energy=False).detach().numpy()
+            energies.extend(energy)
+            forces.extend(np.split(force, np.cumsum(num_atoms)[:-1]))
+
+        if self.delta:
+            self.delta_model.neighborlist.calculate_items(
+                hash_images(dataset.atom_images)
+            )
+            for idx, atoms in enumerate(dataset.atom_images):
+                delta_energy, delta_forces, _ = self.delta_model.image_pred(
+                    atoms, self.params
+                )
+                energies[idx] += np.squeeze(delta_energy) + len(atoms) * (
+                    self.target_ref_per_atom - self.delta_ref_per_atom
+                )
+                forces[idx] = forces[idx] + delta_forces
+        if uncertainty:
+            return energies, forces, energy_variances, force_variances
+        return energies, forces
+
+    def predict_energies(self, images, batch_size=1000, chunk_size=65536):
+        """Predicts the energies of a list of images through the energy-only
+        inference path: fingerprint derivatives are not computed and the
+        model is evaluated without autograd graphs, chunk_size atoms at a
+        time (see FullNN.predict_energies), allowing large batch sizes.
+
+        Returns a list of energies."""
+        if isinstance(self.model.module, EnsembleNN):
+            raise NotImplementedError(
+                "Energy-only inference of ensembles is not supported."
+            )
+        dataset = TestDataset(
+            images=images,
+            unique_atoms=self.elements,
+            descriptor=self.descriptor,
+            Gs=self.Gs,
+            fprange=self.fprange,
+            label=self.testlabel,
+            cores=self.cores,
+            forcetraining=False,
+            fp_mask=self.fp_mask,
+            precision=self.model.module.precision,
+        )
+        dataloader = DataLoader(
+            dataset, batch_size, collate_fn=dataset.collate_test, shuffle=False
+        )
+        model = self.model.module
+        if self.label is not None:
+            model.load_state_dict(torch.load(self.label))
+        model.eval()
+
+        energies = []
+        for inputs in dataloader:
+            energy = model.predict_energies(inputs, chunk_size).numpy().reshape(-1)
+            num_atoms = np.array(inputs[3])
+            energies.extend(
+                energy * float(self.scale.std) + float(self.scale.mean) * num_atoms
+            )
+
         if self.delta:
-            self.delta_model.neighborlist.calculate_items(image_hash)
-            delta_energy, delta_forces, _ = self.delta_model.image_pred(
-                atoms, self.params
+            self.delta_model.neighborlist.calculate_items(
+                hash_images(dataset.atom_images)
             )
-            delta_energy = np.squeeze(delta_energy)
-            energy += delta_energy + num_atoms*(self.target_ref_per_atom - self.delta_ref_per_atom)
-            forces += delta_forces
+            for idx, atoms in enumerate(dataset.atom_images):
+                delta_energy, _, _ = self.delta_model.image_pred(atoms, self.params)
+                energies[idx] += np.squeeze(delta_energy) + len(atoms) * (
+                    self.target_ref_per_atom - self.delta_ref_per_atom
+                )
+        return energies
+
+    def calculate(self, atoms, properties, system_changes):
+        Calculator.calculate(self, atoms, properties, system_changes)
+        if (
+            self.energy_only
+            and "forces" not in properties
+            and not isinstance(self.model.module, EnsembleNN)
+        ):
+            self.results["energy"] = float(self.predict_energies([atoms])[0])
+            return
+        if isinstance(self.model.module, EnsembleNN):
+            energies, forces, energy_variances, force_variances = self.predict(
+                [atoms], uncertainty=True
+            )
+            self.results["energy_variance"] = float(energy_variances[0])
+            self.results["forces_variance"] = force_variances[0]
+        else:
+            energies, forces = self.predict([atoms])
 
-        self.results["energy"] = float(energy)
-        self.results["forces"] = forces
+        self.results["energy"] = float(energies[0])
+        self.results["forces"] = forces[0]
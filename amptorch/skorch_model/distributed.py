@@ -0,0 +1,275 @@
+"""Distributed data-parallel training of AMP models with torch.distributed.
+
+Every process trains on a shard of the AtomsDataset. Losses and gradients are
+summed across processes, such that each optimizer step is the step of the
+full (global) batch; with LBFGS this makes every line search evaluation a
+global one, performed identically by all processes. Rank 0 logs and saves the
+model."""
+
+import os
+import time
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import Sampler
+from amptorch.data_preprocess import collate_amp
+from amptorch.utils import Logger
+from amptorch.profiling import profiler
+from amptorch.skorch_model.utils import make_force_header, make_energy_header
+
+__author__ = "Muhammed Shuaibi"
+__email__ = "mshuaibi@andrew.cmu.edu"
+
+
+def init_process_group(
+    rank, world_size, master_addr="127.0.0.1", master_port=29500, backend="gloo"
+):
+    """Joins the process group of a distributed training run. Defaults to the
+    gloo backend on the local host, e.g. for processes started with
+    torch.multiprocessing.spawn."""
+    os.environ.setdefault("MASTER_ADDR", master_addr)
+    os.environ.setdefault("MASTER_PORT", str(master_port))
+    dist.init_process_group(backend, rank=rank, world_size=world_size)
+
+
+class DistributedAtomsSampler(Sampler):
+    """
+    Shards the dataset across processes such that the total cost of every
+    shard (see AtomsDataset.image_costs) is balanced, rather than the number
+    of images. Shards are reshuffled every epoch with set_epoch, consistently
+    across processes.
+
+    Parameters:
+    -----------
+    costs: array
+        Cost of every image in the dataset.
+
+    num_replicas: int
+        Number of processes. Default: world size of the process group
+
+    rank: int
+        Rank of the current process. Default: rank in the process group
+
+    shuffle: Boolean
+        True to reshuffle the shards every epoch. Default: True
+
+    seed: int
+        Seed of the shuffling, to be shared by all processes. Default: 0
+    """
+
+    def __init__(self, costs, num_replicas=None, rank=None, shuffle=True, seed=0):
+        self.costs = np.asarray(costs)
+        self.num_replicas = (
+            dist.get_world_size() if num_replicas is None else num_replicas
+        )
+        self.rank = dist.get_rank() if rank is None else rank
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def shards(self):
+        """Assigns images to shards greedily, in decreasing order of cost, to
+        the shard of least total cost."""
+        rng = np.random.RandomState(self.seed + self.epoch)
+        order = np.arange(len(self.costs))
+        if self.shuffle:
+            order = rng.permutation(order)
+        order = order[np.argsort(-self.costs[order], kind="stable")]
+        loads = np.zeros(self.num_replicas)
+        shards = [[] for _ in range(self.num_replicas)]
+        for index in order:
+            replica = int(np.argmin(loads))
+            shards[replica].append(int(index))
+            loads[replica] += self.costs[index]
+        if self.shuffle:
+            shards = [list(rng.permutation(shard)) for shard in shards]
+        return shards
+
+    def __iter__(self):
+        return iter(self.shards()[self.rank])
+
+    def __len__(self):
+        return len(self.shards()[self.rank])
+
+
+class DistributedTrainer:
+    """
+    Data-parallel trainer of a model (e.g. FullNN) on an AtomsDataset, to be
+    run by every process of an initialized process group.
+
+    Parameters:
+    -----------
+    module: torch.nn.Module
+        Model to be trained. Its parameters are synchronized from rank 0.
+
+    criterion: torch.nn.Module
+        Loss function instance, e.g. CustomMSELoss(force_coefficient=0.3).
+        Losses are summed over images, as is the case for the amptorch losses.
+
+    optimizer: torch.optim.Optimizer class
+        Default: torch.optim.LBFGS
+
+    lr: float
+        Learning rate. Default: 0.1
+
+    batch_size: int
+        Maximum number of images per batch and process. Default: None, the
+        full shard
+
+    max_epochs: int
+        Default: 10
+
+    log: Logger
+        Logger to write the training progress to on rank 0. Default: None
+
+    optimizer_kwargs:
+        Additional optimizer arguments, e.g. line_search_fn="strong_wolfe".
+    """
+
+    def __init__(
+        self,
+        module,
+        criterion,
+        optimizer=torch.optim.LBFGS,
+        lr=1e-1,
+        batch_size=None,
+        max_epochs=10,
+        log=None,
+        **optimizer_kwargs
+    ):
+        self.module = module
+        self.criterion = criterion
+        self.batch_size = batch_size
+        self.max_epochs = max_epochs
+        self.rank = dist.get_rank()
+        self.world_size = dist.get_world_size()
+        self.log = log if (log is not None and self.rank == 0) else Logger(None)
+        self.broadcast_parameters()
+        self.optimizer = optimizer(self.module.parameters(), lr=lr, **optimizer_kwargs)
+        self.history = []
+
+    def broadcast_parameters(self):
+        for tensor in self.module.state_dict().values():
+            dist.broadcast(tensor, 0)
+
+    def all_reduce_gradients(self):
+        for parameter in self.module.parameters():
+            if parameter.grad is None:
+                parameter.grad = torch.zeros_like(parameter)
+            dist.all_reduce(parameter.grad)
+
+    def batches(self, dataset, indices):
+        """Splits the shard of the process into batches, the number of which
+        is the same on all processes; batches may therefore be empty (None)."""
+        shard_size = torch.tensor(len(indices))
+        dist.all_reduce(shard_size, op=dist.ReduceOp.MAX)
+        batch_size = self.batch_size or max(int(shard_size), 1)
+        num_batches = max(int(np.ceil(int(shard_size) / batch_size)), 1)
+        for batch in np.array_split(np.asarray(indices, dtype=int), num_batches):
+            if len(batch) == 0:
+                yield None
+            else:
+                yield collate_amp([dataset[int(index)] for index in batch])
+
+    def train_step(self, batch):
+        """Performs an optimizer step on the global batch, made up of the local
+        batches of all processes. Returns the global loss."""
+
+        def closure():
+            self.optimizer.zero_grad()
+            loss = torch.zeros(())
+            if batch is not None:
+                loss = self.criterion(self.module(batch[0]), batch[1])
+                with profiler.span("backward"):
+                    loss.backward()
+            with profiler.span("all_reduce"):
+                self.all_reduce_gradients()
+            loss = loss.detach()
+            dist.all_reduce(loss)
+            return loss
+
+        return float(self.optimizer.step(closure))
+
+    def evaluate(self, dataset, indices):
+        """Global energy (per atom) and force RMSEs of the model, in the
+        units of the targets."""
+        scale = dataset.scalings[-1]
+        errors = torch.zeros(4, dtype=torch.float64)
+        for batch in self.batches(dataset, indices):
+            if batch is None:
+                continue
+            energy_pred, force_pred = self.module(batch[0])
+            energy_targets, num_atoms, weights = batch[1][0], batch[1][1], batch[1][3]
+            energy_error = (energy_pred / num_atoms - energy_targets) * scale.std
+            errors[0] += float((weights * energy_error.detach() ** 2).sum())
+            errors[1] += float(weights.sum())
+            if force_pred.nelement() != 0:
+                num_atoms_extended = torch.cat(
+                    [n.repeat(int(n)) for n in num_atoms]
+                ).reshape(-1, 1)
+                weights_extended = torch.cat(
+                    [w.repeat(int(n)) for w, n in zip(weights, num_atoms)]
+                ).reshape(-1, 1)
+                force_error = (
+                    force_pred - batch[1][2] * num_atoms_extended
+                ) * scale.std
+                errors[2] += float((weights_extended * force_error.detach() ** 2).sum())
+                errors[3] += 3 * float(weights_extended.sum())
+        dist.all_reduce(errors)
+        energy_rmse = float(torch.sqrt(errors[0] / errors[1]))
+        force_rmse = float(torch.sqrt(errors[2] / errors[3])) if errors[3] else 0.0
+        return energy_rmse, force_rmse
+
+    def fit(self, dataset, sampler=None):
+        """
+        Trains the model on dataset.
+
+        sampler: DistributedAtomsSampler
+            Sharding of the dataset. Default: shards balanced by atom count.
+        """
+        if sampler is None:
+            sampler = DistributedAtomsSampler(dataset.image_costs("atoms"))
+        forcetraining = self.criterion.alpha > 0
+        self.log("Training initiated on {} processes...".format(self.world_size))
+        if forcetraining:
+            make_force_header(self.log)
+        else:
+            make_energy_header(self.log)
+        for epoch in range(1, self.max_epochs + 1):
+            start = time.time()
+            sampler.set_epoch(epoch)
+            indices = list(sampler)
+            train_loss = 0.0
+            for batch in self.batches(dataset, indices):
+                train_loss += self.train_step(batch)
+            energy_rmse, force_rmse = self.evaluate(dataset, indices)
+            dur = time.time() - start
+            self.history.append(
+                {
+                    "epoch": epoch,
+                    "energy_score": energy_rmse,
+                    "forces_score": force_rmse,
+                    "train_loss": train_loss,
+                    "dur": dur,
+                }
+            )
+            if forcetraining:
+                self.log(
+                    "%5i %12.4f %12.4f %12.4f %7.4f"
+                    % (epoch, energy_rmse, force_rmse, train_loss, dur)
+                )
+            else:
+                self.log(
+                    "%5i %12.4f %12.4f %7.4f" % (epoch, energy_rmse, train_loss, dur)
+                )
+        self.log("...Training Complete!\n")
+        return self
+
+    def save_params(self, filename):
+        """Saves the model parameters from rank 0."""
+        if self.rank == 0:
+            torch.save(self.module.state_dict(), filename)
+        dist.barrier()
@@ -3,53 +3,70 @@ from skorch.utils import to_numpy
 import torch
 from torch.nn import MSELoss, L1Loss
 import numpy as np
+from amptorch.profiling import profiled
 
 
 def target_extractor(y):
+    """Extracts the energies, number of atoms, forces and image weights of a
+    batch target, as collated by collate_amp."""
     return (
         (to_numpy(y[0]), to_numpy(y[1]))
         if len(y) == 2
-        else (to_numpy(y[0]), to_numpy(y[1]), to_numpy(y[2]))
+        else (to_numpy(y[0]), to_numpy(y[1]), to_numpy(y[2]), to_numpy(y[3]))
     )
 
 
+@profiled("energy_score")
 def energy_score(net, X, y):
-    mse_loss = MSELoss(reduction="sum")
+    mse_loss = MSELoss(reduction="none")
     energy_pred, _ = net.forward(X)
+    # ensembles are scored by their mean prediction
+    energy_pred = energy_pred.mean(-1, keepdim=True)
     device = energy_pred.device
     if not hasattr(X, "scalings"):
         X = X.dataset
     scale = X.scalings[-1]
-    num_atoms = torch.FloatTensor(np.concatenate(y[1::3])).reshape(-1, 1).to(device)
-    dataset_size = len(energy_pred)
-    energy_targets_per_atom = torch.tensor(np.concatenate(y[0::3])).to(device).reshape(-1, 1)
+    num_atoms = torch.FloatTensor(np.concatenate(y[1::4])).reshape(-1, 1).to(device)
+    weights = torch.FloatTensor(np.concatenate(y[3::4])).reshape(-1, 1).to(device)
+    dataset_size = weights.sum()
+    energy_targets_per_atom = torch.tensor(np.concatenate(y[0::4])).to(device).reshape(-1, 1)
     energy_targets_per_atom = scale.denorm(energy_targets_per_atom)
     energy_preds_per_atom = torch.div(energy_pred, num_atoms)
     energy_preds_per_atom = scale.denorm(energy_preds_per_atom)
-    energy_loss = mse_loss(energy_preds_per_atom, energy_targets_per_atom)
+    energy_loss = torch.sum(
+        weights * mse_loss(energy_preds_per_atom, energy_targets_per_atom)
+    )
     energy_loss /= dataset_size
     energy_rmse = torch.sqrt(energy_loss)
     return energy_rmse
 
+@profiled("forces_score")
 def forces_score(net, X, y):
     mse_loss = MSELoss(reduction='none')
     _, force_pred = net.forward(X)
     if force_pred.nelement() == 0:
         raise Exception("Force training disabled. Disable force scoring!")
+    if force_pred.dim() == 3:
+        # ensembles are scored by their mean prediction
+        force_pred = force_pred.mean(-1)
     device = force_pred.device
     if not hasattr(X, "scalings"):
         X = X.dataset
     scale = X.scalings[-1]
-    num_atoms = torch.FloatTensor(np.concatenate(y[1::3])).reshape(-1, 1).to(device)
-    force_targets_per_atom = torch.tensor(np.concatenate(y[2::3])).to(device)
+    num_atoms = torch.FloatTensor(np.concatenate(y[1::4])).reshape(-1, 1).to(device)
+    weights = torch.FloatTensor(np.concatenate(y[3::4])).reshape(-1, 1).to(device)
+    force_targets_per_atom = torch.tensor(np.concatenate(y[2::4])).to(device)
     force_targets_per_atom = scale.denorm(force_targets_per_atom)
     device = force_pred.device
-    dataset_size = len(num_atoms)
+    dataset_size = weights.sum()
     num_atoms_extended = torch.cat([idx.repeat(int(idx)) for idx in num_atoms]).reshape(-1, 1)
+    weights_extended = torch.cat(
+        [weight.repeat(int(n)) for weight, n in zip(weights, num_atoms)]
+    ).reshape(-1, 1)
     force_pred_per_atom = scale.denorm(torch.div(force_pred, num_atoms_extended))
     force_targets = force_targets_per_atom*num_atoms_extended
     force_pred = force_pred_per_atom*num_atoms_extended
-    force_mse = mse_loss(force_pred, force_targets)
+    force_mse = weights_extended * mse_loss(force_pred, force_targets)
     force_mse /= 3 * dataset_size * num_atoms_extended
     force_rmse = torch.sqrt(force_mse.sum())
     return force_rmse
@@ -0,0 +1,123 @@
+"""Fingerprint space subsampling: removes samples lying within a cutoff of
+their nearest neighbor, such that the kept samples cover the fingerprint space
+of a dataset with fewer redundant environments. Follows the nearest neighbor
+subsampling scheme of lammps_interface.customizedNNSubsampling."""
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def standardize(data):
+    """Scales every column of data to zero mean and unit variance. Constant
+    columns are only centered."""
+    std = data.std(axis=0)
+    std[std < 1e-8] = 1.0
+    return (data - data.mean(axis=0)) / std
+
+
+def pca_projection(data, target_variance):
+    """Projects data onto its leading principal components, as many as
+    required to explain a fraction target_variance of its variance."""
+    data = data - data.mean(axis=0)
+    _, singular_values, components = np.linalg.svd(data, full_matrices=False)
+    explained = np.cumsum(singular_values ** 2) / np.sum(singular_values ** 2)
+    n_components = min(
+        int(np.searchsorted(explained, target_variance)) + 1, len(components)
+    )
+    return data @ components[:n_components].T
+
+
+def nearest_neighbors(data, method="pykdtree", chunk_size=10000, cores=1):
+    """Finds the nearest neighbor of every row of data, other than itself.
+    The tree is queried in chunks of chunk_size rows, on cores threads.
+
+    Parameters
+    ----------
+    data : array
+        N x D points.
+    method : str
+        "pykdtree" (pykdtree KDTree, or scipy cKDTree if pykdtree is not
+        installed), "kdtree" (scipy cKDTree) or "balltree" (scikit-learn
+        BallTree).
+
+    Returns the distances to, and indices of, the nearest neighbors."""
+    if method == "pykdtree":
+        try:
+            from pykdtree.kdtree import KDTree
+
+            tree = KDTree(np.ascontiguousarray(data))
+        except ImportError:
+            tree = cKDTree(data)
+    elif method == "kdtree":
+        tree = cKDTree(data)
+    elif method == "balltree":
+        from sklearn.neighbors import BallTree
+
+        tree = BallTree(data)
+    else:
+        raise ValueError(
+            "Unknown method: {}. Choose from pykdtree, kdtree, balltree.".format(
+                method
+            )
+        )
+    k = min(2, len(data))
+
+    def query(start):
+        distances, indices = tree.query(data[start : start + chunk_size], k=k)
+        # the query point itself is not necessarily the first match if it
+        # has exact duplicates, so the first match other than itself is taken
+        rows = np.arange(len(indices))
+        columns = (indices[:, 0] == rows + start).astype(np.int64)
+        return distances[rows, columns], indices[rows, columns]
+
+    with ThreadPoolExecutor(max_workers=cores) as pool:
+        results = list(pool.map(query, range(0, len(data), chunk_size)))
+    return (
+        np.concatenate([distances for distances, _ in results]),
+        np.concatenate([indices for _, indices in results]),
+    )
+
+
+def subsample_points(
+    data,
+    cutoff_sig=0.1,
+    rate=0.5,
+    method="pykdtree",
+    pca_target_variance=None,
+    chunk_size=10000,
+    cores=1,
+    seed=None,
+):
+    """Selects a subset of the rows of data covering the same space.
+
+    The data is standardized and, if pca_target_variance is provided,
+    projected onto its leading principal components. Points whose nearest
+    neighbor lies within cutoff_sig * sqrt(dimension) are then removed
+    iteratively: every iteration a random fraction rate of them is
+    considered, and a point is removed only if its nearest neighbor has not
+    been removed in the same iteration, until no such points remain.
+
+    Returns the sorted indices of the kept rows."""
+    data = standardize(np.asarray(data, dtype=np.float64))
+    if pca_target_variance is not None:
+        data = pca_projection(data, pca_target_variance)
+    cutoff = cutoff_sig * np.sqrt(data.shape[1])
+    random_state = np.random.RandomState(seed)
+    keep = np.arange(len(data))
+    while len(keep) > 1:
+        distances, neighbors = nearest_neighbors(
+            data[keep], method=method, chunk_size=chunk_size, cores=cores
+        )
+        close = np.nonzero(distances < cutoff)[0]
+        if len(close) == 0:
+            break
+        candidates = random_state.choice(
+            close, max(1, int(rate * len(close))), replace=False
+        )
+        removed = np.zeros(len(keep), dtype=bool)
+        for candidate in candidates:
+            if not removed[neighbors[candidate]]:
+                removed[candidate] = True
+        keep = keep[~removed]
+    return keep
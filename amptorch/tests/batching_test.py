@@ -0,0 +1,160 @@
+import pickle
+import torch
+import numpy as np
+from skorch import NeuralNetRegressor
+from torch.utils.data import DataLoader
+from ase import Atoms
+from ase.build import fcc100
+from ase.calculators.emt import EMT
+from amptorch.gaussian import SNN_Gaussian
+from amptorch.model import FullNN, CustomMSELoss
+from amptorch.data_preprocess import (
+    AtomsDataset,
+    AtomsBatchSampler,
+    PrefetchDataLoader,
+    collate_amp,
+    worker_init_fn,
+)
+
+
+def make_dataset():
+    images = []
+    for l in np.linspace(2, 5, 20):
+        image = Atoms(
+            "CuCO",
+            [
+                (-l * np.sin(0.65), l * np.cos(0.65), 0),
+                (0, 0, 0),
+                (l * np.sin(0.65), l * np.cos(0.65), 0),
+            ],
+        )
+        image.set_cell([10, 10, 10])
+        image.wrap(pbc=True)
+        image.set_calculator(EMT())
+        images.append(image)
+    for seed in range(5):
+        slab = fcc100("Cu", size=(2, 2, 2), vacuum=5.0)
+        slab.rattle(0.05, seed=seed)
+        slab.set_calculator(EMT())
+        images.append(slab)
+
+    Gs = {}
+    Gs["G2_etas"] = np.logspace(np.log10(0.05), np.log10(5.0), num=2)
+    Gs["G2_rs_s"] = [0] * 2
+    Gs["G4_etas"] = [0.005]
+    Gs["G4_zetas"] = [1.0]
+    Gs["G4_gammas"] = [+1.0, -1]
+    Gs["cutoff"] = 6.5
+
+    return AtomsDataset(
+        images, SNN_Gaussian, Gs, forcetraining=True, label="batching", cores=1
+    )
+
+
+def test_atoms_batch_sampler():
+    training_data = make_dataset()
+    budget = 20
+    for cost in ["atoms", "nnz"]:
+        costs = training_data.image_costs(cost)
+        if cost == "nnz":
+            budget = int(costs.max())
+        samplers = training_data.create_splits(training_data, 0.2)
+        for split in ["train", "val"]:
+            batch_sampler = AtomsBatchSampler(
+                costs, budget, sampler=samplers[split]
+            )
+            batches = list(batch_sampler)
+            for batch in batches:
+                assert (
+                    len(batch) == 1 or costs[batch].sum() <= budget
+                ), "Batch exceeds budget!"
+            assert sorted(sum(batches, [])) == sorted(
+                samplers[split].indices
+            ), "Batches do not cover the split!"
+    # the number of batches of shuffled epochs is that of the batches then
+    # drawn, and counting them does not draw another order
+    random_costs = np.random.RandomState(0).randint(1, 10, size=30)
+    batch_sampler = AtomsBatchSampler(random_costs, 12)
+    for epoch in range(5):
+        num_batches = len(batch_sampler)
+        state = np.random.get_state()
+        assert len(batch_sampler) == num_batches
+        assert np.array_equal(np.random.get_state()[1], state[1])
+        batches = list(batch_sampler)
+        assert len(batches) == num_batches
+        assert sorted(sum(batches, [])) == list(range(len(random_costs)))
+    try:
+        training_data.image_costs("flops")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("An unknown cost was accepted!")
+
+    costs = training_data.image_costs("atoms")
+    loader = DataLoader(
+        training_data,
+        batch_sampler=AtomsBatchSampler(costs, budget),
+        collate_fn=collate_amp,
+    )
+    num_atoms = sum(float(inputs[1][1].sum()) for inputs in loader)
+    assert num_atoms == costs.sum(), "Batches do not cover the dataset!"
+
+    net = NeuralNetRegressor(
+        module=FullNN(
+            training_data.elements,
+            [training_data.fp_length, 2, 2],
+            "cpu",
+            forcetraining=True,
+        ),
+        criterion=CustomMSELoss,
+        criterion__force_coefficient=0.3,
+        optimizer=torch.optim.Adam,
+        lr=1e-2,
+        max_epochs=2,
+        iterator_train__collate_fn=collate_amp,
+        iterator_train__batch_sampler=AtomsBatchSampler(costs, budget),
+        iterator_train__batch_size=1,
+        train_split=None,
+        verbose=0,
+    )
+    net.fit(training_data, None)
+
+
+def test_worker_loading():
+    training_data = make_dataset()
+    worker_data = pickle.loads(pickle.dumps(training_data))
+    assert len(worker_data) == len(training_data), "Pickled dataset incomplete!"
+
+    training_data.share_memory()
+    loader = DataLoader(training_data, batch_size=4, collate_fn=collate_amp)
+    loaders = [
+        DataLoader(
+            training_data,
+            batch_size=4,
+            collate_fn=collate_amp,
+            num_workers=2,
+            worker_init_fn=worker_init_fn,
+        ),
+        PrefetchDataLoader(
+            training_data, prefetch=2, batch_size=4, collate_fn=collate_amp
+        ),
+        PrefetchDataLoader(
+            training_data,
+            prefetch=2,
+            batch_size=4,
+            collate_fn=collate_amp,
+            num_workers=2,
+        ),
+    ]
+    batches = list(loader)
+    for other_loader in loaders:
+        other_batches = list(other_loader)
+        assert len(batches) == len(other_batches), "Number of batches differ!"
+        for batch, other_batch in zip(batches, other_batches):
+            for element, fps in batch[0][0].items():
+                assert torch.equal(fps[0], other_batch[0][0][element][0])
+            assert torch.equal(
+                batch[0][3].to_dense(), other_batch[0][3].to_dense()
+            ), "Fingerprintprimes differ!"
+            for target, other_target in zip(batch[1], other_batch[1]):
+                assert torch.equal(target, other_target), "Targets differ!"
@@ -0,0 +1,74 @@
+import json
+import numpy as np
+from amptorch.benchmarks import (
+    make_emt_dataset,
+    run_benchmarks,
+    compare_results,
+    save_results,
+    load_results,
+    main,
+)
+
+
+def test_emt_dataset():
+    images = make_emt_dataset(3, 13, 3, seed=1)
+    assert len(images) == 3
+    for image in images:
+        assert len(image) == 13
+        assert set(image.get_chemical_symbols()) == {"Cu", "Ag", "Au"}
+    # reproducible for a given seed
+    repeated = make_emt_dataset(3, 13, 3, seed=1)
+    for image, other in zip(images, repeated):
+        assert np.array_equal(image.positions, other.positions)
+        assert image.get_chemical_symbols() == other.get_chemical_symbols()
+        assert image.get_potential_energy() == other.get_potential_energy()
+
+
+def test_benchmarks():
+    Gs = {}
+    Gs["G2_etas"] = np.logspace(np.log10(0.05), np.log10(5.0), num=2)
+    Gs["G2_rs_s"] = [0] * 2
+    Gs["G4_etas"] = [0.005]
+    Gs["G4_zetas"] = [1.0]
+    Gs["G4_gammas"] = [+1.0, -1]
+    Gs["cutoff"] = 6.5
+
+    results = run_benchmarks(
+        sizes=[4, 8], elements=[1, 2], num_images=3, batch_size=2, Gs=Gs,
+        repeats=1, label="benchmarks_test",
+    )
+    names = ["fingerprints", "preprocess", "collate", "train_step", "calculate"]
+    assert len(results["results"]) == 4 * len(names)
+    for record in results["results"]:
+        assert record["benchmark"] in names
+        assert record["value"] > 0
+
+    save_results(results, "benchmark_results.json")
+    loaded = load_results("benchmark_results.json")
+    assert loaded["results"] == json.loads(json.dumps(results["results"]))
+    assert compare_results(results, loaded) == []
+
+    # a twice faster baseline flags every benchmark
+    baseline = json.loads(json.dumps(results))
+    for record in baseline["results"]:
+        if record["higher_is_better"]:
+            record["value"] *= 2
+        else:
+            record["value"] /= 2
+    regressions = compare_results(results, baseline, tolerance=0.2)
+    assert len(regressions) == len(results["results"])
+    for _, _, change in regressions:
+        assert change < -0.2
+    # and a twice slower one none
+    assert compare_results(baseline, results, tolerance=0.2) == []
+    save_results(baseline, "benchmark_baseline.json")
+    assert (
+        main(
+            [
+                "--sizes", "4", "--elements", "1", "--images", "2",
+                "--repeats", "1", "--output", "benchmark_cli.json",
+                "--baseline", "benchmark_baseline.json", "--tolerance", "100",
+            ]
+        )
+        == 0
+    )
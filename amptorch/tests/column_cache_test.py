@@ -0,0 +1,125 @@
+import os
+import numpy as np
+from ase.build import molecule, fcc100, add_adsorbate
+import amptorch.fp_simple_nn as fp_simple_nn
+from amptorch.fp_simple_nn import make_amp_descriptors_simple_nn, get_hash
+from amptorch.gaussian import FileDatabase
+
+
+def test_column_cache():
+    slab = fcc100("Cu", size=(2, 2, 2))
+    add_adsorbate(slab, molecule("CO"), 2, offset=(1, 1))
+    slab.center(vacuum=6.0, axis=2)
+    images = [slab]
+    for displacement in [0.1, 0.2]:
+        image = slab.copy()
+        image.positions[-1, 0] += displacement
+        images.append(image)
+    elements = ["Cu", "C", "O"]
+
+    Gs = {}
+    Gs["G2_etas"] = [0.05, 2.0]
+    Gs["G2_rs_s"] = [0] * 2
+    Gs["G4_etas"] = [0.005]
+    Gs["G4_zetas"] = [1.0]
+    Gs["G4_gammas"] = [+1.0, -1]
+    Gs["cutoff"] = 5.0
+    # a sweep step adding a G2 eta
+    new_Gs = dict(Gs, G2_etas=[0.05, 2.0, 5.0], G2_rs_s=[0] * 3)
+
+    calculated = []
+    wrap_symmetry_functions = fp_simple_nn.wrap_symmetry_functions
+
+    def counting_symmetry_functions(atoms, params_set):
+        calculated.append(sum(params["num"] for params in params_set.values()))
+        return wrap_symmetry_functions(atoms, params_set)
+
+    fp_simple_nn.wrap_symmetry_functions = counting_symmetry_functions
+    try:
+        make_amp_descriptors_simple_nn(
+            images, Gs, elements, forcetraining=True, cores=1, label="cache",
+            save=True,
+        )
+        full_columns = calculated[0]
+        assert calculated == [full_columns] * len(images)
+        # every column is an entry of its own, holding the nonzero
+        # derivative rows only
+        column_db = FileDatabase("amp-data-sf-columns", max_memory=0)
+        image_hash = get_hash(images[0])
+        entries = [key for key in column_db.keys() if key.startswith(image_hash)]
+        assert len(entries) == full_columns
+        stored_rows = 0
+        for key in entries:
+            column = column_db[key]
+            assert column["pairs"].shape == (2, len(column["dx"]))
+            stored_rows += len(column["dx"])
+        assert stored_rows < full_columns / len(elements) * len(images[0]) ** 2
+        inodes = {
+            key: os.stat(os.path.join(column_db.loosepath, key)).st_ino
+            for key in entries
+        }
+        del calculated[:]
+        make_amp_descriptors_simple_nn(
+            images, new_Gs, elements, forcetraining=True, cores=1, label="cache",
+            save=True,
+        )
+        # only the G2 functions of the new eta, one per neighbor element, are
+        # calculated and stored, leaving the other entries untouched
+        assert calculated == [len(elements) ** 2] * len(images)
+        for key, inode in inodes.items():
+            assert os.stat(os.path.join(column_db.loosepath, key)).st_ino == inode
+
+        # without force training, no derivatives are stored, and they are
+        # calculated once force training needs them
+        image = slab.copy()
+        image.positions[-1, 0] += 0.3
+        del calculated[:]
+        fps, fp_primes = make_amp_descriptors_simple_nn(
+            [image], Gs, elements, forcetraining=False, cores=1, label="cache",
+            save=True,
+        )
+        assert fp_primes == [None]
+        image_hash = get_hash(image)
+        for key in column_db.keys():
+            if key.startswith(image_hash):
+                assert "dx" not in column_db[key]
+        make_amp_descriptors_simple_nn(
+            [image], Gs, elements, forcetraining=True, cores=1, label="cache",
+            save=True,
+        )
+        assert calculated == [full_columns] * 2
+    finally:
+        fp_simple_nn.wrap_symmetry_functions = wrap_symmetry_functions
+
+    fps, fp_primes = make_amp_descriptors_simple_nn(
+        images, new_Gs, elements, forcetraining=True, cores=1, label="cache",
+        save=False,
+    )
+    fp_db = FileDatabase("amp-data-fingerprints", max_memory=0)
+    fprimes_db = FileDatabase("amp-data-fingerprint-primes", max_memory=0)
+    for image, image_fps, image_primes in zip(images, fps, fp_primes):
+        image_hash = get_hash(image, new_Gs)
+        for (element, fp), (cached_element, cached_fp) in zip(
+            image_fps, fp_db[image_hash]
+        ):
+            assert element == cached_element
+            assert np.allclose(fp, cached_fp), "Cached fingerprints do not match!"
+        cached_primes = fprimes_db[image_hash]
+        for key, prime in image_primes.items():
+            assert np.allclose(
+                prime, cached_primes[key]
+            ), "Cached fingerprintprimes do not match!"
+
+    # stored descriptors are returned alike, read back from the databases
+    stored_fps, stored_primes = make_amp_descriptors_simple_nn(
+        images, new_Gs, elements, forcetraining=True, cores=1, label="cache",
+        save=True,
+    )
+    assert len(stored_fps) == len(stored_primes) == len(images)
+    for image_fps, image_stored_fps in zip(fps, stored_fps):
+        for (element, fp), (stored_element, stored_fp) in zip(
+            image_fps, image_stored_fps
+        ):
+            assert element == stored_element and np.allclose(fp, stored_fp)
+    for image_primes, image_stored_primes in zip(fp_primes, stored_primes):
+        assert image_primes.keys() == image_stored_primes.keys()
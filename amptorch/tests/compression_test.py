@@ -0,0 +1,130 @@
+import os
+import torch
+import numpy as np
+from ase import Atoms
+from ase.calculators.emt import EMT
+from amptorch.gaussian import SNN_Gaussian
+from amptorch.model import FullNN
+from amptorch.data_preprocess import AtomsDataset, collate_amp
+from amptorch.compression import (
+    compress_fingerprintprimes,
+    decompress_fingerprintprimes,
+    prime_error_bound,
+)
+
+
+def test_prime_compression():
+    torch.manual_seed(0)
+    dense = (torch.rand(300, 90) < 0.05) * torch.randn(300, 90)
+    # empty rows and columns
+    dense[5] = 0
+    dense[-1] = 0
+    dense[:, 0] = 0
+    fingerprintprimes = dense.to_sparse()
+
+    def payload(data):
+        return sum(array.nbytes for array in data.values())
+
+    coo_size = (
+        fingerprintprimes._indices().nbytes + fingerprintprimes._values().nbytes
+    )
+    data = compress_fingerprintprimes(fingerprintprimes)
+    assert data["deltas"].dtype == np.uint8 and data["counts"].dtype == np.uint8
+    assert payload(data) < coo_size / 2
+    assert payload(compress_fingerprintprimes(fingerprintprimes, quantize=True)) < (
+        payload(data)
+    )
+    assert torch.equal(decompress_fingerprintprimes(data).to_dense(), dense)
+    bfloat16_primes = fingerprintprimes.to(torch.bfloat16)
+    assert torch.equal(
+        decompress_fingerprintprimes(
+            compress_fingerprintprimes(bfloat16_primes)
+        ).to_dense(),
+        bfloat16_primes.to_dense(),
+    )
+
+    data = compress_fingerprintprimes(fingerprintprimes, quantize=True, block_size=16)
+    assert data["values"].dtype == np.int16
+    decoded = decompress_fingerprintprimes(data, torch.float64)
+    assert decoded.dtype == torch.float64
+    # every value is within half of its block's scale
+    values = fingerprintprimes.coalesce().values().double()
+    scales = torch.from_numpy(np.repeat(data["scales"], 16)[: len(values)]).double()
+    assert torch.all(
+        (decoded.coalesce().values() - values).abs() <= 0.5 * scales + 1e-12
+    )
+    bound = prime_error_bound(fingerprintprimes, decoded)
+    assert 0 < bound < 1e-4
+    # quantization exceeding the tolerance falls back to exact values
+    data = compress_fingerprintprimes(fingerprintprimes, quantize=True, tolerance=0)
+    assert "scales" not in data
+    assert torch.equal(decompress_fingerprintprimes(data).to_dense(), dense)
+
+    empty = torch.sparse_coo_tensor(
+        torch.zeros((2, 0), dtype=torch.int64), torch.zeros(0), (4, 6)
+    )
+    decoded = decompress_fingerprintprimes(
+        compress_fingerprintprimes(empty, quantize=True)
+    )
+    assert decoded.shape == (4, 6) and decoded._nnz() == 0
+
+
+def test_compressed_dataset():
+    images = []
+    for l in np.linspace(2, 5, 4):
+        image = Atoms(
+            "CuCO",
+            [
+                (-l * np.sin(0.65), l * np.cos(0.65), 0),
+                (0, 0, 0),
+                (l * np.sin(0.65), l * np.cos(0.65), 0),
+            ],
+        )
+        image.set_cell([10, 10, 10])
+        image.wrap(pbc=True)
+        image.set_calculator(EMT())
+        images.append(image)
+
+    Gs = {}
+    Gs["G2_etas"] = np.logspace(np.log10(0.05), np.log10(5.0), num=2)
+    Gs["G2_rs_s"] = [0] * 2
+    Gs["G4_etas"] = [0.005]
+    Gs["G4_zetas"] = [1.0]
+    Gs["G4_gammas"] = [+1.0, -1]
+    Gs["cutoff"] = 6.5
+
+    datasets = {}
+    for compress_primes in [None, "csr", "int16"]:
+        datasets[compress_primes] = AtomsDataset(
+            images, SNN_Gaussian, Gs, forcetraining=True, label="compression",
+            cores=1, store_primes=True, compress_primes=compress_primes,
+            prime_tol=1e-3,
+        )
+
+    for idx_hash in datasets[None].index_hashes:
+        assert os.path.isfile(datasets["csr"].prime_path(idx_hash) + ".npz")
+        assert os.path.isfile(datasets["int16"].prime_path(idx_hash) + ".npz")
+
+    for i in range(len(images)):
+        reference = datasets[None][i][2]
+        assert torch.equal(
+            datasets["csr"][i][2].to_dense(), reference.to_dense()
+        )
+        assert prime_error_bound(reference, datasets["int16"][i][2]) <= 1e-3
+    assert np.array_equal(
+        datasets["int16"].image_costs("nnz"), datasets[None].image_costs("nnz")
+    )
+
+    torch.manual_seed(0)
+    model = FullNN(
+        datasets[None].elements, [datasets[None].fp_length, 2, 5], "cpu",
+        forcetraining=True,
+    )
+    _, reference_forces = model(
+        collate_amp([datasets[None][i] for i in range(len(images))])[0]
+    )
+    _, forces = model(
+        collate_amp([datasets["int16"][i] for i in range(len(images))])[0]
+    )
+    force_error = (forces - reference_forces).abs().max()
+    assert force_error <= 1e-3 * reference_forces.abs().max()
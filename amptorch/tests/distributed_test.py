@@ -0,0 +1,122 @@
+import socket
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from skorch import NeuralNetRegressor
+from ase import Atoms
+from ase.build import fcc100
+from ase.calculators.emt import EMT
+from amptorch.gaussian import SNN_Gaussian
+from amptorch.model import FullNN, CustomMSELoss
+from amptorch.data_preprocess import AtomsDataset, collate_amp
+from amptorch.skorch_model import AMP
+from amptorch.skorch_model.distributed import (
+    init_process_group,
+    DistributedAtomsSampler,
+)
+
+
+def make_net(training_data, batch_size):
+    torch.manual_seed(0)
+    return NeuralNetRegressor(
+        module=FullNN(
+            training_data.elements,
+            [training_data.fp_length, 2, 5],
+            "cpu",
+            forcetraining=True,
+        ),
+        criterion=CustomMSELoss,
+        criterion__force_coefficient=0.3,
+        optimizer=torch.optim.LBFGS,
+        optimizer__line_search_fn="strong_wolfe",
+        lr=1e-1,
+        batch_size=batch_size,
+        max_epochs=2,
+        iterator_train__collate_fn=collate_amp,
+        iterator_train__shuffle=False,
+        train_split=0,
+        verbose=0,
+    )
+
+
+def train_process(rank, world_size, port, training_data):
+    init_process_group(rank, world_size, master_port=port)
+    net = make_net(training_data, len(training_data))
+    calc = AMP(training_data, net, "distributed")
+    calc.train_distributed(overwrite=True)
+    dist.destroy_process_group()
+
+
+def test_distributed_training():
+    images = []
+    for l in np.linspace(2, 5, 10):
+        image = Atoms(
+            "CuCO",
+            [
+                (-l * np.sin(0.65), l * np.cos(0.65), 0),
+                (0, 0, 0),
+                (l * np.sin(0.65), l * np.cos(0.65), 0),
+            ],
+        )
+        image.set_cell([10, 10, 10])
+        image.wrap(pbc=True)
+        image.set_calculator(EMT())
+        images.append(image)
+    for seed in range(2):
+        slab = fcc100("Cu", size=(2, 2, 2), vacuum=5.0)
+        slab.rattle(0.05, seed=seed)
+        slab.set_calculator(EMT())
+        images.append(slab)
+
+    Gs = {}
+    Gs["G2_etas"] = np.logspace(np.log10(0.05), np.log10(5.0), num=2)
+    Gs["G2_rs_s"] = [0] * 2
+    Gs["G4_etas"] = [0.005]
+    Gs["G4_zetas"] = [1.0]
+    Gs["G4_gammas"] = [+1.0, -1]
+    Gs["cutoff"] = 6.5
+
+    training_data = AtomsDataset(
+        images, SNN_Gaussian, Gs, forcetraining=True, label="distributed", cores=1
+    )
+
+    costs = training_data.image_costs("atoms")
+    shards = [
+        list(DistributedAtomsSampler(costs, num_replicas=2, rank=rank))
+        for rank in range(2)
+    ]
+    assert sorted(shards[0] + shards[1]) == list(range(len(images)))
+    assert abs(costs[shards[0]].sum() - costs[shards[1]].sum()) <= costs.max()
+
+    # single process, full batch reference; gradients are zeroed on every
+    # closure evaluation, which skorch's LBFGS stepping does not do
+    module = make_net(training_data, len(training_data)).module
+    criterion = CustomMSELoss(force_coefficient=0.3)
+    optimizer = torch.optim.LBFGS(
+        module.parameters(), lr=1e-1, line_search_fn="strong_wolfe"
+    )
+    batch = collate_amp([training_data[i] for i in range(len(training_data))])
+
+    def closure():
+        optimizer.zero_grad()
+        loss = criterion(module(batch[0]), batch[1])
+        loss.backward()
+        return loss
+
+    for epoch in range(2):
+        optimizer.step(closure)
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    mp.spawn(train_process, args=(2, port, training_data), nprocs=2)
+
+    # LBFGS amplifies the differences in summation order of the shards, such
+    # that the trained models are compared by their loss on the training data
+    reference_loss = closure().item()
+    module.load_state_dict(torch.load("results/trained_models/distributed.pt"))
+    distributed_loss = closure().item()
+    assert np.isclose(
+        distributed_loss, reference_loss, rtol=1e-2
+    ), "Distributed training does not match single process training!"
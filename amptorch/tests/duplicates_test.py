@@ -0,0 +1,74 @@
+import torch
+import numpy as np
+from ase import Atoms
+from ase.calculators.emt import EMT
+from amptorch.gaussian import SNN_Gaussian
+from amptorch.model import FullNN, CustomMSELoss, MAELoss, HuberLoss
+from amptorch.data_preprocess import AtomsDataset, collate_amp
+
+
+def test_duplicate_images():
+    images = []
+    for l in np.linspace(2, 5, 5):
+        image = Atoms(
+            "CuCO",
+            [
+                (-l * np.sin(0.65), l * np.cos(0.65), 0),
+                (0, 0, 0),
+                (l * np.sin(0.65), l * np.cos(0.65), 0),
+            ],
+        )
+        image.set_cell([10, 10, 10])
+        image.wrap(pbc=True)
+        image.set_calculator(EMT())
+        images.append(image)
+    # repeated frames, e.g. of an AIMD trajectory
+    images += [images[0], images[3], images[0]]
+
+    Gs = {}
+    Gs["G2_etas"] = np.logspace(np.log10(0.05), np.log10(5.0), num=2)
+    Gs["G2_rs_s"] = [0] * 2
+    Gs["G4_etas"] = [0.005]
+    Gs["G4_zetas"] = [1.0]
+    Gs["G4_gammas"] = [+1.0, -1]
+    Gs["cutoff"] = 6.5
+
+    training_data = AtomsDataset(
+        images, SNN_Gaussian, Gs, forcetraining=True, label="duplicates", cores=1
+    )
+    assert len(training_data) == 5, "Duplicate images were not collapsed!"
+    assert training_data.image_weights.tolist() == [3, 1, 1, 2, 1]
+    assert len(training_data.sparse_fprimes) == 5
+
+    # the energy scaling is that of the full dataset
+    energies = torch.FloatTensor(
+        [image.get_potential_energy() / len(image) for image in images]
+    )
+    scale = training_data.scalings[-1]
+    assert torch.allclose(scale.mean, energies.mean())
+    assert torch.allclose(scale.std, energies.std())
+
+    # the weighted losses equal those of the duplicated dataset
+    collapsed = [training_data[i] for i in range(len(training_data))]
+    duplicated = []
+    for item in collapsed:
+        for _ in range(int(item[4])):
+            duplicate = list(item)
+            duplicate[4] = torch.tensor(1.0)
+            duplicated.append(duplicate)
+    collapsed_batch = collate_amp(collapsed)
+    duplicated_batch = collate_amp(duplicated)
+    torch.manual_seed(0)
+    model = FullNN(
+        training_data.elements,
+        [training_data.fp_length, 2, 2],
+        "cpu",
+        forcetraining=True,
+    )
+    for loss_fn in [CustomMSELoss, MAELoss, HuberLoss]:
+        criterion = loss_fn(force_coefficient=0.3)
+        collapsed_loss = criterion(model(collapsed_batch[0]), collapsed_batch[1])
+        duplicated_loss = criterion(model(duplicated_batch[0]), duplicated_batch[1])
+        assert torch.allclose(
+            collapsed_loss, duplicated_loss
+        ), "Weighted loss does not match the loss of the duplicated images!"
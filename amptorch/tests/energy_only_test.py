@@ -0,0 +1,110 @@
+import torch
+import numpy as np
+from skorch import NeuralNetRegressor
+from ase import Atoms
+from ase.calculators.emt import EMT
+from amptorch.gaussian import SNN_Gaussian
+from amptorch.model import FullNN, CustomMSELoss
+from amptorch.data_preprocess import AtomsDataset, collate_amp, collate_energy
+from amptorch.skorch_model import AMP
+
+
+def test_energy_only():
+    images = []
+    for l in np.linspace(2, 5, 6):
+        image = Atoms(
+            "CuCO",
+            [
+                (-l * np.sin(0.65), l * np.cos(0.65), 0),
+                (0, 0, 0),
+                (l * np.sin(0.65), l * np.cos(0.65), 0),
+            ],
+        )
+        image.set_cell([10, 10, 10])
+        image.wrap(pbc=True)
+        image.set_calculator(EMT())
+        images.append(image)
+
+    Gs = {}
+    Gs["G2_etas"] = np.logspace(np.log10(0.05), np.log10(5.0), num=2)
+    Gs["G2_rs_s"] = [0] * 2
+    Gs["G4_etas"] = [0.005]
+    Gs["G4_zetas"] = [1.0]
+    Gs["G4_gammas"] = [+1.0, -1]
+    Gs["cutoff"] = 6.5
+
+    force_data = AtomsDataset(
+        images, SNN_Gaussian, Gs, forcetraining=True, label="energy_only", cores=1
+    )
+    training_data = AtomsDataset(
+        images, SNN_Gaussian, Gs, forcetraining=False, label="energy_only", cores=1
+    )
+    items = [training_data[i] for i in range(len(training_data))]
+    batch = collate_amp(items)
+    force_batch = collate_amp([force_data[i] for i in range(len(force_data))])
+    # collate_amp defers to the energy-only collation without derivatives
+    assert batch[0][3].nelement() == 0 and batch[1][2].nelement() == 0
+    for element in batch[0][2]:
+        assert torch.equal(batch[0][0][element][0], force_batch[0][0][element][0])
+        assert torch.equal(batch[0][0][element][1], force_batch[0][0][element][1])
+    for target, force_target in zip(batch[1], force_batch[1]):
+        if target.nelement() > 0:
+            assert torch.equal(target, force_target)
+
+    torch.manual_seed(1)
+    model = FullNN(
+        training_data.elements, [training_data.fp_length, 2, 5], "cpu",
+        forcetraining=True,
+    )
+    reference_energies, _ = model(force_batch[0])
+    model.forcetraining = False
+    energies, forces = model(batch[0])
+    assert forces.nelement() == 0
+    assert torch.allclose(energies, reference_energies, atol=1e-6)
+    # no input gradients, while the parameters are trained
+    for element in batch[0][2]:
+        assert not batch[0][0][element][0].requires_grad
+    CustomMSELoss()((energies, forces), batch[1]).backward()
+    for parameter in model.parameters():
+        assert parameter.grad is not None
+
+    # no_grad inference, in chunks of atoms
+    predicted = model.predict_energies(batch[0], chunk_size=2)
+    assert not predicted.requires_grad
+    assert torch.allclose(predicted, energies.detach(), atol=1e-6)
+    assert torch.allclose(collate_energy(items)[1][0], batch[1][0])
+
+    net = NeuralNetRegressor(
+        module=FullNN(
+            training_data.elements, [training_data.fp_length, 2, 5], "cpu",
+            forcetraining=False,
+        ),
+        criterion=CustomMSELoss,
+        criterion__force_coefficient=0,
+        optimizer=torch.optim.Adam,
+        lr=1e-2,
+        batch_size=3,
+        max_epochs=5,
+        iterator_train__collate_fn=collate_amp,
+        iterator_train__shuffle=False,
+        iterator_valid__collate_fn=collate_amp,
+        train_split=0,
+        verbose=0,
+    )
+    calc = AMP(training_data, net, "energy_only", save_logs=False)
+    net.fit(training_data, None)
+    net.save_params(f_params=calc.label)
+    energies = calc.predict_energies(images, batch_size=4, chunk_size=5)
+    reference_energies, _ = calc.predict(images)
+    assert np.allclose(energies, reference_energies, atol=1e-5)
+    # energies and forces are calculated together unless opted out
+    image = images[2].copy()
+    image.set_calculator(calc)
+    assert np.isclose(image.get_potential_energy(), reference_energies[2], atol=1e-5)
+    assert calc.results["forces"].shape == (3, 3)
+    calc.energy_only = True
+    image = images[3].copy()
+    image.set_calculator(calc)
+    assert np.isclose(image.get_potential_energy(), reference_energies[3], atol=1e-5)
+    assert "forces" not in calc.results
+    assert image.get_forces().shape == (3, 3)
@@ -0,0 +1,115 @@
+import torch
+import numpy as np
+from skorch import NeuralNetRegressor
+from ase import Atoms
+from ase.calculators.emt import EMT
+from amptorch.gaussian import SNN_Gaussian
+from amptorch.model import (
+    FullNN,
+    EnsembleNN,
+    EnsembleLoss,
+    CustomMSELoss,
+    ensemble_statistics,
+)
+from amptorch.data_preprocess import AtomsDataset, collate_amp
+from amptorch.skorch_model import AMP
+
+
+def test_ensemble():
+    images = []
+    for l in np.linspace(2, 5, 6):
+        image = Atoms(
+            "CuCO",
+            [
+                (-l * np.sin(0.65), l * np.cos(0.65), 0),
+                (0, 0, 0),
+                (l * np.sin(0.65), l * np.cos(0.65), 0),
+            ],
+        )
+        image.set_cell([10, 10, 10])
+        image.wrap(pbc=True)
+        image.set_calculator(EMT())
+        images.append(image)
+
+    Gs = {}
+    Gs["G2_etas"] = np.logspace(np.log10(0.05), np.log10(5.0), num=2)
+    Gs["G2_rs_s"] = [0] * 2
+    Gs["G4_etas"] = [0.005]
+    Gs["G4_zetas"] = [1.0]
+    Gs["G4_gammas"] = [+1.0, -1]
+    Gs["cutoff"] = 6.5
+
+    training_data = AtomsDataset(
+        images, SNN_Gaussian, Gs, forcetraining=True, label="ensemble", cores=1
+    )
+    batch = collate_amp([training_data[i] for i in range(len(training_data))])
+    architecture = [training_data.fp_length, 3, 5]
+
+    # the vectorized ensemble matches its separately evaluated members
+    torch.manual_seed(0)
+    models = [
+        FullNN(training_data.elements, architecture, "cpu", forcetraining=True)
+        for _ in range(3)
+    ]
+    ensemble = EnsembleNN.from_models(models)
+    energy_pred, force_pred = ensemble(batch[0])
+    assert energy_pred.shape == (len(images), 3)
+    assert force_pred.shape == (3 * len(images), 3, 3)
+    criterion = CustomMSELoss(force_coefficient=0.3)
+    loss = 0
+    for member, model in enumerate(models):
+        member_energies, member_forces = model(batch[0])
+        assert torch.allclose(energy_pred[:, member : member + 1], member_energies, atol=1e-6)
+        assert torch.allclose(force_pred[..., member], member_forces, atol=1e-6)
+        loss = loss + criterion((member_energies, member_forces), batch[1])
+    ensemble_loss = EnsembleLoss(force_coefficient=0.3)((energy_pred, force_pred), batch[1])
+    assert torch.allclose(ensemble_loss, loss), "Ensemble loss is not the members' sum!"
+
+    torch.manual_seed(1)
+    net = NeuralNetRegressor(
+        module=EnsembleNN(
+            training_data.elements, architecture, "cpu", forcetraining=True, n_models=4
+        ),
+        criterion=EnsembleLoss,
+        criterion__force_coefficient=0.3,
+        optimizer=torch.optim.Adam,
+        lr=1e-2,
+        batch_size=len(training_data),
+        max_epochs=5,
+        iterator_train__collate_fn=collate_amp,
+        iterator_train__shuffle=False,
+        train_split=0,
+        verbose=0,
+    )
+    calc = AMP(training_data, net, "ensemble")
+    net.fit(training_data, None)
+    net.save_params(f_params=calc.label)
+    calc.save_bundle(calc.bundle_label)
+
+    energy_pred, force_pred = net.module(batch[0])
+    energy_pred, force_pred, energy_var, force_var = ensemble_statistics(
+        energy_pred, force_pred
+    )
+    scale = training_data.scalings[-1]
+    num_atoms = batch[1][1]
+    energies = (scale.denorm(energy_pred / num_atoms) * num_atoms).detach().numpy()
+    forces = scale.denorm(force_pred, energy=False).detach().numpy()
+    energy_var = energy_var.detach().numpy() * float(scale.std) ** 2
+    force_var = force_var.detach().numpy() * float(scale.std) ** 2
+    assert np.all(energy_var > 0)
+    for predictor in [calc, AMP.from_bundle(calc.bundle_label, label="ensemble")]:
+        pred_energies, pred_forces, pred_energy_var, pred_force_var = predictor.predict(
+            images, uncertainty=True
+        )
+        assert np.allclose(pred_energies, energies.reshape(-1), atol=1e-4)
+        assert np.allclose(np.concatenate(pred_forces), forces, atol=1e-4)
+        assert np.allclose(pred_energy_var, energy_var.reshape(-1), rtol=1e-4)
+        assert np.allclose(
+            np.concatenate(pred_force_var), force_var, rtol=1e-4, atol=1e-10
+        ), "Ensemble variances do not match!"
+
+    image = images[0].copy()
+    image.set_calculator(calc)
+    assert np.isclose(image.get_potential_energy(), energies[0, 0], atol=1e-4)
+    assert np.isclose(calc.results["energy_variance"], energy_var[0, 0], rtol=1e-4)
+    assert calc.results["forces_variance"].shape == (3, 3)
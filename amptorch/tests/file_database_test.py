@@ -0,0 +1,192 @@
+import io
+import os
+import pickle
+import tarfile
+import hashlib
+import numpy as np
+from ase import Atoms
+from amptorch.gaussian import (
+    FileDatabase,
+    IndexedArchive,
+    Data,
+    NeighborlistCalculator,
+)
+from amptorch.profiling import profiler
+
+
+def test_lru_cache():
+    values = {str(i): np.full(100, i, dtype=np.float64) for i in range(4)}
+    db = FileDatabase("lru-cache", max_memory=None)
+    for key, value in values.items():
+        db[key] = value
+    size = db._memsizes["0"]
+
+    # the cache holds two entries, evicting the least recently used
+    db = FileDatabase("lru-cache", max_memory=2 * size)
+    for key in ["0", "1"]:
+        assert np.array_equal(db[key], values[key])
+    db["0"]
+    db["2"]
+    assert list(db._memdict) == ["0", "2"]
+    assert db._memory == 2 * size
+    db["3"]
+    assert list(db._memdict) == ["2", "3"]
+    assert np.array_equal(db["1"], values["1"])
+
+    # disabled and unbounded caches
+    db = FileDatabase("lru-cache", max_memory=0)
+    assert np.array_equal(db["0"], values["0"]) and not db._memdict
+    db = FileDatabase("lru-cache", max_memory=None)
+    for key in values:
+        db[key]
+    assert set(db._memdict) == set(values)
+
+
+def test_prefetch():
+    values = {str(i): np.full(100, i, dtype=np.float64) for i in range(4)}
+    db = FileDatabase("prefetch", max_memory=None)
+    for key, value in values.items():
+        db[key] = value
+
+    db = FileDatabase("prefetch", max_memory=None)
+    profiler.reset()
+    profiler.enable()
+    try:
+        db.prefetch(list(values), workers=2)
+        assert set(db._memdict) == set(values)
+        for key, value in values.items():
+            assert np.array_equal(db._memdict[key], value)
+        # prefetched reads are counted once, and cached reads not at all
+        assert profiler.counters["bytes_read"] == sum(db._memsizes.values())
+        db["0"]
+        assert profiler.counters["bytes_read"] == sum(db._memsizes.values())
+    finally:
+        profiler.disable()
+        profiler.reset()
+
+    # prefetching beyond the budget keeps the most recently read entries
+    db = FileDatabase("prefetch", max_memory=2 * db._memsizes["0"])
+    db.prefetch(list(values))
+    assert list(db._memdict) == ["2", "3"]
+    db = FileDatabase("prefetch", max_memory=0)
+    db.prefetch(list(values))
+    assert not db._memdict
+
+
+def test_atomic_writes():
+    db = FileDatabase("atomic-writes")
+    path = os.path.join(db.loosepath, "image")
+    digestpath = os.path.join(db.hashpath, "image")
+    db["image"] = np.arange(10.0)
+    inode = os.stat(path).st_ino
+
+    # unchanged entries are not rewritten
+    db["image"] = np.arange(10.0)
+    assert os.stat(path).st_ino == inode
+
+    # changed entries are replaced, along with their digests
+    db["image"] = np.arange(20.0)
+    assert os.stat(path).st_ino != inode
+    with open(path, "rb") as f:
+        digest = hashlib.md5(f.read()).hexdigest()
+    with open(digestpath) as f:
+        assert f.read() == digest
+    assert np.array_equal(FileDatabase("atomic-writes")["image"], np.arange(20.0))
+
+    # entries whose digest does not match are rewritten
+    with open(digestpath, "w") as f:
+        f.write("stale")
+    inode = os.stat(path).st_ino
+    db["image"] = np.arange(20.0)
+    assert os.stat(path).st_ino != inode
+    with open(digestpath) as f:
+        assert f.read() == digest
+
+    # a write interrupted before its digest leaves no stale digest behind,
+    # such that writing the previous value again replaces the contents
+    atomic_write = db._atomic_write
+
+    def interrupted_write(path, contents):
+        if path == digestpath:
+            raise KeyboardInterrupt
+        atomic_write(path, contents)
+
+    db._atomic_write = interrupted_write
+    try:
+        db["image"] = np.arange(30.0)
+    except KeyboardInterrupt:
+        pass
+    db._atomic_write = atomic_write
+    assert not os.path.exists(digestpath)
+    db["image"] = np.arange(20.0)
+    assert np.array_equal(FileDatabase("atomic-writes")["image"], np.arange(20.0))
+    with open(digestpath) as f:
+        assert f.read() == digest
+
+    # no temporary files are left behind
+    assert not [name for name in os.listdir(db.path) if name.startswith(".tmp-")]
+
+
+def test_archive():
+    db = FileDatabase("archive")
+    for key in ["a", "b"]:
+        db[key] = {"key": key}
+    # a legacy tar.gz archive, whose "b" entry is superseded by the loose one
+    with tarfile.open(db.tarpath, "w:gz") as tf:
+        for key, value in [("b", {"key": "old"}), ("c", {"key": "c"})]:
+            contents = pickle.dumps(value)
+            info = tarfile.TarInfo(key)
+            info.size = len(contents)
+            tf.addfile(info, io.BytesIO(contents))
+    assert FileDatabase("archive")["c"] == {"key": "c"}
+
+    for compress in [True, False]:
+        db = FileDatabase("archive")
+        db.archive(compress=compress)
+        assert not os.listdir(db.loosepath)
+        assert not os.path.exists(db.tarpath)
+        assert os.path.exists(db.archivepath)
+        db = FileDatabase("archive")
+        assert sorted(db.keys()) == ["a", "b", "c"]
+        for key in ["a", "b", "c"]:
+            assert db[key] == {"key": key}
+
+    # loose entries take precedence over archived ones
+    db["a"] = {"key": "new"}
+    assert FileDatabase("archive")["a"] == {"key": "new"}
+    db.archive()
+    archive = IndexedArchive(db.archivepath)
+    assert pickle.loads(archive.read("a")) == {"key": "new"}
+    assert sorted(archive.keys()) == ["a", "b", "c"]
+
+
+def test_calculate_items():
+    images = {}
+    for i, l in enumerate(np.linspace(2, 5, 6)):
+        image = Atoms("CuCO", [(-l, 0, 0), (0, 0, 0), (l, 0, 0)], cell=[10, 10, 10])
+        images["image-%i" % i] = image
+
+    neighborlists = {}
+    for name, parallel in [
+        ("serial", None),
+        ("process", {"cores": 2, "backend": "process"}),
+        ("thread", {"cores": 2, "backend": "thread"}),
+    ]:
+        data = Data("calculate-items-%s" % name, calculator=NeighborlistCalculator(4.0))
+        data.calculate_items(images, parallel=parallel)
+        neighborlists[name] = {key: data[key] for key in images}
+    for name in ["process", "thread"]:
+        for key in images:
+            for (indices, offsets), (ref_indices, ref_offsets) in zip(
+                neighborlists[name][key], neighborlists["serial"][key]
+            ):
+                assert np.array_equal(indices, ref_indices)
+                assert np.array_equal(offsets, ref_offsets)
+
+    data = Data("calculate-items-invalid", calculator=NeighborlistCalculator(4.0))
+    try:
+        data.calculate_items(images, parallel={"cores": 2, "backend": "mpi"})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("An unknown backend was accepted!")
@@ -68,8 +68,8 @@ def test_fps_memory():
 
         test = TestDataset(images[idx], base.elements, base.base_descriptor, Gs,
                     base.fprange, 'test2', cores=2)
-        test_fp = test.fps
-        test_prime = test.fp_primes
+        test_fp = test.fps[0]
+        test_prime = test.fp_primes[0]
 
 
 
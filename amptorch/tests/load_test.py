@@ -102,3 +102,10 @@ def test_load():
 
     assert energy_1 == energy_2, "Energies do not match!"
     assert (forces_1 == forces_2).all(), "Forces do not match!"
+
+    calc_3 = AMP.from_bundle('./results/trained_models/test_bundle.pt', label='test')
+    energy_3 = calc_3.get_potential_energy(images[0])
+    forces_3 = calc_3.get_forces(images[0])
+
+    assert np.isclose(energy_1, energy_3), "Bundle energies do not match!"
+    assert np.allclose(forces_1, forces_3), "Bundle forces do not match!"
@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+import torch
+import numpy as np
+from ase import Atoms
+from amptorch.fp_simple_nn import reorganize_simple_nn_fp, reorganize_simple_nn_derivative
+from amptorch.data_preprocess import (
+    scale_fingerprints,
+    scale_fingerprintprimes,
+    stack_fingerprints,
+)
+from amptorch.utils import calculate_fingerprints_range
+
+
+def test_numpy_fingerprints():
+    rng = np.random.RandomState(0)
+    image = Atoms("CuCCuO", positions=rng.rand(4, 3))
+    symbols = image.get_chemical_symbols()
+    elements = ["Cu", "C", "O"]
+    # simple_nn output, per element, with a constant column
+    x = {}
+    dx = {}
+    for element in elements:
+        count = symbols.count(element)
+        x[element] = rng.rand(count, 5)
+        x[element][:, 2] = 0.5
+        dx[element] = rng.rand(count, 5, 4, 3)
+    image_fingerprint = reorganize_simple_nn_fp(image, x)
+    image_primes = reorganize_simple_nn_derivative(image, dx)
+    assert [atom for atom, _ in image_fingerprint] == symbols
+    for atom, afp in image_fingerprint:
+        assert isinstance(afp, np.ndarray) and afp.shape == (5,)
+    for key, fprime in image_primes.items():
+        j, symbol, i, element, k = key
+        assert isinstance(fprime, np.ndarray)
+        row = [n for n, s in enumerate(symbols) if s == element].index(i)
+        assert np.allclose(fprime, dx[element][row, :, j, k])
+
+    # fingerprint ranges of a second, shifted image
+    shifted = [(atom, afp + 1) for atom, afp in image_fingerprint]
+    fp = SimpleNamespace(
+        parameters=SimpleNamespace(mode="atom-centered"),
+        fingerprints={"a": image_fingerprint, "b": shifted},
+    )
+    fprange = calculate_fingerprints_range(fp, {"a": None, "b": None})
+    for element in elements:
+        element_fps = np.array(
+            [afp for atom, afp in image_fingerprint + shifted if atom == element]
+        )
+        assert fprange[element].shape == (5, 2)
+        assert np.allclose(fprange[element][:, 0], element_fps.min(0))
+        assert np.allclose(fprange[element][:, 1], element_fps.max(0))
+
+    # scaling matches the per component scaling of lists of floats
+    scaled = scale_fingerprints(image_fingerprint, fprange)
+    for (atom, afp), (ref_atom, ref_afp) in zip(scaled, image_fingerprint):
+        ref_afp = list(ref_afp)
+        for n in range(len(ref_afp)):
+            low, high = fprange[atom][n]
+            if high - low > 1e-8:
+                ref_afp[n] = -1 + 2.0 * (ref_afp[n] - low) / (high - low)
+        assert atom == ref_atom
+        assert np.allclose(afp, ref_afp)
+    assert scale_fingerprints(image_fingerprint, fprange, np.float32)[0][1].dtype == (
+        np.float32
+    )
+    scaled_primes = scale_fingerprintprimes(image_primes, fprange)
+    for key, fprime in scaled_primes.items():
+        fprange_dif = fprange[key[3]][:, 1] - fprange[key[3]][:, 0]
+        fprange_dif[fprange_dif < 1e-8] = 2
+        assert np.allclose(fprime, 2 * image_primes[key] / fprange_dif)
+    # the stored fingerprints are not modified
+    assert np.allclose(image_fingerprint[0][1], x["Cu"][0])
+
+    element_fps = stack_fingerprints([scaled, scaled[:2]], elements)
+    assert element_fps["Cu"][0].shape == (3, 5)
+    assert element_fps["Cu"][1].tolist() == [0, 0, 1]
+    assert element_fps["O"][1].tolist() == [0]
+    assert torch.allclose(
+        element_fps["C"][0], torch.from_numpy(np.stack([scaled[1][1]] * 2))
+    )
@@ -0,0 +1,135 @@
+import torch
+import numpy as np
+from skorch import NeuralNetRegressor
+from ase import Atoms
+from ase.calculators.emt import EMT
+from amptorch.gaussian import SNN_Gaussian
+from amptorch.model import FullNN, CustomMSELoss
+from amptorch.data_preprocess import AtomsDataset, collate_amp
+from amptorch.precision import get_precision, numpy_dtype
+from amptorch.skorch_model import AMP
+
+
+def test_precision():
+    images = []
+    for l in np.linspace(2, 5, 4):
+        image = Atoms(
+            "CuCO",
+            [
+                (-l * np.sin(0.65), l * np.cos(0.65), 0),
+                (0, 0, 0),
+                (l * np.sin(0.65), l * np.cos(0.65), 0),
+            ],
+        )
+        image.set_cell([10, 10, 10])
+        image.wrap(pbc=True)
+        image.set_calculator(EMT())
+        images.append(image)
+
+    Gs = {}
+    Gs["G2_etas"] = np.logspace(np.log10(0.05), np.log10(5.0), num=2)
+    Gs["G2_rs_s"] = [0] * 2
+    Gs["G4_etas"] = [0.005]
+    Gs["G4_zetas"] = [1.0]
+    Gs["G4_gammas"] = [+1.0, -1]
+    Gs["cutoff"] = 6.5
+
+    datasets = {}
+    for precision in ["float64", "float32", "bfloat16"]:
+        datasets[precision] = AtomsDataset(
+            images, SNN_Gaussian, Gs, forcetraining=True, label="precision",
+            cores=1, precision=precision,
+        )
+    for precision, dataset in datasets.items():
+        policy = get_precision(precision)
+        fingerprint, energy, fprime, forces = dataset[0][:4]
+        assert fingerprint[0][1].dtype == numpy_dtype(policy.fingerprints)
+        assert fprime.dtype == policy.primes
+        assert forces.dtype == energy.dtype == policy.fingerprints
+    # stored fingerprints and primes halve in size
+    fp64 = datasets["float64"].fingerprint_dataset[0][0][1]
+    fp32 = datasets["float32"].fingerprint_dataset[0][0][1]
+    assert fp32.nbytes * 2 == fp64.nbytes
+    assert (
+        datasets["bfloat16"][0][2]._values().element_size() * 2
+        == datasets["float32"][0][2]._values().element_size()
+    )
+    try:
+        get_precision("float16")
+        raise AssertionError("Unknown precision accepted!")
+    except ValueError:
+        pass
+
+    torch.manual_seed(0)
+    reference_model = FullNN(
+        datasets["float64"].elements, [datasets["float64"].fp_length, 2, 5], "cpu",
+        forcetraining=True, precision="float64",
+    )
+    batch = collate_amp([datasets["float64"][i] for i in range(len(images))])
+    reference_energies, reference_forces = reference_model(batch[0])
+    force_scale = reference_forces.abs().max()
+    energy_scale = reference_energies.abs().max()
+    # relative error bounds of the energies and forces of each policy
+    bounds = {"float32": (1e-6, 1e-6), "bfloat16": (1e-6, 1e-2)}
+    for precision, (energy_tol, force_tol) in bounds.items():
+        dataset = datasets[precision]
+        model = FullNN(
+            dataset.elements, [dataset.fp_length, 2, 5], "cpu", forcetraining=True,
+            precision=precision,
+        )
+        model.load_state_dict(reference_model.state_dict())
+        assert next(model.parameters()).dtype == torch.float32
+        batch = collate_amp([dataset[i] for i in range(len(images))])
+        energies, forces = model(batch[0])
+        assert energies.dtype == forces.dtype == torch.float32
+        energy_error = (energies.double() - reference_energies).abs().max() / energy_scale
+        force_error = (forces.double() - reference_forces).abs().max() / force_scale
+        assert energy_error < energy_tol, (precision, energy_error)
+        assert force_error < force_tol, (precision, force_error)
+        loss = CustomMSELoss(force_coefficient=0.3)((energies, forces), batch[1])
+        loss.backward()
+
+    # bfloat16 primes are stored and loaded as their 16 bits
+    stored = AtomsDataset(
+        images, SNN_Gaussian, Gs, forcetraining=True, label="precision", cores=1,
+        store_primes=True, precision="bfloat16",
+    )
+    for i in range(len(images)):
+        fprime = stored[i][2].coalesce()
+        assert fprime.dtype == torch.bfloat16
+        assert torch.equal(
+            fprime.to_dense(), datasets["bfloat16"][i][2].coalesce().to_dense()
+        )
+    # and kept apart from the primes stored under other policies
+    stored = AtomsDataset(
+        images, SNN_Gaussian, Gs, forcetraining=True, label="precision", cores=1,
+        store_primes=True, precision="float32",
+    )
+    for i in range(len(images)):
+        fprime = stored[i][2].coalesce()
+        assert fprime.dtype == torch.float32
+        assert torch.equal(
+            fprime.to_dense(), datasets["float32"][i][2].coalesce().to_dense()
+        )
+
+    # the policy is kept by the model bundles
+    net = NeuralNetRegressor(
+        module=reference_model,
+        criterion=CustomMSELoss,
+        criterion__force_coefficient=0.3,
+        iterator_train__collate_fn=collate_amp,
+        iterator_train__shuffle=False,
+        train_split=0,
+        verbose=0,
+    )
+    net.initialize()
+    calc = AMP(datasets["float64"], net, "precision", save_logs=False)
+    net.save_params(f_params=calc.label)
+    energies, forces = calc.predict(images)
+    calc.save_bundle("precision_bundle.pt")
+    loaded = AMP.from_bundle("precision_bundle.pt", label="precision")
+    assert loaded.model.module.precision.name == "float64"
+    loaded_energies, loaded_forces = loaded.predict(images)
+    assert np.allclose(energies, loaded_energies, rtol=1e-10)
+    for force, loaded_force in zip(forces, loaded_forces):
+        assert np.allclose(force, loaded_force, rtol=1e-10, atol=1e-12)
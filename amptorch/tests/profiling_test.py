@@ -0,0 +1,118 @@
+import json
+import torch
+import numpy as np
+from skorch import NeuralNetRegressor
+from ase import Atoms
+from ase.calculators.emt import EMT
+from amptorch.gaussian import SNN_Gaussian
+from amptorch.model import FullNN, CustomMSELoss
+from amptorch.data_preprocess import AtomsDataset, collate_amp
+from amptorch.fp_simple_nn import make_amp_descriptors_simple_nn
+from amptorch.skorch_model.utils import target_extractor, energy_score, forces_score
+from amptorch.profiling import profiler
+from amptorch.utils import Logger
+
+
+def test_profiling():
+    images = []
+    for l in np.linspace(2, 5, 4):
+        image = Atoms(
+            "CuCO",
+            [
+                (-l * np.sin(0.65), l * np.cos(0.65), 0),
+                (0, 0, 0),
+                (l * np.sin(0.65), l * np.cos(0.65), 0),
+            ],
+        )
+        image.set_cell([10, 10, 10])
+        image.wrap(pbc=True)
+        image.set_calculator(EMT())
+        images.append(image)
+
+    Gs = {}
+    Gs["G2_etas"] = np.logspace(np.log10(0.05), np.log10(5.0), num=2)
+    Gs["G2_rs_s"] = [0] * 2
+    Gs["G4_etas"] = [0.005]
+    Gs["G4_zetas"] = [1.0]
+    Gs["G4_gammas"] = [+1.0, -1]
+    Gs["cutoff"] = 6.5
+
+    profiler.reset()
+    profiler.enable()
+    try:
+        make_amp_descriptors_simple_nn(
+            images, Gs, ["Cu", "C", "O"], forcetraining=True, cores=1,
+            label="profiling", save=False,
+        )
+        training_data = AtomsDataset(
+            images, SNN_Gaussian, Gs, forcetraining=True, label="profiling", cores=1
+        )
+        net = NeuralNetRegressor(
+            module=FullNN(
+                training_data.elements,
+                [training_data.fp_length, 2, 2],
+                "cpu",
+                forcetraining=True,
+            ),
+            criterion=CustomMSELoss,
+            criterion__force_coefficient=0.3,
+            optimizer=torch.optim.Adam,
+            batch_size=2,
+            max_epochs=2,
+            iterator_train__collate_fn=collate_amp,
+            iterator_valid__collate_fn=collate_amp,
+            train_split=0,
+            verbose=0,
+        )
+        net.fit(training_data, None)
+        batch = collate_amp([training_data[i] for i in range(len(training_data))])
+        y = list(target_extractor(batch[1]))
+        energy_score(net, training_data, y)
+        forces_score(net, training_data, y)
+    finally:
+        profiler.disable()
+
+    summary = profiler.summary()
+    for name in [
+        "hash_images",
+        "make_simple_nn_fps",
+        "convert_simple_nn_fps",
+        "preprocess_data",
+        "collate_amp",
+        "FullNN.forward",
+        "loss",
+        "energy_score",
+        "forces_score",
+    ]:
+        assert summary[name]["calls"] > 0, "Span {} was not recorded!".format(name)
+        assert summary[name]["total"] >= summary[name]["max"] > 0
+    # 2 epochs of 2 batches, and the collated batch above
+    assert summary["loss"]["calls"] == 4
+    assert summary["collate_amp"]["calls"] >= 5
+
+    counters = profiler.counters
+    assert counters["images_preprocessed"] == len(images)
+    assert counters["atoms_preprocessed"] == 3 * len(images)
+    assert counters["prime_nnz"] == sum(
+        prime._nnz() for prime in training_data.sparse_fprimes
+    )
+    assert counters["bytes_read"] > 0
+
+    profiler.save_trace("profiling_trace.json")
+    with open("profiling_trace.json") as f:
+        trace = json.load(f)
+    assert len(trace["traceEvents"]) == sum(
+        stats["calls"] for stats in summary.values()
+    )
+    assert trace["counters"]["images_preprocessed"] == len(images)
+
+    with open("profiling_summary.txt", "w") as f:
+        profiler.log_summary(Logger(f))
+    with open("profiling_summary.txt") as f:
+        contents = f.read()
+    assert "preprocess_data" in contents and "prime_nnz" in contents
+
+    # nothing is recorded while disabled
+    profiler.reset()
+    collate_amp([training_data[0]])
+    assert profiler.summary() == {} and not profiler.counters
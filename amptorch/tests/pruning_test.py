@@ -0,0 +1,128 @@
+import torch
+import numpy as np
+from skorch import NeuralNetRegressor
+from ase import Atoms
+from ase.calculators.emt import EMT
+from amptorch.gaussian import SNN_Gaussian
+from amptorch.model import FullNN, CustomMSELoss
+from amptorch.data_preprocess import AtomsDataset, collate_amp
+from amptorch.skorch_model import AMP
+
+
+def test_fingerprint_pruning():
+    images = []
+    for l in np.linspace(2, 5, 10):
+        image = Atoms(
+            "CuCO",
+            [
+                (-l * np.sin(0.65), l * np.cos(0.65), 0),
+                (0, 0, 0),
+                (l * np.sin(0.65), l * np.cos(0.65), 0),
+            ],
+        )
+        image.set_cell([10, 10, 10])
+        image.wrap(pbc=True)
+        image.set_calculator(EMT())
+        images.append(image)
+
+    # repeated etas give duplicate columns; pairs of absent neighbors (e.g. Cu
+    # around Cu) give constant columns
+    Gs = {}
+    Gs["G2_etas"] = [0.05, 0.05, 5.0]
+    Gs["G2_rs_s"] = [0] * 3
+    Gs["G4_etas"] = [0.005]
+    Gs["G4_zetas"] = [1.0]
+    Gs["G4_gammas"] = [+1.0, -1]
+    Gs["cutoff"] = 6.5
+
+    full_data = AtomsDataset(
+        images, SNN_Gaussian, Gs, forcetraining=True, label="pruning", cores=1
+    )
+    training_data = AtomsDataset(
+        images,
+        SNN_Gaussian,
+        Gs,
+        forcetraining=True,
+        label="pruning",
+        cores=1,
+        prune_tol=1e-8,
+    )
+    fp_mask = training_data.fp_mask
+    fp_length = training_data.fp_length
+    for element in training_data.elements:
+        width = fp_length[element] if isinstance(fp_length, dict) else fp_length
+        assert width == fp_mask[element].sum() < full_data.fp_length
+    for index in range(len(images)):
+        rows = []
+        for atom, ((element, fp), (_, full_fp)) in enumerate(
+            zip(
+                training_data.fingerprint_dataset[index],
+                full_data.fingerprint_dataset[index],
+            )
+        ):
+            assert np.allclose(fp, full_fp[fp_mask[element]])
+            rows.append(
+                atom * full_data.fp_length + np.nonzero(fp_mask[element])[0]
+            )
+        rows = np.concatenate(rows)
+        assert torch.allclose(
+            training_data.sparse_fprimes[index].to_dense(),
+            full_data.sparse_fprimes[index].to_dense()[rows],
+        ), "Pruned fingerprintprimes are inconsistent!"
+
+    # stored fingerprintprimes are kept apart per fingerprint mask
+    for reference in [full_data, training_data]:
+        stored_data = AtomsDataset(
+            images,
+            SNN_Gaussian,
+            Gs,
+            forcetraining=True,
+            label="pruning",
+            cores=1,
+            prune_tol=reference.prune_tol,
+            store_primes=True,
+        )
+        for index in range(len(stored_data)):
+            assert torch.allclose(
+                stored_data[index][2].to_dense(),
+                reference.sparse_fprimes[index].to_dense(),
+            ), "Stored fingerprintprimes of another mask were loaded!"
+    assert full_data.prime_key != training_data.prime_key
+
+    torch.manual_seed(0)
+    net = NeuralNetRegressor(
+        module=FullNN(
+            training_data.elements,
+            [training_data.fp_length, 2, 5],
+            "cpu",
+            forcetraining=True,
+        ),
+        criterion=CustomMSELoss,
+        criterion__force_coefficient=0.3,
+        optimizer=torch.optim.LBFGS,
+        lr=1e-1,
+        batch_size=len(training_data),
+        max_epochs=2,
+        iterator_train__collate_fn=collate_amp,
+        iterator_train__shuffle=False,
+        train_split=0,
+        verbose=0,
+    )
+    calc = AMP(training_data, net, "pruning")
+    net.fit(training_data, None)
+    net.save_params(f_params=calc.label)
+    calc.save_bundle(calc.bundle_label)
+
+    # inference applies the same projection
+    batch = collate_amp([training_data[i] for i in range(len(training_data))])
+    energy_pred, force_pred = net.module(batch[0])
+    scale = training_data.scalings[-1]
+    num_atoms = batch[1][1]
+    energies = scale.denorm(energy_pred / num_atoms) * num_atoms
+    forces = scale.denorm(force_pred, energy=False)
+    for predictor in [calc, AMP.from_bundle(calc.bundle_label, label="pruning")]:
+        pred_energies, pred_forces = predictor.predict(images)
+        assert np.allclose(pred_energies, energies.detach().numpy().reshape(-1), atol=1e-4)
+        assert np.allclose(
+            np.concatenate(pred_forces), forces.detach().numpy(), atol=1e-4
+        ), "Inference does not apply the fingerprint mask!"
@@ -139,6 +139,29 @@ def test_skorch():
         idx += 3
     force_loss_image /= 3
 
+    batch_energies, batch_forces = calc.predict(images, batch_size=32)
+    assert np.allclose(
+        batch_energies, calculated_energies, atol=1e-5
+    ), "Batched energy predictions do not match!"
+    assert np.allclose(
+        np.concatenate(batch_forces), calculated_forces, atol=1e-5
+    ), "Batched force predictions do not match!"
+
+    calc.export_torchscript("results/trained_models/test_script.pt")
+    scripted = torch.jit.load("results/trained_models/test_script.pt")
+    test_data = TestDataset(
+        images, calc.elements, calc.descriptor, calc.Gs, calc.fprange, label=calc.testlabel
+    )
+    scripted_energies, scripted_forces = scripted(
+        *test_data.collate_script([test_data[i] for i in range(len(test_data))])
+    )
+    assert np.allclose(
+        scripted_energies.numpy().reshape(-1), calculated_energies, atol=1e-5
+    ), "TorchScript energy predictions do not match!"
+    assert np.allclose(
+        scripted_forces.numpy(), calculated_forces, atol=1e-5
+    ), "TorchScript force predictions do not match!"
+
     reported_energy_score = net.history[-1]["energy_score"]
     reported_forces_score = net.history[-1]["forces_score"]
     assert force_rmse <= 0.005, "Force training convergence not met!"
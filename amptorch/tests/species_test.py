@@ -0,0 +1,157 @@
+import torch
+import numpy as np
+from skorch import NeuralNetRegressor
+from ase import Atoms
+from ase.build import fcc111
+from ase.calculators.emt import EMT
+from amptorch.gaussian import SNN_Gaussian
+from amptorch.fp_simple_nn import make_snn_params
+from amptorch.model import FullNN, CustomMSELoss
+from amptorch.data_preprocess import AtomsDataset, TestDataset, collate_amp
+from amptorch.skorch_model import AMP
+
+
+def test_species_fps():
+    images = []
+    for l in np.linspace(2, 5, 6):
+        image = Atoms(
+            "CuCO",
+            [
+                (-l * np.sin(0.65), l * np.cos(0.65), 0),
+                (0, 0, 0),
+                (l * np.sin(0.65), l * np.cos(0.65), 0),
+            ],
+        )
+        image.set_cell([10, 10, 10])
+        image.wrap(pbc=True)
+        image.set_calculator(EMT())
+        images.append(image)
+    # a pure Cu slab, whose atoms only see Cu neighbors
+    for displacement in [0, 0.1]:
+        slab = fcc111("Cu", size=(2, 2, 2), vacuum=10.0)
+        slab.positions[-1, 2] += displacement
+        slab.set_calculator(EMT())
+        images.append(slab)
+
+    Gs = {}
+    Gs["G2_etas"] = np.logspace(np.log10(0.05), np.log10(5.0), num=2)
+    Gs["G2_rs_s"] = [0] * 2
+    Gs["G4_etas"] = [0.005]
+    Gs["G4_zetas"] = [1.0]
+    Gs["G4_gammas"] = [+1.0, -1]
+    Gs["cutoff"] = 3.0
+
+    full_data = AtomsDataset(
+        images, SNN_Gaussian, Gs, forcetraining=True, label="species", cores=1
+    )
+    training_data = AtomsDataset(
+        images,
+        SNN_Gaussian,
+        dict(Gs, species="auto"),
+        forcetraining=True,
+        label="species",
+        cores=1,
+    )
+    species = training_data.Gs["species"]
+    # the wrapped CuCO images are periodic to simple_nn, such that Cu sees C
+    # and O across the cell boundary
+    assert species["Cu"]["G2"] == ["C", "Cu", "O"]
+    elements = training_data.elements
+    fp_length = training_data.fp_length
+    assert isinstance(fp_length, dict)
+    assert all(fp_length[element] < full_data.fp_length for element in elements)
+
+    # the element specific fingerprints are the matching full fingerprint columns
+    def rows(params):
+        return [tuple(i) + tuple(d) for i, d in zip(params["i"], params["d"])]
+
+    full_params = make_snn_params(
+        elements, Gs["G2_etas"], Gs["G2_rs_s"], Gs["G4_etas"], Gs["cutoff"],
+        Gs["G4_zetas"], Gs["G4_gammas"],
+    )
+    species_params = make_snn_params(
+        elements, Gs["G2_etas"], Gs["G2_rs_s"], Gs["G4_etas"], Gs["cutoff"],
+        Gs["G4_zetas"], Gs["G4_gammas"], species=species,
+    )
+    columns = {}
+    for element in elements:
+        full_rows = rows(full_params[element])
+        columns[element] = [
+            full_rows.index(row) for row in rows(species_params[element])
+        ]
+        assert len(columns[element]) == fp_length[element]
+    for index in range(len(images)):
+        for (element, fp), (_, full_fp) in zip(
+            training_data.fingerprint_dataset[index],
+            full_data.fingerprint_dataset[index],
+        ):
+            assert np.allclose(fp, full_fp[columns[element]])
+            # dropped symmetry functions are identically zero
+            dropped = np.setdiff1d(np.arange(full_data.fp_length), columns[element])
+            assert np.allclose(full_fp[dropped], 0)
+
+    # a model of per element input widths is that of full input width whose
+    # dropped columns are weighted zero
+    torch.manual_seed(0)
+    model = FullNN(elements, [fp_length, 2, 3], "cpu", forcetraining=True)
+    full_model = FullNN(elements, [full_data.fp_length, 2, 3], "cpu", forcetraining=True)
+    full_state = model.state_dict()
+    for element in elements:
+        key = "elementwise_models.{}.model_net.0.weight".format(element)
+        weight = torch.zeros(full_state[key].size(0), full_data.fp_length)
+        weight[:, columns[element]] = full_state[key]
+        full_state[key] = weight
+    full_model.load_state_dict(full_state)
+    batch = collate_amp([training_data[i] for i in range(len(training_data))])
+    full_batch = collate_amp([full_data[i] for i in range(len(full_data))])
+    energy_pred, force_pred = model(batch[0])
+    full_energy_pred, full_force_pred = full_model(full_batch[0])
+    assert torch.allclose(energy_pred, full_energy_pred, atol=1e-6)
+    assert torch.allclose(
+        force_pred, full_force_pred, atol=1e-6
+    ), "Element specific fingerprintprimes are inconsistent!"
+
+    net = NeuralNetRegressor(
+        module=model,
+        criterion=CustomMSELoss,
+        criterion__force_coefficient=0.3,
+        optimizer=torch.optim.LBFGS,
+        lr=1e-1,
+        batch_size=len(training_data),
+        max_epochs=2,
+        iterator_train__collate_fn=collate_amp,
+        iterator_train__shuffle=False,
+        train_split=0,
+        verbose=0,
+    )
+    calc = AMP(training_data, net, "species")
+    net.fit(training_data, None)
+    net.save_params(f_params=calc.label)
+    calc.save_bundle(calc.bundle_label)
+
+    batch = collate_amp([training_data[i] for i in range(len(training_data))])
+    energy_pred, force_pred = net.module(batch[0])
+    scale = training_data.scalings[-1]
+    num_atoms = batch[1][1]
+    energies = (scale.denorm(energy_pred / num_atoms) * num_atoms).detach().numpy()
+    forces = scale.denorm(force_pred, energy=False).detach().numpy()
+    for predictor in [calc, AMP.from_bundle(calc.bundle_label, label="species")]:
+        pred_energies, pred_forces = predictor.predict(images)
+        assert np.allclose(pred_energies, energies.reshape(-1), atol=1e-4)
+        assert np.allclose(np.concatenate(pred_forces), forces, atol=1e-4)
+
+    calc.export_torchscript("results/trained_models/species_script.pt")
+    scripted = torch.jit.load("results/trained_models/species_script.pt")
+    test_data = TestDataset(
+        images, calc.elements, calc.descriptor, calc.Gs, calc.fprange, label="species"
+    )
+    scripted_energies, scripted_forces = scripted(
+        *test_data.collate_script([test_data[i] for i in range(len(test_data))])
+    )
+    assert np.allclose(
+        scripted_energies.numpy().reshape(-1), energies.reshape(-1),
+        rtol=1e-4, atol=1e-4
+    )
+    assert np.allclose(
+        scripted_forces.numpy(), forces, atol=1e-4
+    ), "TorchScript predictions of element specific fingerprints do not match!"
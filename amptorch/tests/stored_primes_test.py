@@ -0,0 +1,82 @@
+import torch
+import numpy as np
+from ase import Atoms
+from ase.calculators.emt import EMT
+from amptorch.gaussian import SNN_Gaussian
+from amptorch.data_preprocess import (
+    AtomsDataset,
+    save_fingerprintprimes,
+    load_fingerprintprimes,
+    stored_fingerprintprimes,
+)
+
+
+def test_stored_primes():
+    rng = np.random.RandomState(0)
+    dense = rng.rand(12, 9) * (rng.rand(12, 9) < 0.3)
+    for dtype in [torch.float64, torch.float32, torch.bfloat16]:
+        fingerprintprimes = torch.tensor(dense, dtype=dtype).to_sparse()
+        path = "round-trip-%s" % str(dtype).split(".")[-1]
+        assert not stored_fingerprintprimes(path)
+        save_fingerprintprimes(path, fingerprintprimes)
+        assert stored_fingerprintprimes(path)
+        loaded = load_fingerprintprimes(path, dense.shape)
+        assert loaded.is_sparse and loaded.dtype == dtype
+        assert loaded._nnz() == np.count_nonzero(dense)
+        assert torch.equal(loaded.to_dense(), fingerprintprimes.to_dense())
+    # values are cast to the requested dtype, whatever they are stored in
+    for path in ["round-trip-float32", "round-trip-bfloat16"]:
+        for dtype in [torch.float32, torch.bfloat16]:
+            loaded = load_fingerprintprimes(path, dense.shape, dtype)
+            assert loaded.dtype == dtype
+            assert torch.allclose(
+                loaded.to_dense().double(), torch.tensor(dense), rtol=1e-2
+            )
+    empty = torch.zeros(4, 6).to_sparse()
+    save_fingerprintprimes("round-trip-empty", empty)
+    loaded = load_fingerprintprimes("round-trip-empty", (4, 6))
+    assert loaded._nnz() == 0 and loaded.shape == (4, 6)
+
+    images = []
+    for l in np.linspace(2, 5, 4):
+        image = Atoms(
+            "CuCO",
+            [
+                (-l * np.sin(0.65), l * np.cos(0.65), 0),
+                (0, 0, 0),
+                (l * np.sin(0.65), l * np.cos(0.65), 0),
+            ],
+        )
+        image.set_cell([10, 10, 10])
+        image.wrap(pbc=True)
+        image.set_calculator(EMT())
+        images.append(image)
+    Gs = {}
+    Gs["G2_etas"] = np.logspace(np.log10(0.05), np.log10(5.0), num=2)
+    Gs["G2_rs_s"] = [0] * 2
+    Gs["G4_etas"] = [0.005]
+    Gs["G4_zetas"] = [1.0]
+    Gs["G4_gammas"] = [+1.0, -1]
+    Gs["cutoff"] = 6.5
+
+    in_memory = AtomsDataset(
+        images, SNN_Gaussian, Gs, forcetraining=True, label="stored", cores=1
+    )
+    # preprocessed twice, the second time reading the stored primes
+    for _ in range(2):
+        stored = AtomsDataset(
+            images,
+            SNN_Gaussian,
+            Gs,
+            forcetraining=True,
+            label="stored",
+            cores=1,
+            store_primes=True,
+        )
+        assert not stored.sparse_fprimes
+        for index in range(len(images)):
+            fprime = stored[index][2]
+            assert fprime.is_sparse
+            assert torch.allclose(
+                fprime.to_dense(), in_memory[index][2].to_dense()
+            ), "Stored fingerprintprimes do not match!"
@@ -0,0 +1,93 @@
+import os
+import torch
+import numpy as np
+from ase import Atoms
+from ase.io import write
+from ase.db import connect
+from ase.calculators.emt import EMT
+from amptorch.gaussian import SNN_Gaussian
+from amptorch.data_preprocess import AtomsDataset
+from amptorch.utils import image_chunks
+
+
+def test_streaming():
+    images = []
+    for l in np.linspace(2, 5, 5):
+        image = Atoms(
+            "CuCO",
+            [
+                (-l * np.sin(0.65), l * np.cos(0.65), 0),
+                (0, 0, 0),
+                (l * np.sin(0.65), l * np.cos(0.65), 0),
+            ],
+        )
+        image.set_cell([10, 10, 10])
+        image.wrap(pbc=True)
+        image.set_calculator(EMT())
+        image.get_potential_energy()
+        image.get_forces()
+        images.append(image)
+    images += [images[0], images[3]]
+
+    write("streaming.traj", images)
+    if os.path.exists("streaming.db"):
+        os.remove("streaming.db")
+    with connect("streaming.db") as db:
+        for image in images:
+            db.write(image)
+
+    # chunks are read lazily, in order
+    for source in [images, "streaming.traj", "streaming.db"]:
+        chunks = list(image_chunks(source, 3))
+        assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+        assert all(
+            np.allclose(atoms.positions, image.positions)
+            for atoms, image in zip(sum(chunks, []), images)
+        )
+
+    Gs = {}
+    Gs["G2_etas"] = np.logspace(np.log10(0.05), np.log10(5.0), num=2)
+    Gs["G2_rs_s"] = [0] * 2
+    Gs["G4_etas"] = [0.005]
+    Gs["G4_zetas"] = [1.0]
+    Gs["G4_gammas"] = [+1.0, -1]
+    Gs["cutoff"] = 6.5
+
+    reference = AtomsDataset(
+        images, SNN_Gaussian, Gs, forcetraining=True, label="streaming", cores=1
+    )
+    for source, chunk_size in [
+        (images, 2),
+        ("streaming.traj", 3),
+        ("streaming.db", 2),
+    ]:
+        streamed = AtomsDataset(
+            source,
+            SNN_Gaussian,
+            Gs,
+            forcetraining=True,
+            label="streaming",
+            cores=1,
+            chunk_size=chunk_size,
+        )
+        # only the hashes and targets of the images are kept
+        assert not hasattr(streamed, "hashed_images")
+        assert len(streamed.targets) == len(reference)
+        assert streamed.elements == reference.elements
+        assert streamed.index_hashes == reference.index_hashes
+        assert streamed.image_weights.tolist() == reference.image_weights.tolist()
+        for element in reference.fprange:
+            assert np.allclose(streamed.fprange[element], reference.fprange[element])
+        assert torch.allclose(streamed.energy_dataset, reference.energy_dataset)
+        for index in range(len(reference)):
+            streamed_item = streamed[index]
+            reference_item = reference[index]
+            for (element, afp), (ref_element, ref_afp) in zip(
+                streamed_item[0], reference_item[0]
+            ):
+                assert element == ref_element
+                assert np.allclose(afp, ref_afp)
+            assert torch.allclose(
+                streamed_item[2].to_dense(), reference_item[2].to_dense()
+            )
+            assert torch.allclose(streamed_item[3], reference_item[3])
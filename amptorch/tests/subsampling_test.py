@@ -0,0 +1,121 @@
+import torch
+import numpy as np
+from ase import Atoms
+from ase.calculators.emt import EMT
+from amptorch.gaussian import SNN_Gaussian
+from amptorch.data_preprocess import AtomsDataset, DatasetView, collate_amp
+from amptorch.subsampling import subsample_points
+
+
+def test_subsample_points():
+    random_state = np.random.RandomState(0)
+    centers = random_state.uniform(-10, 10, size=(20, 4))
+    # clusters of near-identical points around well separated centers
+    data = np.concatenate(
+        [centers + 1e-4 * random_state.randn(*centers.shape) for _ in range(5)]
+    )
+    reference = None
+    for method in ["pykdtree", "kdtree", "balltree"]:
+        for chunk_size, cores in [(10000, 1), (7, 3)]:
+            kept = subsample_points(
+                data,
+                cutoff_sig=0.01,
+                rate=0.5,
+                method=method,
+                chunk_size=chunk_size,
+                cores=cores,
+                seed=0,
+            )
+            assert sorted(set(kept % len(centers))) == list(
+                range(len(centers))
+            ), "Subsampling removed a whole cluster!"
+            assert len(kept) == len(centers)
+            if reference is None:
+                reference = kept
+            assert np.array_equal(kept, reference)
+    # the projection keeps the clusters apart
+    projected = subsample_points(
+        data, cutoff_sig=0.01, pca_target_variance=0.99, seed=0
+    )
+    assert len(projected) == len(centers)
+    # of exact duplicates, only one copy is removed
+    points = random_state.rand(200, 4)
+    duplicated = np.concatenate([points, points])
+    for method in ["pykdtree", "kdtree", "balltree"]:
+        kept = subsample_points(
+            duplicated, cutoff_sig=1e-6, rate=1.0, method=method, seed=0
+        )
+        assert sorted(kept % len(points)) == list(
+            range(len(points))
+        ), "Subsampling removed both copies of a duplicate!"
+    try:
+        subsample_points(data, method="octree")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("An unknown method was accepted!")
+
+
+def test_dataset_subsample():
+    images = []
+    for l in np.linspace(2, 5, 6):
+        for displacement in [0, 1e-5, 2e-5]:
+            image = Atoms(
+                "CuCO",
+                [
+                    (-l * np.sin(0.65), l * np.cos(0.65), 0),
+                    (0, 0, displacement),
+                    (l * np.sin(0.65), l * np.cos(0.65), 0),
+                ],
+            )
+            image.set_cell([10, 10, 10])
+            image.wrap(pbc=True)
+            image.set_calculator(EMT())
+            images.append(image)
+
+    Gs = {}
+    Gs["G2_etas"] = np.logspace(np.log10(0.05), np.log10(5.0), num=2)
+    Gs["G2_rs_s"] = [0] * 2
+    Gs["G4_etas"] = [0.005]
+    Gs["G4_zetas"] = [1.0]
+    Gs["G4_gammas"] = [+1.0, -1]
+    Gs["cutoff"] = 6.5
+
+    training_data = AtomsDataset(
+        images, SNN_Gaussian, Gs, forcetraining=True, label="subsample", cores=2
+    )
+    subset = training_data.subsample_view(cutoff_sig=0.01, rate=0.5, seed=0)
+    assert isinstance(subset, DatasetView)
+    # near-identical displacements are redundant, while every bond length is
+    # covered
+    assert len(subset) < len(training_data)
+    assert sorted(set(np.asarray(subset.indices) // 3)) == list(range(6))
+
+    # the view shares the dataset's fingerprints and scalings
+    assert subset.scalings is training_data.scalings
+    assert subset.fp_length == training_data.fp_length
+    for i, index in enumerate(subset.indices):
+        assert subset[i][0] is training_data[index][0]
+    assert np.array_equal(
+        subset.image_costs(), training_data.image_costs()[subset.indices]
+    )
+    batch = collate_amp([subset[i] for i in range(len(subset))])
+    assert torch.allclose(
+        batch[1][0],
+        collate_amp([training_data[i] for i in subset.indices])[1][0],
+    )
+
+    # subsample refingerprints the dataset with the kept images
+    images_keep, idx_keep = training_data.subsample(
+        cutoff_sig=0.01, rate=0.5, seed=0
+    )
+    assert idx_keep == list(subset.indices)
+    assert all(images_keep[i] is images[index] for i, index in enumerate(idx_keep))
+    assert len(training_data) == len(idx_keep)
+    assert torch.allclose(
+        training_data.energy_dataset,
+        AtomsDataset(
+            images_keep, SNN_Gaussian, Gs, forcetraining=True, label="subsample",
+            cores=2
+        ).energy_dataset,
+    )
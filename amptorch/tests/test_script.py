@@ -9,6 +9,34 @@ from delta_test import test_skorch_delta
 from skorch_test import test_skorch, test_e_only_skorch
 from fps_from_memory_test import test_fps_memory
 from load_test import test_load
+from torch_fp_test import (
+    test_torch_fp_match,
+    test_autograd_forces,
+    test_positions_training,
+)
+from batching_test import test_atoms_batch_sampler, test_worker_loading
+from distributed_test import test_distributed_training
+from duplicates_test import test_duplicate_images
+from pruning_test import test_fingerprint_pruning
+from species_test import test_species_fps
+from column_cache_test import test_column_cache
+from ensemble_test import test_ensemble
+from subsampling_test import test_subsample_points, test_dataset_subsample
+from profiling_test import test_profiling
+from benchmarks_test import test_emt_dataset, test_benchmarks
+from energy_only_test import test_energy_only
+from precision_test import test_precision
+from compression_test import test_prime_compression, test_compressed_dataset
+from streaming_test import test_streaming
+from file_database_test import (
+    test_lru_cache,
+    test_prefetch,
+    test_atomic_writes,
+    test_archive,
+    test_calculate_items,
+)
+from numpy_fps_test import test_numpy_fingerprints
+from stored_primes_test import test_stored_primes
 from val_test import (
     test_skorch_val,
     test_energy_only_skorch_val,
@@ -42,6 +70,88 @@ class TestMethods(unittest.TestCase):
         test_load()
         print("Loading trained model test passed!")
 
+    def test_torch_fps(self):
+        test_torch_fp_match()
+        test_autograd_forces()
+        test_positions_training()
+        print("Torch fingerprint tests passed!")
+
+    def test_batching(self):
+        test_atoms_batch_sampler()
+        test_worker_loading()
+        print("Batching tests passed!")
+
+    def test_distributed(self):
+        test_distributed_training()
+        print("Distributed training test passed!")
+
+    def test_duplicates(self):
+        test_duplicate_images()
+        print("Duplicate image tests passed!")
+
+    def test_pruning(self):
+        test_fingerprint_pruning()
+        print("Fingerprint pruning test passed!")
+
+    def test_species(self):
+        test_species_fps()
+        print("Element specific fingerprint test passed!")
+
+    def test_column_cache(self):
+        test_column_cache()
+        print("Fingerprint column cache test passed!")
+
+    def test_ensemble(self):
+        test_ensemble()
+        print("Ensemble test passed!")
+
+    def test_subsampling(self):
+        test_subsample_points()
+        test_dataset_subsample()
+        print("Subsampling tests passed!")
+
+    def test_profiling(self):
+        test_profiling()
+        print("Profiling test passed!")
+
+    def test_benchmarks(self):
+        test_emt_dataset()
+        test_benchmarks()
+        print("Benchmark tests passed!")
+
+    def test_energy_only(self):
+        test_energy_only()
+        print("Energy-only test passed!")
+
+    def test_precision(self):
+        test_precision()
+        print("Precision test passed!")
+
+    def test_compression(self):
+        test_prime_compression()
+        test_compressed_dataset()
+        print("Compression tests passed!")
+
+    def test_streaming(self):
+        test_streaming()
+        print("Streaming ingestion test passed!")
+
+    def test_file_database(self):
+        test_lru_cache()
+        test_prefetch()
+        test_atomic_writes()
+        test_archive()
+        test_calculate_items()
+        print("FileDatabase tests passed!")
+
+    def test_numpy_fingerprints(self):
+        test_numpy_fingerprints()
+        print("NumPy fingerprint pipeline test passed!")
+
+    def test_stored_primes(self):
+        test_stored_primes()
+        print("Stored fingerprintprimes test passed!")
+
     def test_skorch_val(self):
         test_skorch_val()
         test_energy_only_skorch_val()
@@ -0,0 +1,185 @@
+import copy
+import numpy as np
+import torch
+from ase import Atoms
+from ase.build import molecule, fcc100, add_adsorbate
+from ase.calculators.emt import EMT
+from skorch import NeuralNetRegressor
+from amptorch.fp_simple_nn import wrap_symmetry_functions
+from amptorch.fp_torch import (
+    make_torch_params,
+    torch_symmetry_functions,
+    SymmetryFunctions,
+    collate_positions,
+    PositionsDataset,
+)
+from amptorch.gaussian import SNN_Gaussian
+from amptorch.data_preprocess import TestDataset
+from amptorch.model import FullNN, PositionsNN, CustomMSELoss
+
+
+def make_images():
+    slab = fcc100("Cu", size=(2, 2, 2))
+    ads = molecule("CO")
+    add_adsorbate(slab, ads, 2, offset=(1, 1))
+    slab.center(vacuum=4.0, axis=2)
+    slab.set_pbc(True)
+    slab.rattle(0.05, seed=1)
+    molecule_image = Atoms(
+        "CuCO", [(0, 0, 0), (1.2, 0.3, 0), (0.2, 1.4, 0.4)], cell=[10, 10, 10]
+    )
+    # wrapped across the boundary of a non-periodic cell, which simple_nn
+    # treats as periodic
+    l = 2.0
+    wrapped_image = Atoms(
+        "CuCO",
+        [
+            (-l * np.sin(0.65), l * np.cos(0.65), 0),
+            (0, 0, 0),
+            (l * np.sin(0.65), l * np.cos(0.65), 0),
+        ],
+    )
+    wrapped_image.set_cell([10, 10, 10])
+    wrapped_image.wrap(pbc=True)
+    return [molecule_image, slab, wrapped_image]
+
+
+Gs = {}
+Gs["G2_etas"] = [0.05, 2.0]
+Gs["G2_rs_s"] = [0, 0]
+Gs["G4_etas"] = [0.005]
+Gs["G4_zetas"] = [1.0, 4.0]
+Gs["G4_gammas"] = [1.0, -1.0]
+Gs["cutoff"] = 6.5
+
+
+def test_torch_fp_match():
+    elements = ["Cu", "C", "O"]
+    params_set = make_torch_params(Gs, elements)
+    for image in make_images():
+        x_snn, dx_snn = wrap_symmetry_functions(image, copy.deepcopy(params_set))
+        x_torch, dx_torch = torch_symmetry_functions(image, params_set)
+        for element in elements:
+            assert np.allclose(
+                x_snn[element], x_torch[element], atol=1e-8
+            ), "Fingerprints do not match simple_nn!"
+            assert np.allclose(
+                dx_snn[element], dx_torch[element], atol=1e-8
+            ), "Fingerprint derivatives do not match simple_nn!"
+        periodic_image = image.copy()
+        periodic_image.set_pbc(True)
+        x_periodic, _ = torch_symmetry_functions(periodic_image, params_set)
+        for element in elements:
+            assert np.allclose(
+                x_torch[element], x_periodic[element]
+            ), "Cells are not treated as periodic!"
+
+
+def test_autograd_forces():
+    images = make_images()
+    elements = ["Cu", "C", "O"]
+    fprange = {}
+    params_set = make_torch_params(Gs, elements)
+    for image in images:
+        x, _ = torch_symmetry_functions(image, params_set, calculate_derivatives=False)
+        for element, fps in x.items():
+            ranges = np.stack((fps.min(0), fps.max(0)), axis=1)
+            if element in fprange:
+                ranges[:, 0] = np.minimum(fprange[element][:, 0], ranges[:, 0])
+                ranges[:, 1] = np.maximum(fprange[element][:, 1], ranges[:, 1])
+            fprange[element] = ranges
+    fp_length = params_set["Cu"]["num"]
+
+    dataset = TestDataset(images, elements, SNN_Gaussian, Gs, fprange)
+    model = FullNN(elements, [fp_length, 2, 5], "cpu", forcetraining=True)
+    energies, forces = model(
+        dataset.collate_test([dataset[i] for i in range(len(dataset))])
+    )
+
+    symmetry_functions = SymmetryFunctions(params_set)
+    positions_model = PositionsNN(
+        elements, [fp_length, 2, 5], symmetry_functions, fprange
+    )
+    positions_model.load_state_dict(model.state_dict())
+    positions_model.eval()
+    autograd_energies, autograd_forces = positions_model(
+        collate_positions(images, symmetry_functions)
+    )
+
+    assert torch.allclose(
+        energies, autograd_energies, atol=1e-5
+    ), "Autograd energies do not match!"
+    assert torch.allclose(
+        forces, autograd_forces, atol=1e-5
+    ), "Autograd forces do not match fingerprintprimes forces!"
+
+
+def test_positions_training():
+    images = make_images()
+    for l in [0.9, 1.1]:
+        image = images[0].copy()
+        image.positions *= l
+        images.append(image)
+    for image in images:
+        image.set_calculator(EMT())
+        image.get_potential_energy()
+        image.get_forces()
+
+    dataset = PositionsDataset(images, Gs, prune_tol=1e-6, precision="float64")
+    elements = dataset.elements
+    params_set = make_torch_params(Gs, elements)
+    for element in elements:
+        assert dataset.fprange[element].shape == (params_set[element]["num"], 2)
+        assert dataset.fp_length[element] == dataset.fp_mask[element].sum()
+    assert any(not mask.all() for mask in dataset.fp_mask.values())
+
+    # the masked inputs match those of the fingerprintprimes pipeline
+    test_dataset = TestDataset(
+        images, elements, SNN_Gaussian, Gs, dataset.fprange, fp_mask=dataset.fp_mask,
+        precision="float64"
+    )
+    model = FullNN(
+        elements, [dataset.fp_length, 2, 5], "cpu", forcetraining=True,
+        precision="float64"
+    )
+    energies, forces = model(
+        test_dataset.collate_test([test_dataset[i] for i in range(len(images))])
+    )
+    positions_model = PositionsNN(
+        elements, [dataset.fp_length, 2, 5], dataset.symmetry_functions,
+        dataset.fprange, fp_mask=dataset.fp_mask, precision="float64"
+    )
+    positions_model.load_state_dict(model.state_dict())
+    positions_model.eval()
+    inputs, targets = dataset.collate([dataset[i] for i in range(len(images))])
+    autograd_energies, autograd_forces = positions_model(inputs)
+    assert autograd_energies.dtype == torch.float64
+    assert torch.allclose(energies, autograd_energies, atol=1e-10)
+    assert torch.allclose(forces, autograd_forces, atol=1e-10)
+    assert targets[0].shape == (len(images), 1)
+    assert targets[2].shape == autograd_forces.shape
+
+    # training through the positions dataset
+    torch.manual_seed(0)
+    net = NeuralNetRegressor(
+        module=PositionsNN,
+        module__unique_atoms=elements,
+        module__architecture=[dataset.fp_length, 2, 5],
+        module__symmetry_functions=dataset.symmetry_functions,
+        module__fprange=dataset.fprange,
+        module__fp_mask=dataset.fp_mask,
+        module__precision="float64",
+        criterion=CustomMSELoss,
+        criterion__force_coefficient=0.3,
+        optimizer=torch.optim.Adam,
+        lr=1e-2,
+        batch_size=2,
+        max_epochs=20,
+        iterator_train__collate_fn=dataset.collate,
+        iterator_train__shuffle=True,
+        train_split=None,
+        verbose=0,
+    )
+    net.fit(dataset, None)
+    losses = net.history[:, "train_loss"]
+    assert losses[-1] < losses[0], "Training did not reduce the loss!"
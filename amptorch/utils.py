@@ -1,8 +1,10 @@
 import sys
 import copy
+import json
 import time
 import os
 import pickle
+import itertools
 from pickle import load
 from collections import defaultdict, OrderedDict
 import shutil
@@ -10,7 +12,9 @@ import numpy as np
 from ase import io
 from ase.db import connect
 from simple_nn.features.symmetry_function import Symmetry_function
+from amptorch.profiling import profiler, profiled
 
+@profiled("hash_images")
 def hash_images(images, Gs=None, log=None, ordered=False):
     """ Converts input images -- which may be a list, a trajectory file, or
     a database -- into a dictionary indexed by their hashes.
@@ -38,7 +42,7 @@ def hash_images(images, Gs=None, log=None, ordered=False):
             if extension == ".traj":
                 images = io.Trajectory(images, "r")
             elif extension == ".db":
-                images = [row.toatoms() for row in connect(images, "db").select(None)]
+                images = (row.toatoms() for row in connect(images, "db").select(None))
 
         # images converted to dictionary form; key is hash of image.
         log("Hashing images...", tic="hash")
@@ -61,10 +65,30 @@ def hash_images(images, Gs=None, log=None, ordered=False):
             dict_images[hash] = image
         log(" %i unique images after hashing." % len(dict_images))
         log("...hashing completed.", toc="hash")
+        profiler.count("images_hashed", len(dict_images))
         return dict_images
 
 
-def calculate_fingerprints_range(fp, images):
+def image_chunks(images, chunk_size):
+    """Lazily iterates over images -- which may be a list, a database or a
+    file in any format readable by ase.io.iread, e.g. a trajectory or extxyz
+    file -- in lists of up to chunk_size images. Files are read as the
+    chunks are requested rather than all at once.
+    """
+    if isinstance(images, str):
+        if os.path.splitext(images)[1] == ".db":
+            images = (row.toatoms() for row in connect(images, "db").select(None))
+        else:
+            images = io.iread(images, index=":")
+    images = iter(images)
+    while True:
+        chunk = list(itertools.islice(images, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def calculate_fingerprints_range(fp, images, fprange=None):
     """Calculates the range for the fingerprints corresponding to images,
     stored in fp. fp is a fingerprints object with the fingerprints data
     stored in a dictionary-like object at fp.fingerprints. (Typically this
@@ -73,26 +97,32 @@ def calculate_fingerprints_range(fp, images):
 
     In image-centered mode, returns an array of (min, max) values for each
     fingerprint. In atom-centered mode, returns a dictionary of such
-    arrays, one per element.
+    (P, 2) arrays, one per element. If provided, the ranges of fprange, e.g.
+    those of previously processed images, are extended in place instead.
     """
     if fp.parameters.mode == "image-centered":
         raise NotImplementedError()
     elif fp.parameters.mode == "atom-centered":
-        fprange = {}
+        fprange = {} if fprange is None else fprange
         for hash in images.keys():
             imagefingerprints = fp.fingerprints[hash]
-            for element, fingerprint in imagefingerprints:
+            elements = np.array([element for element, _ in imagefingerprints])
+            for element in np.unique(elements):
+                # element fingerprint lengths may differ, see "species" in Gs
+                element_fps = np.array(
+                    [
+                        fingerprint
+                        for atom, fingerprint in imagefingerprints
+                        if atom == element
+                    ]
+                )
+                ranges = np.stack((element_fps.min(0), element_fps.max(0)), axis=1)
                 if element not in fprange:
-                    fprange[element] = [[_, _] for _ in fingerprint]
+                    fprange[element] = ranges
                 else:
-                    assert len(fprange[element]) == len(fingerprint)
-                    for i, ridge in enumerate(fingerprint):
-                        if ridge < fprange[element][i][0]:
-                            fprange[element][i][0] = ridge
-                        elif ridge > fprange[element][i][1]:
-                            fprange[element][i][1] = ridge
-    for key, value in fprange.items():
-        fprange[key] = value
+                    assert len(fprange[element]) == len(ranges)
+                    fprange[element][:, 0] = np.minimum(fprange[element][:, 0], ranges[:, 0])
+                    fprange[element][:, 1] = np.maximum(fprange[element][:, 1], ranges[:, 1])
     return fprange
 
 
@@ -183,6 +213,8 @@ def reorganize_simple_nn_derivative(image, dx_dict):
                         if (j, syms[j], true_i, element, k) not in d:
                             d[(j, syms[j], true_i, element, k)] = []
                         d[(j, syms[j], true_i, element, k)].append(derivative)
+    for key, derivatives in d.items():
+        d[key] = np.array(derivatives)
     # zero_keys = []
     # for key, derivatives in d.items():
         # zero_check = [a == 0 for a in derivatives]
@@ -217,7 +249,7 @@ def reorganize_simple_nn_fp(image, x_dict):
     for i, sym in enumerate(syms):
         simple_nn_index = sym_dict[sym].index(i)
         fp = x_dict[sym][simple_nn_index]
-        fp_l.append((sym, list(fp)))
+        fp_l.append((sym, fp))
     return fp_l
 
 
@@ -260,6 +292,8 @@ def get_hash(atoms, Gs=None):
         for number in gs_values[4]:
             string += "%.15f" % number
         string += "%.15f" % gs_values[5]
+        if "species" in Gs:
+            string += json.dumps(Gs["species"], sort_keys=True)
 
     md5 = hashlib.md5(string.encode("utf-8"))
     hash = md5.hexdigest()
@@ -452,19 +486,17 @@ def stored_fps(traj, Gs):
 
 def make_amp_descriptors_simple_nn(atoms, Gs, elements, cores, label, save=True):
     """
-    uses simple_nn to make descriptors in the amp format.
-    Only creates the same symmetry functions for each element
-    for now.
+    uses simple_nn to make descriptors in the amp format, including the
+    fingerprint primes. Forwards to
+    amptorch.fp_simple_nn.make_amp_descriptors_simple_nn, and shares its
+    return contract: lists of the fps and fp_primes of every image, in the
+    order of atoms, whether save is True or False.
     """
-    traj, calculated = make_simple_nn_fps(atoms, Gs, elements=elements,
-            label=label, clean_up_directory=True)
-    if calculated:
-        fps, fp_primes = convert_simple_nn_fps(traj, Gs, cores, label, save, delete_old=True)
-        return fps, fp_primes
-    if save is False and calculated is False:
-        fps, fp_primes = stored_fps(atoms, Gs)
-        return fps, fp_primes
-    else: return None, None
+    from amptorch.fp_simple_nn import make_amp_descriptors_simple_nn as make_descriptors
+
+    return make_descriptors(
+        atoms, Gs, elements, forcetraining=True, cores=cores, label=label, save=save
+    )
 
 
 class Logger: